@@ -0,0 +1,182 @@
+import io
+import os
+import time
+import uuid
+import itertools
+from PIL import Image
+
+from lazy_imports import lazy_import
+from resources import register_resource, get_resource
+from storage import get_storage
+from rate_limits import PRIORITY_STANDARD
+from medical_analysis import analyze_medical_image, analyze_medical_image_streaming, split_report_sections
+
+np = lazy_import("numpy")
+
+DEFAULT_THRESHOLD = 6
+# Oldest analyses are evicted once the cache holds more than this many
+MAX_CACHED_ANALYSES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "10000"))
+
+# The 64-bit hash is split into four 16-bit bands. If two hashes differ in at most
+# `threshold` bits, at least one band differs in at most threshold // 4 bits, so
+# probing each band's near neighbours finds every match without a full scan.
+HASH_BITS = 64
+BAND_BITS = 16
+NUM_BANDS = HASH_BITS // BAND_BITS
+
+_DCT_SIZE = 32
+_dct_matrix = None
+
+
+def _get_dct_matrix():
+    # Built on first use so importing this module doesn't load numpy
+    global _dct_matrix
+    if _dct_matrix is None:
+        _dct_matrix = np.array([
+            [np.sqrt((1 if k == 0 else 2) / _DCT_SIZE) * np.cos(np.pi * (2 * n + 1) * k / (2 * _DCT_SIZE))
+             for n in range(_DCT_SIZE)]
+            for k in range(_DCT_SIZE)
+        ])
+    return _dct_matrix
+
+
+def compute_phash(image) -> int:
+    """64-bit DCT perceptual hash, stable under re-saving, recompression and resizing
+
+    image may be a PIL Image or encoded bytes; JPEG bytes are decoded in draft mode.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+        if image.format == "JPEG":
+            image.draft("L", (_DCT_SIZE * 2, _DCT_SIZE * 2))
+    pixels = np.asarray(image.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    dct_matrix = _get_dct_matrix()
+    coefficients = (dct_matrix @ pixels @ dct_matrix.T)[:8, :8].flatten()
+    # Skip the DC term when picking the median so overall brightness doesn't dominate
+    bits = coefficients > np.median(coefficients[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(phash):
+    mask = (1 << BAND_BITS) - 1
+    return [(phash >> (i * BAND_BITS)) & mask for i in range(NUM_BANDS)]
+
+
+def _band_neighbours(value, radius):
+    """Every BAND_BITS-bit value within `radius` bits of value"""
+    yield value
+    for distance in range(1, radius + 1):
+        for positions in itertools.combinations(range(BAND_BITS), distance):
+            flipped = value
+            for position in positions:
+                flipped ^= 1 << position
+            yield flipped
+
+
+class AnalysisCache:
+    """Near-duplicate cache of vision analyses keyed by perceptual hash, analysis type and model
+
+    Entries live in the shared storage backend, so every replica reuses
+    analyses made by the others. Each entry is a hash; its four hash bands are
+    indexed as sets scoped to the analysis type and model. The analysis_entries
+    sorted set orders entries by age so the oldest can be evicted.
+    """
+
+    def __init__(self, backend=None, threshold=DEFAULT_THRESHOLD, max_entries=MAX_CACHED_ANALYSES):
+        self.backend = backend or get_storage()
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+    @staticmethod
+    def _band_key(analysis_type, model, band, value):
+        return f"analysis_band:{analysis_type}:{model}:{band}:{value}"
+
+    def lookup(self, phash, analysis_type, model, threshold=None):
+        """Return (result, distance) for the closest cached analysis within threshold, or None"""
+        threshold = self.threshold if threshold is None else threshold
+        radius = threshold // NUM_BANDS
+        probes = [
+            self._band_key(analysis_type, model, band, neighbour)
+            for band, value in enumerate(_bands(phash))
+            for neighbour in _band_neighbours(value, radius)
+        ]
+        candidates = set().union(*self.backend.smembers_many(probes))
+        best = None
+        entries = self.backend.hgetall_many([f"analysis:{entry_id}" for entry_id in sorted(candidates)])
+        for entry in entries:
+            if not entry:
+                continue
+            distance = hamming_distance(phash, int(entry["phash"]))
+            if distance <= threshold and (best is None or distance < best[1]):
+                best = (entry["result"], distance)
+        return best
+
+    def store(self, phash, analysis_type, model, result):
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        self.backend.hset(f"analysis:{entry_id}", {
+            "phash": phash, "analysis_type": analysis_type, "model": model, "result": result, "created_at": now
+        })
+        for band, value in enumerate(_bands(phash)):
+            self.backend.sadd(self._band_key(analysis_type, model, band, value), entry_id)
+        self.backend.zadd("analysis_entries", entry_id, now)
+        self._evict()
+
+    def _evict(self):
+        """Drop the entries past max_entries, oldest first, along with their band memberships"""
+        expired = self.backend.zrevrange("analysis_entries", offset=self.max_entries)
+        if not expired:
+            return
+        entries = self.backend.hgetall_many([f"analysis:{entry_id}" for entry_id in expired])
+        for entry_id, entry in zip(expired, entries):
+            if entry:
+                for band, value in enumerate(_bands(int(entry["phash"]))):
+                    self.backend.srem(self._band_key(entry["analysis_type"], entry["model"], band, value), entry_id)
+            self.backend.delete(f"analysis:{entry_id}")
+            self.backend.zrem("analysis_entries", entry_id)
+
+    def size(self) -> int:
+        return self.backend.zcard("analysis_entries")
+
+
+register_resource("analysis_cache", AnalysisCache, description="Perceptual-hash analysis cache")
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Return the process-wide analysis cache"""
+    return get_resource("analysis_cache")
+
+
+def cached_analyze_medical_image(image, analysis_type, api_key, model="gpt-4o", threshold=DEFAULT_THRESHOLD,
+                                 use_cache=True, on_section=None, priority=PRIORITY_STANDARD):
+    """analyze_medical_image with a near-duplicate lookup in front of it
+
+    Returns (analysis, stats); stats["cache_hit"] tells whether the vision call was skipped.
+    With on_section, the report is streamed and each section is passed on as soon as
+    it is complete; cached reports are split and passed on immediately.
+    """
+    cache = get_analysis_cache()
+    lookup_start = time.perf_counter()
+    phash = compute_phash(image)
+    if use_cache:
+        hit = cache.lookup(phash, analysis_type, model, threshold)
+        if hit is not None:
+            if on_section:
+                for section in split_report_sections(hit[0]):
+                    on_section(section)
+            return hit[0], {
+                "cache_hit": True,
+                "cache_distance": hit[1],
+                "lookup_seconds": time.perf_counter() - lookup_start
+            }
+    if on_section:
+        analysis, stats = analyze_medical_image_streaming(image, analysis_type, api_key, model, on_section)
+    else:
+        analysis, stats = analyze_medical_image(image, analysis_type, api_key, model, return_stats=True, priority=priority)
+    cache.store(phash, analysis_type, model, analysis)
+    stats["cache_hit"] = False
+    return analysis, stats
@@ -0,0 +1,374 @@
+"""Headless HTTP API over the same functions the Streamlit pages use
+
+    uvicorn api:app --port 8000
+
+Chat, role chat, PDF questions and image analysis answer directly; set
+"stream": true in the request body to receive the reply as server-sent
+events instead. Progression generation runs as a background job on the
+shared job manager and is polled (or followed as events) under /jobs.
+Blocking calls run in worker threads, so the event loop keeps serving other
+requests while the model is answering.
+
+Chat and PDF questions are paid for with the server's OpenAI key. Set
+API_TOKEN to require "Authorization: Bearer <token>" on every endpoint but
+/health. Without it, keep the API bound to localhost (uvicorn's default) or
+behind an authenticating proxy. Analysis and progression use the caller's
+X-OpenAI-Key; only token-authenticated callers may omit it and use the
+server's key.
+"""
+import io
+import os
+import json
+import time
+import queue
+import hmac
+import base64
+import asyncio
+import binascii
+import threading
+from typing import List, Dict, Optional, Literal
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request, Header, Depends
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel, Field
+
+from utils import CHAT_MODEL, get_openai_response, stream_chat_reply
+from role_chat import ROLE_PROMPTS, ROLE_CHAT_MODEL, build_role_messages, get_role_response
+from pdf_qa import (
+    PDF_QA_MODEL, PDF_QA_PARAMS, NO_CONTENT_REPLY, build_pdf_messages, get_pdf_based_response, get_pdf_processor, load_document_texts
+)
+from document_store import get_document_store
+from medical_analysis import MEDICAL_PROMPTS
+from analysis_cache import DEFAULT_THRESHOLD, cached_analyze_medical_image
+from jobs import get_job_manager, ACTIVE_STATES
+from previews import encode_full_resolution
+
+load_dotenv()
+
+API_TOKEN = os.getenv("API_TOKEN", "")
+
+
+async def require_token(request: Request, authorization: Optional[str] = Header(None)):
+    """Reject requests without the bearer token when API_TOKEN is set"""
+    if not API_TOKEN or request.url.path == "/health":
+        return
+    if not hmac.compare_digest(authorization or "", f"Bearer {API_TOKEN}"):
+        raise HTTPException(401, "Pass the API token in an Authorization: Bearer header")
+
+
+app = FastAPI(
+    title="GenAI API",
+    description="Chat, PDF question answering, medical image analysis and progression generation",
+    dependencies=[Depends(require_token)]
+)
+
+# Seconds between job updates on /jobs/{id}/events
+JOB_EVENT_INTERVAL = 1.0
+
+
+class ChatRequest(BaseModel):
+    prompt: str
+    history: List[Dict[str, str]] = []
+    stream: bool = False
+
+
+class PDFQuestion(BaseModel):
+    question: str
+    documents: List[str]
+    history: List[Dict[str, str]] = []
+    stream: bool = False
+
+
+class AnalysisRequest(BaseModel):
+    image_base64: str
+    analysis_type: str = "general_analysis"
+    model: str = "gpt-4o"
+    use_cache: bool = True
+    cache_threshold: int = DEFAULT_THRESHOLD
+    stream: bool = False
+
+
+class ProgressionRequest(BaseModel):
+    condition: str
+    location: str
+    visual_characteristics: str
+    demographics: str = ""
+    # The models and stage counts the progression page offers
+    model: Literal["gpt-4o", "gpt-4o-mini", "gpt-4-turbo"] = "gpt-4o"
+    num_frames: int = Field(5, ge=1, le=8)
+    resume: bool = True
+
+
+def _api_key(header_value):
+    """Analysis and generation take the caller's key, like the pages' sidebar field
+
+    The server's own key is only used for callers authenticated with API_TOKEN.
+    """
+    api_key = header_value or (API_TOKEN and os.getenv("OPENAI_API_KEY"))
+    if not api_key:
+        raise HTTPException(401, "Pass an OpenAI API key in the X-OpenAI-Key header")
+    return api_key
+
+
+def _event_stream(events):
+    """Server-sent events from a (blocking) iterator of dicts; Starlette iterates it in a worker thread"""
+    return StreamingResponse(
+        (f"data: {json.dumps(event, default=str)}\n\n" for event in events),
+        media_type="text/event-stream"
+    )
+
+
+def _stream_reply(messages, model, history, **params):
+    reply = ""
+    try:
+        for delta in stream_chat_reply(messages, model, **params):
+            reply += delta
+            yield {"delta": delta}
+    except Exception as e:
+        yield {"error": str(e)}
+        return
+    yield {"done": True, "reply": reply, "history": history + [{"role": "assistant", "content": reply}]}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.post("/chat")
+async def chat(body: ChatRequest):
+    """Same conversation as the chatbot page"""
+    if body.stream:
+        history = body.history + [{"role": "user", "content": body.prompt}]
+        return _event_stream(_stream_reply(history, CHAT_MODEL, history))
+    try:
+        reply, history = await asyncio.to_thread(get_openai_response, body.prompt, list(body.history))
+    except Exception as e:
+        raise HTTPException(502, f"Error getting response: {str(e)}")
+    return {"reply": reply, "history": history}
+
+
+@app.get("/roles")
+async def list_roles():
+    return {"roles": ROLE_PROMPTS}
+
+
+@app.post("/roles/{role}/chat")
+async def role_chat(role: str, body: ChatRequest):
+    """Chat with one of the role-based assistants"""
+    if role not in ROLE_PROMPTS:
+        raise HTTPException(404, f"Unknown role: {role}")
+    if body.stream:
+        messages = build_role_messages(body.prompt, list(body.history), role)
+        history = body.history + [{"role": "user", "content": body.prompt}]
+        return _event_stream(_stream_reply(messages, ROLE_CHAT_MODEL, history))
+    try:
+        reply, history = await asyncio.to_thread(get_role_response, body.prompt, list(body.history), role)
+    except Exception as e:
+        raise HTTPException(502, f"Error getting response: {str(e)}")
+    return {"reply": reply, "history": history}
+
+
+@app.post("/pdf/documents")
+async def upload_pdf(request: Request, filename: str = "document.pdf"):
+    """Extract (or load from the shared cache) a PDF sent as the raw request body
+
+    The returned document id is the file hash used by /pdf/ask.
+    """
+    data = await request.body()
+    if not data:
+        raise HTTPException(400, "Send the PDF as the request body")
+    try:
+        document, from_cache = await asyncio.to_thread(get_pdf_processor().load_document, io.BytesIO(data), filename)
+    except Exception as e:
+        raise HTTPException(422, str(e))
+    if document is None:
+        raise HTTPException(422, f"No text could be extracted from {filename}")
+    return {
+        "document": document.file_hash, "filename": filename, "pages": document.pages,
+        "words": document.words, "cached": from_cache
+    }
+
+
+def _get_document(document_id):
+    document = get_pdf_processor().get_document(document_id)
+    if document is None:
+        raise HTTPException(404, f"Unknown document: {document_id}")
+    return document
+
+
+def _load_documents(document_ids):
+    return load_document_texts([_get_document(document_id) for document_id in document_ids])
+
+
+@app.get("/pdf/documents/{document_id}/pages/{page}")
+async def get_pdf_page(document_id: str, page: int):
+    """Text of one page of an uploaded document"""
+    document = await asyncio.to_thread(_get_document, document_id)
+    try:
+        text = await asyncio.to_thread(get_document_store().read_page, document.file_hash, page)
+    except Exception as e:
+        raise HTTPException(404, str(e))
+    return {"document": document.file_hash, "page": page, "pages": document.pages, "text": text}
+
+
+@app.post("/pdf/ask")
+async def ask_pdf(body: PDFQuestion):
+    """Answer a question from previously uploaded documents only"""
+    contents = await asyncio.to_thread(_load_documents, body.documents)
+    if body.stream:
+        messages = build_pdf_messages(body.question, contents, list(body.history))
+        if messages is None:
+            return {"reply": NO_CONTENT_REPLY, "history": body.history}
+        history = body.history + [{"role": "user", "content": body.question}]
+        return _event_stream(_stream_reply(messages, PDF_QA_MODEL, history, **PDF_QA_PARAMS))
+    reply, history = await asyncio.to_thread(get_pdf_based_response, body.question, contents, list(body.history))
+    return {"reply": reply, "history": history}
+
+
+def _decode_image(image_base64):
+    try:
+        return base64.b64decode(image_base64, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(400, "image_base64 is not valid base64")
+
+
+def _stream_analysis(image, body, api_key):
+    """Sections as soon as each is complete, then the stats"""
+    sections = queue.Queue()
+    finished = object()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["analysis"], outcome["stats"] = cached_analyze_medical_image(
+                image, body.analysis_type, api_key, body.model,
+                threshold=body.cache_threshold, use_cache=body.use_cache, on_section=sections.put
+            )
+        except Exception as e:
+            outcome["error"] = str(e)
+        finally:
+            sections.put(finished)
+
+    threading.Thread(target=run, name="api-analysis", daemon=True).start()
+    while True:
+        section = sections.get()
+        if section is finished:
+            break
+        yield {"section": section}
+    if "error" in outcome:
+        yield {"error": outcome["error"]}
+    else:
+        yield {"done": True, "stats": outcome["stats"]}
+
+
+@app.post("/analysis")
+async def analyze(body: AnalysisRequest, x_openai_key: Optional[str] = Header(None)):
+    """Medical image analysis with the near-duplicate cache in front, as on the analyser page"""
+    api_key = _api_key(x_openai_key)
+    if body.analysis_type not in MEDICAL_PROMPTS:
+        raise HTTPException(400, f"Unknown analysis type: {body.analysis_type}")
+    image = _decode_image(body.image_base64)
+    if body.stream:
+        return _event_stream(_stream_analysis(image, body, api_key))
+    try:
+        analysis, stats = await asyncio.to_thread(
+            cached_analyze_medical_image, image, body.analysis_type, api_key, body.model,
+            threshold=body.cache_threshold, use_cache=body.use_cache
+        )
+    except Exception as e:
+        raise HTTPException(502, str(e))
+    return {"analysis": analysis, "stats": stats}
+
+
+@app.post("/progression")
+async def start_progression(body: ProgressionRequest, x_openai_key: Optional[str] = Header(None)):
+    """Start the analysis and frame pipeline as a background job"""
+    api_key = _api_key(x_openai_key)
+    disease_info = {
+        "condition": body.condition,
+        "location": body.location,
+        "visual_characteristics": body.visual_characteristics,
+        "demographics": body.demographics
+    }
+    job_id = get_job_manager().submit(
+        "progression_pipeline",
+        disease_info=disease_info,
+        api_key=api_key,
+        model=body.model,
+        num_frames=body.num_frames,
+        resume=body.resume
+    )
+    return {"job": job_id, "status_url": f"/jobs/{job_id}", "events_url": f"/jobs/{job_id}/events"}
+
+
+def _job_summary(job):
+    """JSON view of a job; frames are returned as URLs rather than images"""
+    summary = {
+        field: job[field] for field in
+        ("id", "job_type", "status", "progress", "message", "error", "created_at", "updated_at")
+    }
+    data = job["result"] or job["partial"]
+    if job["job_type"] == "progression_pipeline":
+        summary["analysis"] = data.get("analysis")
+        summary["errors"] = data.get("errors", [])
+        summary["frames"] = [
+            {
+                "stage": frame["stage"],
+                "stage_number": frame["stage_number"],
+                "url": f"/jobs/{job['id']}/frames/{frame['stage_number']}"
+            }
+            for frame in data.get("frames", [])
+        ]
+    return summary
+
+
+def _poll(job_id):
+    job = get_job_manager().poll(job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown job: {job_id}")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return _job_summary(await asyncio.to_thread(_poll, job_id))
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    await asyncio.to_thread(_poll, job_id)
+    await asyncio.to_thread(get_job_manager().cancel, job_id)
+    return {"job": job_id, "cancel_requested": True}
+
+
+@app.get("/jobs/{job_id}/frames/{stage_number}")
+async def get_frame(job_id: str, stage_number: int):
+    """A labelled progression frame as PNG"""
+    job = await asyncio.to_thread(_poll, job_id)
+    data = job["result"] or job["partial"]
+    for frame in data.get("frames", []):
+        if frame["stage_number"] == stage_number:
+            png = await asyncio.to_thread(encode_full_resolution, frame["image"])
+            return Response(png, media_type="image/png")
+    raise HTTPException(404, f"Stage {stage_number} is not ready")
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent job updates whenever the job changes, until it finishes"""
+    await asyncio.to_thread(_poll, job_id)
+
+    def updates():
+        last_update = None
+        while True:
+            job = get_job_manager().poll(job_id)
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                yield _job_summary(job)
+            if job["status"] not in ACTIVE_STATES:
+                return
+            time.sleep(JOB_EVENT_INTERVAL)
+
+    return _event_stream(updates())
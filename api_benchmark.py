@@ -0,0 +1,143 @@
+"""Throughput of the HTTP API against the Streamlit chat page
+
+Both paths answer the same chat messages through the same get_openai_response,
+with the OpenAI client replaced by a stand-in that waits a fixed latency and
+echoes the prompt, so the numbers show framework and rerun overhead rather
+than model speed. Nothing is sent to OpenAI.
+
+    python api_benchmark.py                              # 50 messages, 8 concurrent API clients
+    python api_benchmark.py --requests 200 --latency 0.5 --json
+
+The Streamlit path drives app.py through Streamlit's script runner exactly as
+a browser session would: every message re-executes the page and reruns it
+once more to show the reply. A session handles one message at a time, so it
+is measured sequentially; the API is measured both sequentially and with
+concurrent clients.
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from types import SimpleNamespace
+
+from resources import override_resource
+from rate_limits import RequestScheduler
+
+
+class _FakeCompletions:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, model, messages, stream=False, **params):
+        time.sleep(self.latency)
+        reply = f"Echo: {messages[-1]['content'][:60]}"
+        if stream:
+            return iter([
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+                for word in reply.split()
+            ])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=reply))],
+            usage=SimpleNamespace(total_tokens=len(reply) // 4)
+        )
+
+
+def install_fake_openai(latency):
+    """Replace the OpenAI client and the request scheduler with an echoing stand-in and an unthrottled queue"""
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=_FakeCompletions(latency)))
+    override_resource("openai_client", lambda: fake_client, description="Benchmark stand-in for OpenAI")
+    override_resource(
+        "request_scheduler",
+        lambda: RequestScheduler({"default": {"rpm": 10 ** 9, "tpm": None}}),
+        description="Unthrottled scheduler for benchmarks"
+    )
+
+
+def summarize(latencies, wall_seconds):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "wall_seconds": wall_seconds,
+        "requests_per_second": len(ordered) / wall_seconds if wall_seconds else 0.0,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000
+    }
+
+
+def bench_streamlit(messages):
+    """Send each message through the chatbot page's form in one script-runner session"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file("app.py", default_timeout=60).run()
+    latencies = []
+    start_time = time.perf_counter()
+    for message in messages:
+        request_start = time.perf_counter()
+        app.text_input[0].input(message)
+        app.button[0].click().run()
+        latencies.append(time.perf_counter() - request_start)
+        if app.exception:
+            raise Exception(f"Error in app.py: {app.exception[0].value}")
+    return summarize(latencies, time.perf_counter() - start_time)
+
+
+async def _bench_api(messages, concurrency):
+    import httpx
+    from api import app, API_TOKEN
+
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send(client, message):
+        async with slots:
+            request_start = time.perf_counter()
+            response = await client.post("/chat", json={"prompt": message})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - request_start)
+
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Authorization": f"Bearer {API_TOKEN}"} if API_TOKEN else {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60, headers=headers) as client:
+        start_time = time.perf_counter()
+        await asyncio.gather(*(send(client, message) for message in messages))
+        return summarize(latencies, time.perf_counter() - start_time)
+
+
+def bench_api(messages, concurrency):
+    """POST each message to /chat in-process, with up to concurrency requests in flight"""
+    return asyncio.run(_bench_api(messages, concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chat throughput of the HTTP API and the Streamlit page")
+    parser.add_argument("--requests", type=int, default=50, help="Messages sent on each path")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent API clients")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds the stand-in model takes per reply")
+    parser.add_argument("--skip-streamlit", action="store_true", help="Only measure the API")
+    parser.add_argument("--json", action="store_true", help="Print raw results as JSON")
+    args = parser.parse_args()
+
+    install_fake_openai(args.latency)
+    messages = [f"Benchmark message {i}" for i in range(args.requests)]
+    results = {}
+    if not args.skip_streamlit:
+        results["streamlit"] = bench_streamlit(messages)
+    results["api_sequential"] = bench_api(messages, 1)
+    results[f"api_concurrent_{args.concurrency}"] = bench_api(messages, args.concurrency)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print(f"{args.requests} chat messages, stand-in model latency {args.latency * 1000:.0f} ms")
+    for name, result in results.items():
+        print(
+            f"{name:>20}: {result['requests_per_second']:7.1f} req/s  "
+            f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  ({result['wall_seconds']:.1f}s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
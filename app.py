@@ -1,7 +1,12 @@
 import streamlit as st
 from utils import get_openai_response
+from rate_limits import describe_wait, PRIORITY_INTERACTIVE
+from resources import get_registry, process_resident_bytes
+from session_store import get_process_memory_usage
+from rerun_profiler import start_rerun_profile, profile_section, finish_rerun_profile
 
 st.set_page_config(page_title="GenAI Chatbot", page_icon="🤖")
+start_rerun_profile(__file__)
 st.title("🧠 Generative AI Chatbot")
 
 # Initialize session
@@ -11,17 +16,18 @@ if "input_key" not in st.session_state:
     st.session_state.input_key = 0
 
 # Display chat history first
-if st.session_state.chat_history:
-    st.subheader("💬 Conversation History")
-    for message in st.session_state.chat_history:
-        if message["role"] == "user":
-            with st.chat_message("user"):
-                st.write(message['content'])
-        else:
-            with st.chat_message("assistant"):
-                st.write(message['content'])
-else:
-    st.info("👋 Welcome! Start a conversation by typing a message below.")
+with profile_section("render history"):
+    if st.session_state.chat_history:
+        st.subheader("💬 Conversation History")
+        for message in st.session_state.chat_history:
+            if message["role"] == "user":
+                with st.chat_message("user"):
+                    st.write(message['content'])
+            else:
+                with st.chat_message("assistant"):
+                    st.write(message['content'])
+    else:
+        st.info("👋 Welcome! Start a conversation by typing a message below.")
 
 # Chat interface with form to handle submission properly
 with st.form(key="chat_form", clear_on_submit=True):
@@ -29,7 +35,9 @@ with st.form(key="chat_form", clear_on_submit=True):
     submit_button = st.form_submit_button("Send 🚀")
 
 if submit_button and user_input and user_input.strip():
-    with st.spinner("🤔 Thinking..."):
+    # Requests wait their turn when the model is at its rate limit
+    wait_note = describe_wait("gpt-4", PRIORITY_INTERACTIVE)
+    with st.spinner(f"🤔 Thinking... ({wait_note})" if wait_note else "🤔 Thinking..."), profile_section("chat request"):
         try:
             response, updated_history = get_openai_response(user_input, st.session_state.chat_history)
             st.session_state.chat_history = updated_history
@@ -37,4 +45,21 @@ if submit_button and user_input and user_input.strip():
             st.rerun()  # Refresh the page to show the new messages
         except Exception as e:
             st.error(f"❌ Error: {str(e)}")
-            st.error("Please check your OpenAI API key and internet connection.")
\ No newline at end of file
+            st.error("Please check your OpenAI API key and internet connection.")
+
+# Process-wide resources shared by every session
+with st.sidebar.expander("🧰 Shared Resources"), profile_section("shared resources"):
+    megabyte = 1024 * 1024
+    resident = process_resident_bytes()
+    if resident is not None:
+        st.metric("Process Memory", f"{resident / megabyte:,.0f} MB")
+    sessions = get_process_memory_usage()
+    st.caption(f"{sessions['sessions']} sessions holding {sessions['resident_bytes'] / megabyte:,.1f} MB in memory")
+    for resource in get_registry().memory_report():
+        if resource['loaded']:
+            size = "size unknown" if resource['bytes'] is None else f"{resource['bytes'] / megabyte:,.1f} MB"
+            st.markdown(f"✅ **{resource['name']}**: {size}, loaded in {resource['load_seconds']:.2f}s")
+        else:
+            st.markdown(f"⏸️ **{resource['name']}**: not loaded")
+
+finish_rerun_profile(st.sidebar.caption)
@@ -0,0 +1,203 @@
+import os
+import io
+import csv
+import json
+import time
+import hashlib
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from analysis_cache import cached_analyze_medical_image
+from rate_limits import PRIORITY_BATCH
+
+BATCH_DIR = "batch_results"
+# Server-side input paths are only accepted when this is set, and only inside it
+SERVER_INPUT_ROOT = os.getenv("SERVER_INPUT_ROOT", "")
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif', '.webp'}
+CSV_FIELDS = [
+    "name", "sha1", "status", "analysis_type", "model", "seconds", "payload_bytes", "cache_hit", "analysis", "error"
+]
+
+
+def get_batch_id(source, analysis_type, model) -> str:
+    """Stable id for a batch so re-running the same input resumes its results file"""
+    digest = hashlib.sha1(f"{analysis_type}:{model}:".encode())
+    if os.path.isdir(source):
+        digest.update(os.path.abspath(source).encode())
+    else:
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def resolve_server_path(path) -> str:
+    """Resolve a path entered by a user against SERVER_INPUT_ROOT, refusing anything outside it"""
+    if not SERVER_INPUT_ROOT:
+        raise Exception("Server paths are disabled; set SERVER_INPUT_ROOT to allow them")
+    root = os.path.realpath(SERVER_INPUT_ROOT)
+    # Symlinks and ".." are resolved before the check, so neither can step outside the root
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise Exception(f"Path is outside the server input folder: {path}")
+    return resolved
+
+
+def save_uploaded_archive(data: bytes) -> str:
+    """Persist an uploaded zip so the batch can be resumed later"""
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    path = os.path.join(BATCH_DIR, f"input_{hashlib.sha1(data).hexdigest()[:16]}.zip")
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
+
+
+def _is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def count_batch_images(source) -> int:
+    """Count images in a batch source without reading them"""
+    if os.path.isdir(source):
+        return sum(1 for _, _, files in os.walk(source) for filename in files if _is_image_name(filename))
+    with zipfile.ZipFile(source) as archive:
+        return sum(
+            1 for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/") and _is_image_name(info.filename)
+        )
+
+
+def iter_batch_images(source):
+    """Yield (name, bytes) for every image in a directory tree or zip archive, one at a time"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                if _is_image_name(filename):
+                    path = os.path.join(root, filename)
+                    with open(path, 'rb') as f:
+                        yield os.path.relpath(path, source), f.read()
+    else:
+        with zipfile.ZipFile(source) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                    continue
+                if _is_image_name(info.filename):
+                    yield info.filename, archive.read(info)
+
+
+def load_batch_results(results_path):
+    """Load the records written so far, keyed by (name, sha1); later lines win"""
+    records = {}
+    if os.path.exists(results_path):
+        with open(results_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A partially written last line from an interrupted run
+                    continue
+                records[(record["name"], record["sha1"])] = record
+    return records
+
+
+def _analyze_one(name, data, sha1, analysis_type, api_key, model):
+    start_time = time.perf_counter()
+    record = {"name": name, "sha1": sha1, "analysis_type": analysis_type, "model": model}
+    try:
+        # Queued behind interactive requests when the model is at its rate limit
+        analysis, stats = cached_analyze_medical_image(data, analysis_type, api_key, model, priority=PRIORITY_BATCH)
+        record.update(
+            status="ok", analysis=analysis, payload_bytes=stats.get("payload_bytes"),
+            cache_hit=stats["cache_hit"], error=None
+        )
+    except Exception as e:
+        record.update(status="error", analysis=None, payload_bytes=None, cache_hit=False, error=str(e))
+    record["seconds"] = round(time.perf_counter() - start_time, 3)
+    return record
+
+
+def run_batch_analysis(source, analysis_type, api_key, model, results_path, max_workers=4,
+                       on_result=None, should_stop=None):
+    """Analyze every image in source concurrently, appending each result to a JSONL file
+
+    Images that already have a successful record in results_path are skipped, so an
+    interrupted batch resumes where it stopped. At most 2 * max_workers images are
+    held in memory at a time.
+    """
+    completed = {key for key, record in load_batch_results(results_path).items() if record["status"] == "ok"}
+    os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+    write_lock = threading.Lock()
+
+    with open(results_path, 'a+', encoding='utf-8') as results_file:
+        # Terminate a line left half-written by an interrupted run
+        if results_file.tell() > 0:
+            results_file.seek(results_file.tell() - 1)
+            if results_file.read(1) != "\n":
+                results_file.write("\n")
+
+        def handle(futures):
+            for future in futures:
+                record = future.result()
+                with write_lock:
+                    results_file.write(json.dumps(record) + "\n")
+                    results_file.flush()
+                if on_result:
+                    on_result(record)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            for name, data in iter_batch_images(source):
+                if should_stop and should_stop():
+                    break
+                sha1 = hashlib.sha1(data).hexdigest()
+                if (name, sha1) in completed:
+                    continue
+                pending.add(executor.submit(_analyze_one, name, data, sha1, analysis_type, api_key, model))
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    handle(done)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                handle(done)
+    return results_path
+
+
+def export_batch_csv(results_path) -> bytes:
+    """Export the latest record for each image as CSV"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for record in load_batch_results(results_path).values():
+        writer.writerow(record)
+    return buffer.getvalue().encode('utf-8')
+
+
+def export_batch_jsonl(results_path) -> bytes:
+    """Export the latest record for each image as JSONL"""
+    records = load_batch_results(results_path).values()
+    return "".join(json.dumps(record) + "\n" for record in records).encode('utf-8')
+
+
+def batch_analysis_job(ctx, source, analysis_type, api_key, model, results_path, max_workers=4):
+    """Background job: run a resumable batch analysis, publishing a row per finished image"""
+    total = count_batch_images(source)
+    rows = {}
+
+    def on_result(record):
+        rows[record["name"]] = {key: record.get(key) for key in ("name", "status", "seconds", "error")}
+        ctx.publish('rows', list(rows.values()))
+        finished = sum(1 for row in rows.values() if row["status"] == "ok")
+        ctx.report_progress(finished, total, f"{finished}/{total} images analyzed")
+
+    for record in load_batch_results(results_path).values():
+        on_result(record)
+
+    run_batch_analysis(
+        source, analysis_type, api_key, model, results_path, max_workers,
+        on_result=on_result, should_stop=ctx.cancelled
+    )
+    ctx.check_cancelled()
+    return results_path
@@ -0,0 +1,408 @@
+"""Micro-benchmarks for the CPU-bound hot paths
+
+Every benchmark runs on synthetic fixtures generated the same way on every
+run (a multi-hundred-page text PDF, 1024px progression frames, populated
+caches and indexes), so results are comparable between commits. Network
+calls are never made.
+
+    python benchmarks.py                     # run everything, compare with the baseline if there is one
+    python benchmarks.py -k pdf -k frame     # only benchmarks whose name contains "pdf" or "frame"
+    python benchmarks.py --save-baseline     # record this machine's numbers as the baseline
+    python benchmarks.py --check             # exit 1 if a benchmark regressed past the tolerance
+    python benchmarks.py --output results.json
+
+Baselines are machine specific: record one on the machine that runs the
+comparison, before the change being measured.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import statistics
+import tempfile
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(ROOT_DIR, "benchmark_baseline.json")
+# A benchmark regresses when its median is this much slower than the baseline
+DEFAULT_TOLERANCE = float(os.getenv("BENCHMARK_TOLERANCE", "0.25"))
+DEFAULT_REPEAT = 5
+
+PDF_PAGES = 300
+FRAME_SIDE = 1024
+NUM_FRAMES = 5
+CACHE_ENTRIES = 2000
+LIBRARY_REPORTS = 1000
+LIBRARY_IMAGES = 300
+
+_WORDS = (
+    "lesion patient tissue margin dermal benign malignant stage progression cell biopsy "
+    "clinical observed irregular border pigment diameter evolving symmetry treatment follow "
+    "imaging contrast region inflammation edema chronic acute marker sample report findings"
+).split()
+
+
+def build_text_pdf(num_pages=PDF_PAGES, lines_per_page=45, seed=0) -> bytes:
+    """A valid PDF of num_pages pages of seeded pseudo-random text, written without a PDF library"""
+    rng = random.Random(seed)
+    bodies = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    }
+    page_ids = []
+    next_id = 4
+    for _ in range(num_pages):
+        lines = [" ".join(rng.choice(_WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        stream = ("BT /F1 10 Tf 50 780 Td 14 TL " + " ".join(f"({line}) '" for line in lines) + " ET").encode('latin-1')
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        bodies[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        bodies[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        page_ids.append(page_id)
+    bodies[2] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>".encode()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in range(1, next_id):
+        offsets[object_id] = out.tell()
+        out.write(b"%d 0 obj\n" % object_id + bodies[object_id] + b"\nendobj\n")
+    xref_offset = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % next_id)
+    for object_id in range(1, next_id):
+        out.write(b"%010d 00000 n \n" % offsets[object_id])
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (next_id, xref_offset))
+    return out.getvalue()
+
+
+def build_frame(index, side=FRAME_SIDE):
+    """A seeded RGB frame with gradients and shapes, so encoders see realistic rather than flat content"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(index)
+    image = Image.merge("RGB", (
+        Image.linear_gradient("L").resize((side, side)),
+        Image.radial_gradient("L").resize((side, side)),
+        Image.linear_gradient("L").rotate(90).resize((side, side))
+    ))
+    draw = ImageDraw.Draw(image)
+    for _ in range(150):
+        x, y = rng.randrange(side), rng.randrange(side)
+        radius = rng.randrange(4, side // 8)
+        draw.ellipse(
+            [x - radius, y - radius, x + radius, y + radius],
+            fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        )
+    return image
+
+
+class Fixtures:
+    """Fixtures built on first use and shared by every benchmark in a run"""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self._cache = {}
+
+    def _get(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    @property
+    def pdf_bytes(self):
+        return self._get("pdf_bytes", build_text_pdf)
+
+    @property
+    def frames(self):
+        return self._get("frames", lambda: [build_frame(i) for i in range(NUM_FRAMES)])
+
+    @property
+    def backend(self):
+        from storage import SQLiteBackend
+        return self._get("backend", lambda: SQLiteBackend(os.path.join(self.workdir, "benchmark_state.db")))
+
+    def path(self, name):
+        return os.path.join(self.workdir, name)
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register setup(fixtures) -> callable; the callable is what gets timed"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@benchmark("pdf.extract_text")
+def _pdf_extract_text(fixtures):
+    from pdf_qa import PDFProcessor
+    processor = PDFProcessor(fixtures.backend)
+    data = fixtures.pdf_bytes
+    return lambda: processor.extract_text_from_pdf(io.BytesIO(data))
+
+
+@benchmark("pdf.file_hash")
+def _pdf_file_hash(fixtures):
+    from pdf_qa import PDFProcessor
+    processor = PDFProcessor(fixtures.backend)
+    pdf_file = io.BytesIO(fixtures.pdf_bytes)
+    return lambda: processor.get_file_hash(pdf_file)
+
+
+def _pdf_text():
+    # Stands in for extracted text when PyPDF2 isn't needed for the benchmark itself
+    rng = random.Random(1)
+    return "".join(
+        f"\n--- Page {page} ---\n" + " ".join(rng.choice(_WORDS) for _ in range(540)) + "\n"
+        for page in range(1, PDF_PAGES + 1)
+    )
+
+
+@benchmark("pdf.cache_store")
+def _pdf_cache_store(fixtures):
+    from pdf_qa import PDFProcessor
+    processor = PDFProcessor(fixtures.backend)
+    text = _pdf_text()
+    return lambda: processor.cache_pdf_content("benchmark-store", text, "benchmark.pdf")
+
+
+@benchmark("pdf.cache_load")
+def _pdf_cache_load(fixtures):
+    from pdf_qa import PDFProcessor
+    processor = PDFProcessor(fixtures.backend)
+    processor.cache_pdf_content("benchmark-load", _pdf_text(), "benchmark.pdf")
+    return lambda: processor.load_cached_content("benchmark-load")
+
+
+def _document_store(fixtures):
+    from pdf_qa import PDFProcessor
+    from document_store import DocumentStore
+    documents = DocumentStore(fixtures.backend, fixtures.path("document_store"))
+    text = _pdf_text()
+    PDFProcessor(fixtures.backend, documents).cache_pdf_content("benchmark-document", text, "benchmark.pdf")
+    documents.add("benchmark-document", "benchmark.pdf", text)
+    return documents
+
+
+@benchmark("pdf.document_page")
+def _pdf_document_page(fixtures):
+    documents = _document_store(fixtures)
+    page = PDF_PAGES // 2
+    return lambda: documents.read_page("benchmark-document", page)
+
+
+@benchmark("pdf.document_text")
+def _pdf_document_text(fixtures):
+    documents = _document_store(fixtures)
+    return lambda: documents.read_text("benchmark-document")
+
+
+@benchmark("frame.add_stage_label")
+def _add_stage_label(fixtures):
+    from progression import add_stage_label
+    frame = fixtures.frames[0]
+    return lambda: add_stage_label(frame, "Stage 3: Moderate progression - clear manifestation of symptoms")
+
+
+@benchmark("frame.encode_base64.progression")
+def _encode_progression(fixtures):
+    from progression import encode_image_to_base64
+    frame = fixtures.frames[0]
+    return lambda: encode_image_to_base64(frame)
+
+
+@benchmark("frame.encode_base64.medical_analysis")
+def _encode_medical(fixtures):
+    from medical_analysis import encode_image_to_base64
+    frame = fixtures.frames[0]
+    return lambda: encode_image_to_base64(frame)
+
+
+@benchmark("frame.prepare_for_vision")
+def _prepare_for_vision(fixtures):
+    from medical_analysis import prepare_image_for_vision
+    frame = fixtures.frames[0]
+    return lambda: prepare_image_for_vision(frame, "skin_analysis", measure_baseline=False)
+
+
+@benchmark("frame.prepare_for_vision.xray")
+def _prepare_xray_for_vision(fixtures):
+    from medical_analysis import prepare_image_for_vision
+    # A 16-bit radiograph, which goes through windowing and the PNG path
+    radiograph = fixtures.frames[0].convert("L").convert("I").point(lambda value: value * 257).convert("I;16")
+    return lambda: prepare_image_for_vision(radiograph, "xray_analysis", measure_baseline=False)
+
+
+@benchmark("video.create_from_frames")
+def _create_video(fixtures):
+    from progression import create_video_from_frames
+    frames = [{"image": image, "stage": f"Stage {i + 1}", "stage_number": i + 1} for i, image in enumerate(fixtures.frames)]
+    output_path = fixtures.path("benchmark.mp4")
+    return lambda: create_video_from_frames(frames, 2, output_path)
+
+
+@benchmark("retrieval.compute_phash")
+def _compute_phash(fixtures):
+    from analysis_cache import compute_phash
+    frame = fixtures.frames[0]
+    return lambda: compute_phash(frame)
+
+
+@benchmark("retrieval.analysis_cache_lookup")
+def _analysis_cache_lookup(fixtures):
+    from analysis_cache import AnalysisCache
+    cache = AnalysisCache(fixtures.backend)
+    rng = random.Random(2)
+    hashes = [rng.getrandbits(64) for _ in range(CACHE_ENTRIES)]
+    for phash in hashes:
+        cache.store(phash, "skin_analysis", "gpt-4o", "cached report")
+    # Near duplicates of stored entries: a few bits flipped in each
+    probes = [phash ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for phash in hashes[:20]]
+    return lambda: [cache.lookup(probe, "skin_analysis", "gpt-4o") for probe in probes]
+
+
+@benchmark("retrieval.report_search")
+def _report_search(fixtures):
+    from report_store import ReportStore
+    store = ReportStore(fixtures.path("benchmark_reports.db"))
+    rng = random.Random(3)
+    for i in range(LIBRARY_REPORTS):
+        body = " ".join(rng.choice(_WORDS) for _ in range(300))
+        store.save(body, "medical_analysis", analysis_type="skin_analysis", model="gpt-4o", created_at=1_700_000_000 + i)
+    return lambda: [store.search(query, limit=20) for query in ("lesion border", "malignant", "pigment* stage")]
+
+
+@benchmark("retrieval.image_library_search")
+def _image_library_search(fixtures):
+    from PIL import Image
+    from image_library import ImageLibrary
+    library = ImageLibrary(fixtures.backend)
+    rng = random.Random(4)
+    for i in range(LIBRARY_IMAGES):
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8), (i % 256, i // 256, rng.randrange(256))).save(buffer, format="PNG")
+        library.add(buffer.getvalue(), " ".join(rng.choice(_WORDS) for _ in range(10)), model="dall-e-3")
+    return lambda: [library.search(query) for query in ("lesion", "clin*", "tissue margin")]
+
+
+def measure(run, repeat=DEFAULT_REPEAT, warmup=1):
+    """Time run() repeat times after warmup calls"""
+    for _ in range(warmup):
+        run()
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start_time)
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "mean": statistics.mean(times),
+        "repeat": repeat
+    }
+
+
+def run_benchmarks(names, repeat=DEFAULT_REPEAT):
+    """Run the named benchmarks; one with a missing dependency is reported as skipped"""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="benchmarks-") as workdir:
+        fixtures = Fixtures(workdir)
+        for name in names:
+            try:
+                run = BENCHMARKS[name](fixtures)
+            except ImportError as e:
+                results[name] = {"skipped": str(e)}
+                continue
+            results[name] = measure(run, repeat)
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.node(),
+            "fixtures": hashlib.sha1(
+                f"{PDF_PAGES}:{FRAME_SIDE}:{NUM_FRAMES}:{CACHE_ENTRIES}:{LIBRARY_REPORTS}:{LIBRARY_IMAGES}".encode()
+            ).hexdigest()[:12]
+        },
+        "results": results
+    }
+
+
+def compare(run, baseline, tolerance=DEFAULT_TOLERANCE):
+    """One row per benchmark present in both, with the median ratio and whether it regressed"""
+    rows = []
+    for name, result in run["results"].items():
+        base = baseline["results"].get(name, {})
+        if "median" not in result or "median" not in base:
+            continue
+        ratio = result["median"] / base["median"] if base["median"] else float("inf")
+        rows.append({
+            "name": name,
+            "baseline": base["median"],
+            "current": result["median"],
+            "ratio": ratio,
+            "regressed": ratio > 1 + tolerance
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the micro-benchmarks and compare them with a baseline")
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="Only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per benchmark")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON to compare with or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown, e.g. 0.25 for 25%%")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 if any benchmark regressed")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.filters or any(f in name for f in args.filters)]
+    run = run_benchmarks(names, args.repeat)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    rows = {row["name"]: row for row in compare(run, baseline, args.tolerance)} if baseline else {}
+    if baseline and baseline["meta"].get("fixtures") != run["meta"]["fixtures"]:
+        print("warning: baseline was recorded with different fixtures", file=sys.stderr)
+
+    for name, result in run["results"].items():
+        if "skipped" in result:
+            print(f"{name:40} skipped ({result['skipped']})")
+            continue
+        line = f"{name:40} {result['median'] * 1000:10.2f} ms median  {result['min'] * 1000:10.2f} ms min"
+        row = rows.get(name)
+        if row:
+            line += f"  {row['ratio']:5.2f}x baseline" + ("  REGRESSED" if row["regressed"] else "")
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    regressed = [name for name, row in rows.items() if row["regressed"]]
+    if regressed:
+        print(f"{len(regressed)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressed)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
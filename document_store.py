@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import mmap
+import uuid
+import threading
+from collections import OrderedDict, namedtuple
+
+from resources import register_resource, get_resource
+from storage import get_storage
+
+DOCUMENT_STORE_DIR = os.getenv("DOCUMENT_STORE_DIR", "document_store")
+# Documents kept memory-mapped at once; the least recently read are unmapped beyond it
+MAX_OPEN_DOCUMENTS = int(os.getenv("MAX_OPEN_DOCUMENTS", "64"))
+
+# What session state keeps instead of a document's text
+DocumentRef = namedtuple("DocumentRef", ["file_hash", "filename", "pages", "words", "nbytes"])
+
+# Page headers written by PDFProcessor.extract_text_from_pdf
+_PAGE_HEADER = re.compile(rb"\n--- Page (\d+) ---\n")
+
+
+def index_pages(data: bytes):
+    """[(page_number, start, end, words)] for each page of extracted text, as byte offsets into data
+
+    Text without page headers is indexed as a single page.
+    """
+    headers = list(_PAGE_HEADER.finditer(data))
+    if not headers:
+        return [(1, 0, len(data), len(data.split()))]
+    pages = []
+    for i, header in enumerate(headers):
+        start = header.end()
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(data)
+        # Each page body ends with the newline written after it
+        if end > start and data[end - 1:end] == b"\n":
+            end -= 1
+        pages.append((int(header.group(1)), start, end, len(data[start:end].split())))
+    return pages
+
+
+class DocumentStore:
+    """Page-indexed access to extracted document texts, shared by every session
+
+    The text itself is stored once, in the shared storage backend under
+    pdf_text:{file_hash}; source(file_hash) returns it. The page index and
+    word counts are computed once when a document is added and kept in the
+    backend beside it; sessions only hold DocumentRefs. Each host writes a
+    local copy of a text the first time it is read and memory-maps it, so any
+    page can be sliced out by its offsets without loading the whole document.
+    The directory is only a cache and is rebuilt from the backend when missing.
+    """
+
+    def __init__(self, backend=None, directory=DOCUMENT_STORE_DIR, max_open=MAX_OPEN_DOCUMENTS, source=None):
+        self.backend = backend or get_storage()
+        self.directory = directory
+        self.max_open = max_open
+        self.source = source or self._load_pdf_text
+        self._lock = threading.Lock()
+        self._maps = OrderedDict()
+        # Page indexes never change once written, so each is parsed once per process
+        self._indexes = {}
+
+    def _path(self, file_hash):
+        return os.path.join(self.directory, file_hash[:2], f"{file_hash}.txt")
+
+    def _load_pdf_text(self, file_hash):
+        # Imported here, as pdf_qa builds on this module
+        from pdf_qa import PDFProcessor
+        cached_data = PDFProcessor(self.backend, self).load_cached_content(file_hash)
+        return cached_data['content'] if cached_data else None
+
+    def add(self, file_hash, filename, text) -> DocumentRef:
+        """Index a stored document's text unless it is already indexed, and return its reference"""
+        ref = self.get(file_hash)
+        if ref is not None:
+            return ref._replace(filename=filename)
+
+        data = text.encode('utf-8')
+        pages = index_pages(data)
+        words = sum(page[3] for page in pages)
+        self.backend.hset(f"document:{file_hash}", {
+            "filename": filename, "pages": len(pages), "words": words, "bytes": len(data),
+            "index": json.dumps(pages)
+        })
+        return DocumentRef(file_hash, filename, len(pages), words, len(data))
+
+    def get(self, file_hash):
+        """Reference to an indexed document, or None if it was never added"""
+        record = self.backend.hgetall(f"document:{file_hash}")
+        if not record:
+            return None
+        return DocumentRef(file_hash, record["filename"], int(record["pages"]), int(record["words"]), int(record["bytes"]))
+
+    def page_index(self, file_hash):
+        """[(page_number, start, end, words)] for a stored document"""
+        index = self._indexes.get(file_hash)
+        if index is None:
+            record = self.backend.hgetall(f"document:{file_hash}")
+            if not record:
+                raise Exception(f"Document {file_hash} is not in the document store")
+            index = [tuple(page) for page in json.loads(record["index"])]
+            self._indexes[file_hash] = index
+        return index
+
+    def _write_local_copy(self, file_hash, path):
+        text = self.source(file_hash)
+        if text is None:
+            raise Exception(f"Document {file_hash} is no longer in the shared storage")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        os.replace(tmp_path, path)
+
+    def pages(self, file_hash):
+        """Page numbers of a stored document, in order; pages whose text couldn't be extracted are missing"""
+        return [page[0] for page in self.page_index(file_hash)]
+
+    def _read(self, file_hash, start, end) -> bytes:
+        with self._lock:
+            mapped = self._maps.get(file_hash)
+            if mapped is None:
+                path = self._path(file_hash)
+                if not os.path.exists(path):
+                    self._write_local_copy(file_hash, path)
+                if os.path.getsize(path) == 0:
+                    return b""
+                with open(path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[file_hash] = mapped
+                while len(self._maps) > self.max_open:
+                    _, evicted = self._maps.popitem(last=False)
+                    evicted.close()
+            else:
+                self._maps.move_to_end(file_hash)
+            return mapped[start:end]
+
+    def read_page(self, file_hash, page_number) -> str:
+        """Text of one page, numbered from 1"""
+        pages = self.page_index(file_hash)
+        # Pages are normally numbered in order, so the position is tried first
+        if 1 <= page_number <= len(pages) and pages[page_number - 1][0] == page_number:
+            page = pages[page_number - 1]
+        else:
+            page = next((page for page in pages if page[0] == page_number), None)
+        if page is None:
+            raise Exception(f"Document {file_hash} has no page {page_number}")
+        return self._read(file_hash, page[1], page[2]).decode('utf-8')
+
+    def read_text(self, file_hash) -> str:
+        """The full extracted text, page headers included"""
+        return self._read(file_hash, 0, None).decode('utf-8')
+
+
+register_resource("document_store", DocumentStore, description="Shared extracted document texts")
+
+
+def get_document_store() -> DocumentStore:
+    """Return the process-wide document store"""
+    return get_resource("document_store")
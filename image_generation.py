@@ -0,0 +1,71 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lazy_imports import lazy_import
+from image_library import get_image_library
+from rate_limits import create_images, PRIORITY_STANDARD
+
+openai = lazy_import("openai")
+
+# DALL-E 3 returns one image per request, so variations are separate concurrent calls
+SINGLE_IMAGE_MODELS = {"dall-e-3"}
+# Process-wide cap on in-flight image requests, shared by every session
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_IMAGE_GENERATIONS", "4"))
+
+_generation_slots = threading.BoundedSemaphore(MAX_CONCURRENT_GENERATIONS)
+
+
+def _generate_and_store(prompt, model, size, n, quality, style, metadata):
+    params = {"prompt": prompt, "model": model, "n": n, "size": size, "response_format": "b64_json"}
+    if model in SINGLE_IMAGE_MODELS:
+        params.update(quality=quality, style=style)
+    with _generation_slots:
+        images = create_images(openai, PRIORITY_STANDARD, **params).data
+    # Decoding and thumbnailing run in the worker, outside the request slot
+    library = get_image_library()
+    return [library.add_generated(image_data, prompt, **metadata) for image_data in images]
+
+
+def generate_images(prompt, api_key, model, size, n_images=1, quality=None, style=None, on_image=None):
+    """Generate n_images images and persist each to the image library as soon as it arrives
+
+    For single-image models the variations are requested concurrently, so the
+    whole batch takes about as long as one image. on_image(index, digest,
+    elapsed_seconds) is called from the calling thread in completion order. Returns
+    (digests, errors), with digests in request order and failed slots omitted.
+    """
+    openai.api_key = api_key
+    metadata = {
+        "model": model,
+        "size": size,
+        "quality": quality if model in SINGLE_IMAGE_MODELS else None,
+        "style": style if model in SINGLE_IMAGE_MODELS else None
+    }
+    if model in SINGLE_IMAGE_MODELS:
+        requests_per_call = [1] * n_images
+    else:
+        requests_per_call = [n_images]
+
+    digests = {}
+    errors = []
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(len(requests_per_call), MAX_CONCURRENT_GENERATIONS)) as executor:
+        futures = {
+            executor.submit(_generate_and_store, prompt, model, size, n, quality, style, metadata): call_index
+            for call_index, n in enumerate(requests_per_call)
+        }
+        for future in as_completed(futures):
+            call_index = futures[future]
+            try:
+                stored = future.result()
+            except Exception as e:
+                errors.append(f"Image {call_index + 1}: {str(e)}")
+                continue
+            for offset, digest in enumerate(stored):
+                index = call_index + offset
+                digests[index] = digest
+                if on_image:
+                    on_image(index, digests[index], time.perf_counter() - start_time)
+    return [digests[index] for index in sorted(digests)], errors
@@ -0,0 +1,143 @@
+from PIL import Image
+import io
+import re
+import time
+import base64
+import hashlib
+
+from resources import register_resource, get_resource
+from storage import get_storage
+from previews import PREVIEW_FORMAT, PREVIEW_MAX_SIDE, PREVIEW_QUALITY, _LRUCache
+
+MAX_CACHED_THUMBNAILS = 256
+
+_NUMERIC_FIELDS = {"width": int, "height": int, "bytes": int, "created_at": float}
+
+
+def _tokens(text):
+    return re.findall(r"\w+", (text or "").lower())
+
+
+class ImageLibrary:
+    """Library of generated images, deduplicated by content hash
+
+    Originals and thumbnails are kept in the shared storage backend at
+    generation time, so displaying them never touches the network, they
+    outlive the short-lived URLs the API hands out and every replica sees
+    them. Prompts are indexed by word and word prefix for search.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_storage()
+        self._thumbnails = _LRUCache(MAX_CACHED_THUMBNAILS)
+
+    def add(self, data: bytes, prompt, model=None, size=None, quality=None, style=None, revised_prompt=None) -> str:
+        """Store an image with its generation metadata and return its digest
+
+        An image that is already in the library keeps its first record.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if self.get(digest) is not None:
+            return digest
+
+        image = Image.open(io.BytesIO(data))
+        if image.format != "PNG":
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            data = buffer.getvalue()
+        # Whoever stores the original first owns the record; a concurrent duplicate stops here
+        if not self.backend.add(f"image_blob:{digest}", data):
+            return digest
+        thumbnail = image.convert("RGB")
+        thumbnail.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format=PREVIEW_FORMAT, quality=PREVIEW_QUALITY)
+        self.backend.set(f"image_thumbnail:{digest}", buffer.getvalue())
+
+        now = time.time()
+        self.backend.hset(f"image:{digest}", {
+            "digest": digest, "prompt": prompt, "revised_prompt": revised_prompt or "",
+            "model": model or "", "size": size or "", "quality": quality or "", "style": style or "",
+            "width": image.width, "height": image.height, "bytes": len(data), "created_at": now
+        })
+        for token in set(_tokens(prompt) + _tokens(revised_prompt)):
+            self.backend.sadd(f"image_term:{token}", digest)
+            for length in range(1, len(token) + 1):
+                self.backend.sadd(f"image_prefix:{token[:length]}", digest)
+        if model:
+            self.backend.sadd(f"image_model:{model}", digest)
+        self.backend.zadd("images", digest, now)
+        return digest
+
+    def add_generated(self, image_data, prompt, **metadata) -> str:
+        """Store one item of an images.generate response made with response_format="b64_json" """
+        return self.add(
+            base64.b64decode(image_data.b64_json),
+            prompt,
+            revised_prompt=getattr(image_data, "revised_prompt", None),
+            **metadata
+        )
+
+    @staticmethod
+    def _index_keys(query=None, model=None):
+        """Set keys to intersect: every query word must match, a trailing * matches a prefix"""
+        keys = []
+        for word in (query or "").split():
+            prefix = word.endswith("*")
+            for token in _tokens(word):
+                keys.append(f"image_prefix:{token}" if prefix else f"image_term:{token}")
+        if model:
+            keys.append(f"image_model:{model}")
+        return keys
+
+    @staticmethod
+    def _row(entry):
+        if not entry:
+            return None
+        row = {field: value or None for field, value in entry.items()}
+        for field, cast in _NUMERIC_FIELDS.items():
+            row[field] = cast(float(row[field])) if row.get(field) else None
+        return row
+
+    def search(self, query=None, model=None, limit=24, offset=0):
+        """Newest images whose prompt matches the query"""
+        keys = self._index_keys(query, model)
+        if not keys:
+            digests = self.backend.zrevrange("images", offset, limit)
+            return [row for row in map(self._row, self.backend.hgetall_many([f"image:{d}" for d in digests])) if row]
+        digests = self.backend.sinter(keys)
+        rows = [row for row in map(self._row, self.backend.hgetall_many([f"image:{d}" for d in digests])) if row]
+        rows.sort(key=lambda row: row["created_at"], reverse=True)
+        return rows[offset:offset + limit]
+
+    def count(self, query=None, model=None) -> int:
+        keys = self._index_keys(query, model)
+        return len(self.backend.sinter(keys)) if keys else self.backend.zcard("images")
+
+    def get(self, digest):
+        return self._row(self.backend.hgetall(f"image:{digest}"))
+
+    def thumbnail(self, digest) -> bytes:
+        """Thumbnail bytes, kept in a small in-process cache"""
+        data = self._thumbnails.get(digest)
+        if data is None:
+            data = self.backend.get(f"image_thumbnail:{digest}")
+            if data is None:
+                raise Exception(f"Error loading thumbnail: {digest} is not in the library")
+            self._thumbnails.put(digest, data)
+        return data
+
+    def image_bytes(self, digest) -> bytes:
+        """The full-resolution PNG"""
+        data = self.backend.get(f"image_blob:{digest}")
+        if data is None:
+            raise Exception(f"Error loading image: {digest} is not in the library")
+        return data
+
+
+register_resource("image_library", ImageLibrary, description="Generated image library")
+
+
+def get_image_library() -> ImageLibrary:
+    """Return the process-wide image library"""
+    return get_resource("image_library")
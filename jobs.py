@@ -0,0 +1,394 @@
+from PIL import Image
+import io
+import os
+import json
+import socket
+import hashlib
+import threading
+import time
+import uuid
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+from resources import register_resource, get_resource
+from storage import get_storage
+
+# Files produced by jobs (video and animation exports) are written here
+JOB_RESULTS_DIR = "job_results"
+
+# Job types are resolved lazily so a persisted job can be resumed without
+# the page that submitted it having been loaded in this process
+JOB_TYPES = {
+    "progression_pipeline": "progression:progression_pipeline_job",
+    "progression_frames": "progression:progression_frames_job",
+    "progression_video": "progression:progression_video_job",
+    "progression_animation": "progression:progression_animation_job",
+    "medical_analysis": "medical_analysis:medical_analysis_job",
+    "multi_analysis": "medical_analysis:multi_analysis_job",
+    "batch_analysis": "batch_analysis:batch_analysis_job",
+    "tiled_analysis": "tiled_analysis:tiled_analysis_job",
+}
+
+# Parameters that are never written to storage; resume() must be given them again
+SECRET_PARAMS = {"api_key"}
+
+ACTIVE_STATES = ("queued", "running")
+RESUMABLE_STATES = ("failed", "cancelled", "interrupted")
+
+# Workers refresh the heartbeat of every job they own; an active job whose
+# heartbeat is older than the timeout belonged to a worker that has gone away
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TIMEOUT = 30
+
+# Finished jobs are deleted, with everything they stored, once idle for this long
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_HOURS", "24")) * 3600
+PURGE_INTERVAL = 600
+
+_NUMERIC_FIELDS = ("progress", "created_at", "updated_at", "heartbeat_at")
+
+
+def _encode(value, put_blob):
+    """JSON-safe form of a job value; images and bytes go through put_blob and are referenced by digest
+
+    Only plain data is accepted, so nothing read back from a shared backend can
+    run code when it is decoded.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Image.Image):
+        return {"__image__": put_blob(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": put_blob(bytes(value))}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(item, put_blob) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item, put_blob) for item in value]
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError("Job values may only contain dicts with string keys")
+        return {"__dict__": {key: _encode(item, put_blob) for key, item in value.items()}}
+    raise TypeError(f"Cannot store {type(value).__name__} in a job")
+
+
+def _decode(value, get_blob):
+    if isinstance(value, list):
+        return [_decode(item, get_blob) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__dict__" in value:
+        return {key: _decode(item, get_blob) for key, item in value["__dict__"].items()}
+    if "__tuple__" in value:
+        return tuple(_decode(item, get_blob) for item in value["__tuple__"])
+    if "__bytes__" in value:
+        return get_blob(value["__bytes__"])
+    image = Image.open(io.BytesIO(get_blob(value["__image__"])))
+    image.load()
+    return image
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation has been requested"""
+
+
+class JobContext:
+    """Handle passed to job functions for progress, partial results and cancellation"""
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+
+    def report_progress(self, done, total, message=""):
+        self.manager._update(self.job_id, progress=done / total if total else 0.0, message=message)
+
+    def publish(self, key, value):
+        """Expose a partial result to pollers before the job finishes"""
+        self.manager._publish(self.job_id, key, value)
+
+    def published(self, key):
+        """The value last published under key, including by an earlier run of a resumed job"""
+        return self.manager._read_value(self.job_id, f"partial:{key}")
+
+    def cancelled(self) -> bool:
+        return self.manager._cancel_requested(self.job_id)
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+
+class JobManager:
+    """Local worker pool over a job table kept in the shared storage backend
+
+    Any replica can poll, cancel or resume a job; it runs on the replica that
+    submitted or resumed it.
+    """
+
+    def __init__(self, backend=None, max_workers=4):
+        self.backend = backend or get_storage()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        os.makedirs(JOB_RESULTS_DIR, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._partials = {}
+        self._cancel_events = {}
+        # Digest of every image and bytes value a running job has stored, by object id
+        self._stored_blobs = {}
+        self._last_purge = 0.0
+        threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+    @staticmethod
+    def _job_key(job_id):
+        return f"job:{job_id}"
+
+    def _put_blob(self, job_id, value, stored):
+        cached = stored.get(id(value))
+        if cached is not None and cached[0] is value:
+            return cached[1]
+        if isinstance(value, Image.Image):
+            buffer = io.BytesIO()
+            value.save(buffer, format="PNG")
+            data = buffer.getvalue()
+        else:
+            data = value
+        digest = hashlib.sha1(data).hexdigest()
+        # Frames published again in a longer list are not written a second time
+        if self.backend.add(f"job:{job_id}:blob:{digest}", data):
+            self.backend.sadd(f"job:{job_id}:blobs", digest)
+        stored[id(value)] = (value, digest)
+        return digest
+
+    def _write_value(self, job_id, kind, value):
+        with self._lock:
+            stored = self._stored_blobs.setdefault(job_id, {})
+        encoded = _encode(value, lambda item: self._put_blob(job_id, item, stored))
+        self.backend.set(f"job:{job_id}:{kind}", json.dumps(encoded).encode('utf-8'))
+
+    def _read_value(self, job_id, kind):
+        data = self.backend.get(f"job:{job_id}:{kind}")
+        if data is None:
+            return None
+        try:
+            encoded = json.loads(data)
+        except ValueError:
+            # Written in an older format; treated as missing
+            return None
+
+        def get_blob(digest):
+            blob = self.backend.get(f"job:{job_id}:blob:{digest}")
+            if blob is None:
+                raise Exception(f"Job {job_id} is missing stored data {digest}")
+            return blob
+
+        return _decode(encoded, get_blob)
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        self.backend.hset(self._job_key(job_id), {
+            name: "" if value is None else value for name, value in fields.items()
+        })
+
+    def _publish(self, job_id, key, value):
+        with self._lock:
+            self._partials.setdefault(job_id, {})[key] = value
+        # Only the published key is rewritten
+        self._write_value(job_id, f"partial:{key}", value)
+        self.backend.sadd(f"job:{job_id}:partial_keys", key)
+
+    def _read_partial(self, job_id):
+        keys = self.backend.smembers_many([f"job:{job_id}:partial_keys"])[0]
+        partial = {}
+        for key in keys:
+            value = self._read_value(job_id, f"partial:{key}")
+            if value is not None:
+                partial[key] = value
+        return partial
+
+    def _delete_partial(self, job_id):
+        keys = self.backend.smembers_many([f"job:{job_id}:partial_keys"])[0]
+        self.backend.delete(f"job:{job_id}:partial_keys", *(f"job:{job_id}:partial:{key}" for key in keys))
+
+    def _output_file(self, job_id):
+        """The file a video or animation job wrote to JOB_RESULTS_DIR, if any"""
+        data = self.backend.get(f"job:{job_id}:params")
+        try:
+            path = json.loads(data)["__dict__"].get("output_path") if data is not None else None
+        except (ValueError, KeyError, TypeError):
+            return None
+        if not isinstance(path, str):
+            return None
+        results_dir = os.path.realpath(JOB_RESULTS_DIR)
+        path = os.path.realpath(path)
+        return path if os.path.commonpath([results_dir, path]) == results_dir else None
+
+    def _delete_job(self, job_id, job_type=None):
+        output_file = self._output_file(job_id)
+        if output_file:
+            try:
+                os.remove(output_file)
+            except FileNotFoundError:
+                pass
+        blobs = self.backend.smembers_many([f"job:{job_id}:blobs"])[0]
+        self._delete_partial(job_id)
+        self.backend.delete(
+            self._job_key(job_id), f"job:{job_id}:params", f"job:{job_id}:result", f"job:{job_id}:blobs",
+            *(f"job:{job_id}:blob:{digest}" for digest in blobs)
+        )
+        self.backend.zrem("jobs", job_id)
+        if job_type:
+            self.backend.zrem(f"jobs:{job_type}", job_id)
+
+    def purge_finished_jobs(self, older_than=JOB_RETENTION_SECONDS) -> int:
+        """Delete jobs with no activity for older_than seconds, with everything they stored"""
+        cutoff = time.time() - older_than
+        job_ids = self.backend.zrevrange("jobs")
+        rows = self.backend.hgetall_many([self._job_key(job_id) for job_id in job_ids])
+        purged = 0
+        for job_id, row in zip(job_ids, rows):
+            # Running jobs refresh their heartbeat, so they are never this idle
+            last_active = max(float(row.get(field) or 0) for field in ("updated_at", "heartbeat_at")) if row else 0
+            if last_active > cutoff:
+                continue
+            self._delete_job(job_id, row.get("job_type") if row else None)
+            purged += 1
+        return purged
+
+    def _cancel_requested(self, job_id) -> bool:
+        event = self._cancel_events.get(job_id)
+        return event is not None and event.is_set()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                owned = list(self._cancel_events.items())
+            for job_id, event in owned:
+                try:
+                    # Cancellation may have been requested from another replica
+                    if self.backend.hgetall(self._job_key(job_id)).get("cancel_requested") == "1":
+                        event.set()
+                    # A job purged meanwhile must not be recreated as a hash without a status
+                    self.backend.hset_if_exists(self._job_key(job_id), "status", {"heartbeat_at": time.time()})
+                except Exception:
+                    continue
+            if time.time() - self._last_purge > PURGE_INTERVAL:
+                self._last_purge = time.time()
+                try:
+                    self.purge_finished_jobs()
+                except Exception:
+                    pass
+
+    def _resolve(self, job_type):
+        module_name, func_name = JOB_TYPES[job_type].split(":")
+        return getattr(importlib.import_module(module_name), func_name)
+
+    def _run(self, job_id, job_type, params):
+        try:
+            if self._cancel_requested(job_id):
+                self._update(job_id, status="cancelled", message="Cancelled before start")
+                return
+            self._update(job_id, status="running", message="Started")
+            try:
+                result = self._resolve(job_type)(JobContext(self, job_id), **params)
+                self._write_value(job_id, "result", result)
+                self._update(job_id, status="completed", progress=1.0, message="Done", error=None)
+                # Pollers read the result from here on
+                self._delete_partial(job_id)
+            except Exception as e:
+                # A job may surface cancellation wrapped in its own error type
+                if self._cancel_requested(job_id):
+                    self._update(job_id, status="cancelled", message="Cancelled")
+                else:
+                    self._update(job_id, status="failed", error=str(e))
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+                self._partials.pop(job_id, None)
+                self._stored_blobs.pop(job_id, None)
+
+    def _start(self, job_id, job_type, params):
+        with self._lock:
+            self._cancel_events[job_id] = threading.Event()
+        self._update(job_id, owner=self.worker_id, heartbeat_at=time.time(), cancel_requested=0)
+        self._executor.submit(self._run, job_id, job_type, params)
+
+    def submit(self, job_type, **params) -> str:
+        """Queue a job and return its id"""
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        stored = {name: value for name, value in params.items() if name not in SECRET_PARAMS}
+        self._write_value(job_id, "params", stored)
+        self.backend.hset(self._job_key(job_id), {
+            "id": job_id, "job_type": job_type, "status": "queued", "progress": 0.0,
+            "message": "", "error": "", "created_at": now, "updated_at": now
+        })
+        self.backend.zadd("jobs", job_id, now)
+        self.backend.zadd(f"jobs:{job_type}", job_id, now)
+        self._start(job_id, job_type, params)
+        return job_id
+
+    def _row(self, row):
+        # A hash without a status is what is left of a job deleted mid-update
+        if not row or "status" not in row:
+            return None
+        job = dict(row)
+        for field in _NUMERIC_FIELDS:
+            job[field] = float(job[field]) if job.get(field) else 0.0
+        job["error"] = job.get("error") or None
+        if job["status"] in ACTIVE_STATES and time.time() - job["heartbeat_at"] > HEARTBEAT_TIMEOUT:
+            # The worker that owned this job stopped without finishing it
+            job["status"] = "interrupted"
+            self._update(job["id"], status="interrupted")
+        return job
+
+    def poll(self, job_id):
+        """Return the job's state, partial results and (once completed) its result"""
+        job = self._row(self.backend.hgetall(self._job_key(job_id)))
+        if job is None:
+            return None
+        with self._lock:
+            partial = self._partials.get(job_id)
+        job["partial"] = partial if partial is not None else self._read_partial(job_id)
+        job["result"] = self._read_value(job_id, "result") if job["status"] == "completed" else None
+        return job
+
+    def list_jobs(self, job_type=None, limit=50):
+        """List recent jobs, newest first"""
+        job_ids = self.backend.zrevrange(f"jobs:{job_type}" if job_type else "jobs", 0, limit)
+        rows = self.backend.hgetall_many([self._job_key(job_id) for job_id in job_ids])
+        return [job for job in (self._row(row) for row in rows) if job is not None]
+
+    def cancel(self, job_id):
+        """Request cancellation; running jobs stop at their next checkpoint"""
+        self.backend.hset(self._job_key(job_id), {"cancel_requested": 1})
+        event = self._cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+        job = self.poll(job_id)
+        if job and job["status"] == "interrupted":
+            self._update(job_id, status="cancelled", message="Cancelled")
+
+    def resume(self, job_id, **params):
+        """Re-run a failed, cancelled or interrupted job with its stored parameters
+
+        Secret parameters such as api_key are not persisted and must be passed again.
+        """
+        job = self.poll(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job: {job_id}")
+        if job["status"] not in RESUMABLE_STATES:
+            raise ValueError(f"Job {job_id} is {job['status']} and cannot be resumed")
+        stored = self._read_value(job_id, "params") or {}
+        stored.update(params)
+        self._update(job_id, status="queued", progress=0.0, message="Resumed", error=None)
+        self._start(job_id, job["job_type"], stored)
+        return job_id
+
+
+register_resource("job_manager", JobManager, description="Background worker pool and job table")
+
+
+def get_job_manager() -> JobManager:
+    """Return the process-wide job manager shared by every Streamlit session"""
+    return get_resource("job_manager")
@@ -0,0 +1,60 @@
+import sys
+import importlib
+import importlib.util
+import threading
+import types
+
+_import_lock = threading.RLock()
+
+
+class LazyModule(types.ModuleType):
+    """Module placeholder that imports the real module on first attribute access
+
+    Heavy dependencies (openai, cv2, numpy, ...) are only loaded once a code
+    path actually uses them, so importing a page stays cheap. The import runs
+    under a lock, so job threads touching a module for the first time at the
+    same moment import it exactly once.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with _import_lock:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name, optional=False):
+    """Return a lazily loaded module
+
+    Raises ImportError straight away if the module is not installed, unless
+    optional is set, in which case None is returned so callers can keep the
+    usual `if module is None` checks for optional dependencies.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    try:
+        found = importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        found = False
+    if not found:
+        if optional:
+            return None
+        raise ImportError(f"No module named '{name}'")
+    return LazyModule(name)
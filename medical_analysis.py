@@ -0,0 +1,522 @@
+from PIL import Image
+import io
+import time
+import re
+import base64
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lazy_imports import lazy_import
+from rate_limits import create_chat_completion, PRIORITY_STANDARD
+
+openai = lazy_import("openai")
+
+logger = logging.getLogger(__name__)
+
+MEDICAL_PROMPTS = {
+    "general_analysis": """
+    As a medical AI assistant, analyze this medical image and provide:
+    1. **Visual Observations**: What do you see in the image?
+    2. **Potential Conditions**: What medical conditions could this indicate?
+    3. **Symptoms to Look For**: What symptoms should be monitored?
+    4. **Recommended Actions**: What should the healthcare provider consider?
+    5. **Urgency Level**: How urgent is this case?
+
+    IMPORTANT: This is for educational/assistance purposes only. Always consult with qualified medical professionals for diagnosis and treatment.
+    """,
+    "skin_analysis": """
+    Analyze this skin/dermatological image as a medical AI assistant:
+    1. **Skin Lesion Assessment**: Describe the appearance, size, color, texture
+    2. **Potential Skin Conditions**: List possible dermatological conditions
+    3. **ABCDE Analysis**: If applicable, assess Asymmetry, Border, Color, Diameter, Evolution
+    4. **Risk Factors**: Identify any concerning features
+    5. **Recommendations**: Suggest next steps for evaluation
+
+    DISCLAIMER: This is not a substitute for professional dermatological examination.
+    """,
+    "xray_analysis": """
+    As a medical AI assistant, analyze this X-ray/radiological image:
+    1. **Image Quality**: Comment on image clarity and positioning
+    2. **Anatomical Structures**: Identify visible structures
+    3. **Abnormal Findings**: Note any abnormalities or concerning features
+    4. **Possible Conditions**: Suggest potential diagnoses to consider
+    5. **Additional Imaging**: Recommend if other imaging might be needed
+
+    IMPORTANT: Radiological interpretation requires specialized training. This is for educational support only.
+    """,
+    "eye_analysis": """
+    Analyze this ophthalmological image as a medical AI assistant:
+    1. **Eye Structure Assessment**: Describe visible eye structures
+    2. **Abnormalities**: Note any visible abnormalities or lesions
+    3. **Potential Eye Conditions**: List possible ocular conditions
+    4. **Symptoms to Monitor**: What symptoms should be watched for
+    5. **Specialist Referral**: When to refer to ophthalmologist
+
+    DISCLAIMER: Eye conditions require professional ophthalmological evaluation.
+    """,
+    "wound_analysis": """
+    As a medical AI assistant, analyze this wound/injury image:
+    1. **Wound Assessment**: Describe type, size, depth, and appearance
+    2. **Healing Stage**: Assess current healing phase
+    3. **Infection Signs**: Look for signs of infection or complications
+    4. **Treatment Considerations**: Suggest wound care approaches
+    5. **Monitoring**: What to watch for during healing
+
+    IMPORTANT: Wound care requires proper medical evaluation and treatment.
+    """,
+    "symptom_analysis": """
+    Analyze this medical symptom image as a medical AI assistant:
+    1. **Symptom Description**: Describe what you observe
+    2. **Possible Causes**: List potential underlying causes
+    3. **Associated Symptoms**: What other symptoms might be present
+    4. **Severity Assessment**: Evaluate the severity level
+    5. **Medical Attention**: When to seek immediate medical care
+
+    DISCLAIMER: Symptoms require proper medical evaluation for accurate diagnosis.
+    """
+}
+
+SYSTEM_PROMPT = "You are a medical AI assistant designed to help healthcare professionals analyze medical images. Provide detailed, structured analysis while emphasizing the importance of professional medical consultation. Always include disclaimers about the limitations of AI analysis."
+
+# How each analysis type is sent to the vision model. The model tiles "high"
+# detail images at up to 2048px on the long side and 768px on the short side,
+# and "low" detail at 512px, so anything larger is wasted upload.
+PREPROCESSING_PROFILES = {
+    "general_analysis": {"detail": "high", "format": "JPEG", "quality": 85},
+    "skin_analysis": {"detail": "high", "format": "JPEG", "quality": 92},
+    "xray_analysis": {"detail": "high", "format": "PNG", "grayscale": True},
+    "eye_analysis": {"detail": "high", "format": "JPEG", "quality": 92},
+    "wound_analysis": {"detail": "high", "format": "JPEG", "quality": 85},
+    "symptom_analysis": {"detail": "low", "format": "JPEG", "quality": 80}
+}
+
+def encode_image_to_base64(image):
+    """Convert PIL Image to base64 string"""
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    img_str = base64.b64encode(buffered.getvalue()).decode()
+    return img_str
+
+# Modes with more than 8 bits per sample, such as 16-bit DICOM exports and TIFF radiographs
+HIGH_BIT_DEPTH_MODES = ("I;16", "I;16L", "I;16B", "I;16N", "I", "F")
+# Share of the darkest and of the brightest pixels clipped when windowing them to 8 bits
+WINDOW_CLIP = 0.005
+
+def window_to_8bit(image):
+    """Stretch a high-bit-depth image's percentile window over 0-255
+
+    Converting I;16 or I images straight to L or RGB clamps every value above
+    255 to white, which blanks out most of a radiograph. Other modes are
+    returned unchanged.
+    """
+    if image.mode not in HIGH_BIT_DEPTH_MODES:
+        return image
+    if image.mode.startswith("I;16"):
+        image = image.convert("I")
+    low, high = image.getextrema()
+    if high <= low:
+        return Image.new("L", image.size, 0)
+    histogram = image.histogram(extrema=(low, high))
+    clip = sum(histogram) * WINDOW_CLIP
+    bin_width = (high - low) / len(histogram)
+    count = 0
+    for first_bin, pixels in enumerate(histogram):
+        count += pixels
+        if count > clip:
+            break
+    count = 0
+    for last_bin in range(len(histogram) - 1, -1, -1):
+        count += histogram[last_bin]
+        if count > clip:
+            break
+    window_low = low + first_bin * bin_width
+    window_high = max(low + (last_bin + 1) * bin_width, window_low + bin_width)
+    scale = 255.0 / (window_high - window_low)
+    offset = -window_low * scale
+    return image.point(lambda value: value * scale + offset).convert("L")
+
+def get_vision_target_size(size, detail):
+    """Largest size the vision model will actually use for an image at this detail level"""
+    width, height = size
+    if detail == "low":
+        scale = 512 / max(width, height)
+    else:
+        scale = min(2048 / max(width, height), 768 / min(width, height))
+    scale = min(scale, 1.0)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def combine_profiles(analysis_types):
+    """The most demanding preprocessing among several analysis types, for one image sent to all of them
+
+    High detail wins over low, PNG over JPEG (at the highest JPEG quality
+    otherwise), and the image is only grayscale if every type wants it so.
+    """
+    profiles = [PREPROCESSING_PROFILES.get(t, PREPROCESSING_PROFILES["general_analysis"]) for t in analysis_types]
+    if any(profile["format"] == "PNG" for profile in profiles):
+        combined = {"format": "PNG"}
+    else:
+        combined = {"format": "JPEG", "quality": max(profile["quality"] for profile in profiles)}
+    combined["detail"] = "high" if any(profile["detail"] == "high" for profile in profiles) else "low"
+    combined["grayscale"] = all(profile.get("grayscale") for profile in profiles)
+    return combined
+
+def prepare_image_for_vision(image, analysis_type, measure_baseline=None, profile=None):
+    """Downscale and encode an image for a vision call according to its analysis type
+
+    image may be a PIL Image or the raw uploaded bytes. Raw JPEG bytes are decoded
+    with Pillow's draft mode, so only the reduced resolution is decoded; a PIL
+    Image passed in is never modified. Returns the data URL, detail level and
+    size/timing stats; byte counts are of the base64 payload actually sent.
+    With measure_baseline the stats also include the size and encoding time of
+    the full-resolution PNG the previous implementation sent. It defaults to
+    whether the comparison would be logged. profile overrides the analysis
+    type's preprocessing profile.
+    """
+    if measure_baseline is None:
+        measure_baseline = logger.isEnabledFor(logging.INFO)
+    start_time = time.perf_counter()
+    profile = profile or PREPROCESSING_PROFILES.get(analysis_type, PREPROCESSING_PROFILES["general_analysis"])
+    source = image
+    source_bytes = None
+    if isinstance(image, (bytes, bytearray)):
+        source_bytes = len(image)
+        image = Image.open(io.BytesIO(image))
+    original_size = image.size
+    target_size = get_vision_target_size(original_size, profile["detail"])
+
+    mode = "L" if profile.get("grayscale") else "RGB"
+    # draft() shrinks the image in place, so it is only used on an image opened
+    # here, and only takes effect before the pixel data has been loaded
+    if source_bytes is not None and image.format == "JPEG":
+        image.draft(mode, target_size)
+    prepared = window_to_8bit(image).convert(mode)
+    if prepared.size != target_size:
+        prepared = prepared.resize(target_size, Image.LANCZOS, reducing_gap=3.0)
+
+    buffered = io.BytesIO()
+    if profile["format"] == "PNG":
+        prepared.save(buffered, format="PNG")
+    else:
+        prepared.save(buffered, format=profile["format"], quality=profile["quality"])
+    payload = base64.b64encode(buffered.getvalue()).decode()
+    mime = f"image/{profile['format'].lower()}"
+
+    stats = {
+        "original_size": original_size,
+        "sent_size": prepared.size,
+        "source_bytes": source_bytes,
+        "payload_bytes": len(payload),
+        "detail": profile["detail"],
+        "format": profile["format"],
+        "preprocess_seconds": time.perf_counter() - start_time
+    }
+    if measure_baseline:
+        # The baseline is encoded from an undrafted decode of the original
+        baseline_start = time.perf_counter()
+        original = Image.open(io.BytesIO(source)) if source_bytes is not None else source
+        stats["baseline_bytes"] = len(encode_image_to_base64(window_to_8bit(original).convert("RGB")))
+        stats["baseline_seconds"] = time.perf_counter() - baseline_start
+    return {
+        "data_url": f"data:{mime};base64,{payload}",
+        "detail": profile["detail"],
+        "stats": stats
+    }
+
+def request_vision_analysis(prepared, prompt, api_key, model="gpt-4o", max_tokens=1500, priority=PRIORITY_STANDARD):
+    """Send an already prepared image with a prompt to the vision model and return the text"""
+    openai.api_key = api_key
+    response = create_chat_completion(
+        openai,
+        priority,
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": prepared["data_url"], "detail": prepared["detail"]}}
+                ]
+            }
+        ],
+        max_tokens=max_tokens,
+        temperature=0.1
+    )
+
+    # The new API returns content in response.choices[0].message.content or response.choices[0].content
+    if hasattr(response.choices[0], "message") and hasattr(response.choices[0].message, "content"):
+        return response.choices[0].message.content
+    elif hasattr(response.choices[0], "content"):
+        return response.choices[0].content
+    return str(response)
+
+def _log_vision_request(analysis_type, stats):
+    # Compared against the full-resolution PNG the previous implementation sent
+    if "baseline_bytes" not in stats:
+        return
+    logger.info(
+        "Vision request for %s: %s -> %s px, %d bytes sent vs %d full-resolution (%d saved), "
+        "preprocess %.3fs vs %.3fs full-resolution (%.3fs saved), request %.2fs",
+        analysis_type, stats["original_size"], stats["sent_size"], stats["payload_bytes"],
+        stats["baseline_bytes"], stats["baseline_bytes"] - stats["payload_bytes"],
+        stats["preprocess_seconds"], stats["baseline_seconds"],
+        stats["baseline_seconds"] - stats["preprocess_seconds"], stats["request_seconds"]
+    )
+
+def analyze_medical_image(image, analysis_type, api_key, model="gpt-4o", return_stats=False, extra_context=None,
+                          priority=PRIORITY_STANDARD):
+    """Analyze medical image using OpenAI's vision model
+
+    With return_stats=True, returns (analysis, stats) where stats records the
+    preprocessing savings and request latency. extra_context is appended to the
+    analysis prompt, e.g. to tell the model it is looking at one tile of a larger image.
+    priority places the request in the rate-limit queue (see rate_limits).
+    """
+    try:
+        # Downscale and encode the image for this analysis type
+        prepared = prepare_image_for_vision(image, analysis_type)
+        stats = prepared["stats"]
+
+        prompt = MEDICAL_PROMPTS.get(analysis_type, MEDICAL_PROMPTS["general_analysis"])
+        if extra_context:
+            prompt = f"{prompt}\n{extra_context}"
+
+        request_start = time.perf_counter()
+        result_content = request_vision_analysis(prepared, prompt, api_key, model, priority=priority)
+        stats["request_seconds"] = time.perf_counter() - request_start
+        _log_vision_request(analysis_type, stats)
+
+        if return_stats:
+            return result_content, stats
+        return result_content
+    except Exception as e:
+        raise Exception(f"Error analyzing medical image: {str(e)}")
+
+# Reports use numbered bold headings such as "1. **Visual Observations**:"
+SECTION_HEADING = re.compile(r"^[ \t]*(?:#+[ \t]*)?(\d+)\.[ \t]+\*\*(.+?)\*\*:?", re.MULTILINE)
+
+class ReportSectionParser:
+    """Incrementally split a streamed report into its numbered sections
+
+    A section is complete once the next heading starts or the stream ends. Text
+    before the first heading is emitted as section 0.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+
+    def _section(self, start, end):
+        text = self.buffer[start:end].strip()
+        match = SECTION_HEADING.match(self.buffer, start)
+        if match:
+            return {"number": int(match.group(1)), "title": match.group(2).strip(), "text": text}
+        return {"number": 0, "title": None, "text": text}
+
+    def feed(self, chunk):
+        """Add streamed text and return any sections completed by it"""
+        self.buffer += chunk
+        # Only match within complete lines so a half-streamed heading is never taken for one
+        return self._split(self.buffer.rfind("\n") + 1)
+
+    def _split(self, end):
+        completed = []
+        for match in SECTION_HEADING.finditer(self.buffer, self.position + 1, end):
+            section = self._section(self.position, match.start())
+            if section["text"]:
+                completed.append(section)
+            self.position = match.start()
+        return completed
+
+    def close(self):
+        """Return the sections still buffered once the stream has ended"""
+        # The last line is complete now, so a heading in the final chunk still starts its own section
+        completed = self._split(len(self.buffer))
+        section = self._section(self.position, len(self.buffer))
+        return completed + [section] if section["text"] else completed
+
+def split_report_sections(text):
+    """Split a complete report into its numbered sections"""
+    parser = ReportSectionParser()
+    return parser.feed(text) + parser.close()
+
+def analyze_medical_image_streaming(image, analysis_type, api_key, model="gpt-4o", on_section=None):
+    """Streaming variant of analyze_medical_image that reports each section as soon as it is complete
+
+    Returns (analysis, stats). stats adds time_to_first_token and
+    time_to_first_section, both measured from the start of the request.
+    """
+    try:
+        prepared = prepare_image_for_vision(image, analysis_type)
+        stats = prepared["stats"]
+        openai.api_key = api_key
+        parser = ReportSectionParser()
+
+        request_start = time.perf_counter()
+        stream = create_chat_completion(
+            openai,
+            PRIORITY_STANDARD,
+            model=model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": MEDICAL_PROMPTS.get(analysis_type, MEDICAL_PROMPTS["general_analysis"])},
+                        {"type": "image_url", "image_url": {"url": prepared["data_url"], "detail": prepared["detail"]}}
+                    ]
+                }
+            ],
+            max_tokens=1500,
+            temperature=0.1,
+            stream=True
+        )
+
+        stats["time_to_first_token"] = None
+        stats["time_to_first_section"] = None
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if stats["time_to_first_token"] is None:
+                stats["time_to_first_token"] = time.perf_counter() - request_start
+            for section in parser.feed(chunk.choices[0].delta.content):
+                if stats["time_to_first_section"] is None:
+                    stats["time_to_first_section"] = time.perf_counter() - request_start
+                if on_section:
+                    on_section(section)
+        for section in parser.close():
+            if stats["time_to_first_section"] is None:
+                stats["time_to_first_section"] = time.perf_counter() - request_start
+            if on_section:
+                on_section(section)
+
+        stats["request_seconds"] = time.perf_counter() - request_start
+        _log_vision_request(analysis_type, stats)
+        logger.info("Time to first section for %s: %.2fs", analysis_type, stats["time_to_first_section"] or 0.0)
+        return parser.buffer, stats
+    except Exception as e:
+        raise Exception(f"Error analyzing medical image: {str(e)}")
+
+def _profile_key(analysis_type):
+    profile = PREPROCESSING_PROFILES.get(analysis_type, PREPROCESSING_PROFILES["general_analysis"])
+    return tuple(sorted(profile.items()))
+
+def _split_combined_report(text, analysis_types):
+    """Split a single-call report on its '### <analysis_type>' markers"""
+    sections = {}
+    for i, analysis_type in enumerate(analysis_types):
+        marker = f"### {analysis_type}"
+        start = text.find(marker)
+        if start == -1:
+            continue
+        start += len(marker)
+        ends = [text.find(f"### {other}", start) for other in analysis_types[i+1:]]
+        ends = [end for end in ends if end != -1]
+        sections[analysis_type] = text[start:min(ends) if ends else len(text)].strip()
+    return sections
+
+def analyze_medical_image_multi(image, analysis_types, api_key, model="gpt-4o", single_call=False, on_result=None):
+    """Run several analysis types over one image, preparing each distinct encoding only once
+
+    Types that share a preprocessing profile share one encoded payload, and the
+    requests run concurrently. With single_call=True, all types go to the model in
+    one structured request. The report is split per type and every type gets the
+    same latency. Returns {analysis_type: {"analysis", "seconds", "error"}}.
+    on_result, if given, is called with (analysis_type, result) as each lands.
+    """
+    if not single_call and len({_profile_key(t) for t in analysis_types}) > 1:
+        # Several encodings are needed, so decode once at full size up front;
+        # draft decoding for the first profile would starve the others
+        if isinstance(image, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(image))
+        image.load()
+
+    results = {}
+    if single_call:
+        # One image serves every type, so it is prepared for the most demanding of them
+        prepared = prepare_image_for_vision(image, analysis_types[0], profile=combine_profiles(analysis_types))
+        prompt = "Provide each of the following analyses of this image. Start each one with its marker line exactly as written.\n"
+        for analysis_type in analysis_types:
+            prompt += f"\n### {analysis_type}\n{MEDICAL_PROMPTS[analysis_type]}"
+        start_time = time.perf_counter()
+        try:
+            text = request_vision_analysis(prepared, prompt, api_key, model, max_tokens=min(4096, 1200 * len(analysis_types)))
+            sections = _split_combined_report(text, analysis_types)
+            error = None
+        except Exception as e:
+            sections, error = {}, str(e)
+        seconds = time.perf_counter() - start_time
+        for analysis_type in analysis_types:
+            result = {
+                "analysis": sections.get(analysis_type),
+                "seconds": seconds,
+                "error": error or (None if analysis_type in sections else "Section missing from combined report")
+            }
+            results[analysis_type] = result
+            if on_result:
+                on_result(analysis_type, result)
+        return results
+
+    prepared_by_profile = {}
+    for analysis_type in analysis_types:
+        key = _profile_key(analysis_type)
+        if key not in prepared_by_profile:
+            prepared_by_profile[key] = prepare_image_for_vision(image, analysis_type)
+
+    def run(analysis_type):
+        start_time = time.perf_counter()
+        prepared = prepared_by_profile[_profile_key(analysis_type)]
+        analysis = request_vision_analysis(prepared, MEDICAL_PROMPTS[analysis_type], api_key, model)
+        return analysis, time.perf_counter() - start_time
+
+    with ThreadPoolExecutor(max_workers=len(analysis_types)) as executor:
+        futures = {executor.submit(run, analysis_type): analysis_type for analysis_type in analysis_types}
+        for future in as_completed(futures):
+            analysis_type = futures[future]
+            try:
+                analysis, seconds = future.result()
+                result = {"analysis": analysis, "seconds": seconds, "error": None}
+            except Exception as e:
+                result = {"analysis": None, "seconds": None, "error": str(e)}
+            results[analysis_type] = result
+            if on_result:
+                on_result(analysis_type, result)
+    return results
+
+def medical_analysis_job(ctx, image, analysis_type, api_key, model="gpt-4o", use_cache=True, cache_threshold=None):
+    """Background job: run analyze_medical_image off the Streamlit script thread"""
+    # Imported here because the cache module builds on this one
+    from analysis_cache import cached_analyze_medical_image, DEFAULT_THRESHOLD
+
+    sections = []
+
+    def on_section(section):
+        sections.append(section)
+        ctx.publish('sections', list(sections))
+        ctx.report_progress(len(sections), len(sections) + 1, f"{len(sections)} sections received")
+
+    ctx.report_progress(0, 1, "Analyzing image")
+    analysis, stats = cached_analyze_medical_image(
+        image, analysis_type, api_key, model,
+        threshold=DEFAULT_THRESHOLD if cache_threshold is None else cache_threshold,
+        use_cache=use_cache,
+        on_section=on_section
+    )
+    return {"analysis": analysis, "stats": stats}
+
+def multi_analysis_job(ctx, image, analysis_types, api_key, model="gpt-4o", single_call=False):
+    """Background job: several analysis types over one image, publishing each as it lands"""
+    finished = {}
+
+    def on_result(analysis_type, result):
+        finished[analysis_type] = result
+        ctx.publish('results', dict(finished))
+        ctx.report_progress(len(finished), len(analysis_types), f"{len(finished)}/{len(analysis_types)} analyses done")
+
+    return analyze_medical_image_multi(image, analysis_types, api_key, model, single_call, on_result=on_result)
@@ -1,14 +1,19 @@
 import streamlit as st
-import openai
-import requests
-from PIL import Image, ImageDraw, ImageFont
-import io
 import os
-import base64
-import numpy as np
+import sys
+import time
 from datetime import datetime
 from dotenv import load_dotenv
-import json
+
+# Add the parent directory to the path to import the shared modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jobs import get_job_manager, ACTIVE_STATES, JOB_RESULTS_DIR
+from rate_limits import describe_wait, PRIORITY_BATCH
+from progression import get_missing_stages
+from previews import get_cached_preview, get_preview, encode_full_resolution
+from session_store import get_session_store, format_memory_usage
+from report_store import get_report_store
+from rerun_profiler import start_rerun_profile, profile_section, finish_rerun_profile
 
 # Load environment variables
 load_dotenv()
@@ -20,168 +25,41 @@ st.set_page_config(
     layout="wide"
 )
 
-def encode_image_to_base64(image):
-    """Convert PIL Image to base64 string"""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
-
-def generate_disease_progression_frames(disease_info, api_key, num_frames=5):
-    """Generate frames showing disease progression using DALL-E"""
-    try:
-        openai.api_key = api_key
-        generated_frames = []
-        
-        # Define progression stages dynamically based on num_frames
-        default_stages = [
-            "Early stage - initial symptoms barely visible",
-            "Mild progression - early signs becoming apparent", 
-            "Moderate progression - clear manifestation of symptoms",
-            "Advanced stage - significant disease presentation",
-            "Severe stage - advanced disease characteristics",
-            "Critical stage - life-threatening complications",
-            "End-stage - irreversible damage",
-            "Terminal stage - palliative care focus"
-        ]
-        progression_stages = default_stages[:num_frames]
-
-        # Generate frames for each stage
-        for i, stage in enumerate(progression_stages):
-            prompt = f"""
-            Medical illustration of {disease_info['condition']} - {stage}.
-            Location: {disease_info['location']}
-            
-            Style: Professional medical illustration, clinical photography style,
-            educational medical content, anatomically accurate, clear visualization,
-            medical textbook quality, diagnostic imaging style, healthcare professional standard
-            
-            Show: {disease_info['visual_characteristics']} at {stage}
-            """
-            with st.spinner(f"Generating frame {i+1}/{num_frames} - {stage}..."):
-                response = openai.images.generate(
-                    prompt=prompt,
-                    model="dall-e-3",
-                    size="1024x1024",
-                    quality="hd",
-                    style="natural",
-                    n=1
-                )
-                # Download and store the image
-                img_url = response.data[0].url
-                img_response = requests.get(img_url)
-                frame_image = Image.open(io.BytesIO(img_response.content))
-                # Add stage label to frame
-                frame_with_label = add_stage_label(frame_image, f"Stage {i+1}: {stage}")
-                generated_frames.append({
-                    'image': frame_with_label,
-                    'stage': stage,
-                    'stage_number': i+1
-                })
-        return generated_frames
-        
-    except Exception as e:
-        raise Exception(f"Error generating progression frames: {str(e)}")
+EXPORT_MIME_TYPES = {
+    ".mp4": "video/mp4",
+    ".gif": "image/gif",
+    ".webp": "image/webp"
+}
 
-def add_stage_label(image, label_text):
-    """Add stage label to the image"""
-    try:
-        # Create a copy of the image
-        labeled_image = image.copy()
-        draw = ImageDraw.Draw(labeled_image)
-        
-        # Try to use a default font, fallback to basic font
-        try:
-            font = ImageFont.truetype("arial.ttf", 24)
-        except:
-            font = ImageFont.load_default()
-        
-        # Calculate text position
-        text_width = draw.textlength(label_text, font=font)
-        text_height = 30
-        x = 10
-        y = 10
-        
-        # Draw background rectangle for text
-        draw.rectangle([x-5, y-5, x+text_width+5, y+text_height+5], fill="black", outline="white")
-        
-        # Draw text
-        draw.text((x, y), label_text, fill="white", font=font)
-        
-        return labeled_image
-        
-    except Exception as e:
-        st.error(f"Error adding label: {str(e)}")
-        return image
-
-def create_progression_analysis(disease_info, api_key, model="gpt-4o"):
-    """Generate detailed analysis of disease progression"""
-    try:
-        openai.api_key = api_key
-        
-        analysis_prompt = f"""
-        As a medical education specialist, provide a comprehensive analysis of {disease_info['condition']} progression:
-
-        **Disease:** {disease_info['condition']}
-        **Location:** {disease_info['location']}
-        **Patient Demographics:** {disease_info.get('demographics', 'General population')}
-
-        Please provide:
-        1. **Disease Overview**: Brief description of the condition
-        2. **Progression Timeline**: Typical timeline from onset to advanced stages
-        3. **Stage-by-Stage Analysis**: Detailed description of each progression stage
-        4. **Visual Changes**: How the appearance changes through each stage
-        5. **Symptoms Evolution**: How symptoms develop and worsen over time
-        6. **Risk Factors**: Factors that accelerate or influence progression
-        7. **Intervention Points**: Key stages where treatment can be most effective
-        8. **Prognosis**: Expected outcomes at different stages
-        9. **Educational Notes**: Important points for patients and healthcare providers
-
-        **Format**: Use clear medical terminology suitable for healthcare professionals while being educational.
-        **Disclaimer**: Include appropriate medical disclaimers about individual variation and professional consultation.
-        """
-        
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a medical education specialist with expertise in disease progression and pathology. Provide comprehensive, educational analysis for healthcare professionals and medical students."
-                },
-                {
-                    "role": "user",
-                    "content": analysis_prompt
-                }
-            ],
-            max_tokens=2000,
-            temperature=0.1
-        )
-        
-        return response.choices[0].message.content
-        
-    except Exception as e:
-        raise Exception(f"Error generating progression analysis: {str(e)}")
-
-def main():
-def create_video_from_frames(frames, frame_duration, output_path):
-    """Create a video file from a list of PIL Image frames"""
-    try:
-        # Convert PIL images to numpy arrays
-        frame_arrays = [np.array(frame['image'].convert('RGB')) for frame in frames]
-        
-        # Create video clip
-        clip = mpy.ImageSequenceClip(frame_arrays, fps=1/frame_duration)
-        
-        # Write video file
-        clip.write_videofile(output_path, codec='libx264', audio=False)
-        
-        return output_path
-    except Exception as e:
-        st.error(f"Error creating video: {str(e)}")
+def render_export_job(job_manager, session_key, label):
+    """Show the state of an export job with its size, encode time and download"""
+    if not st.session_state.get(session_key):
         return None
+    job = job_manager.poll(st.session_state[session_key])
+    if job and job['status'] in ACTIVE_STATES:
+        st.info(f"⏳ Encoding {label} in the background...")
+    elif job and job['status'] == 'completed':
+        result = job['result']
+        st.metric(f"{label} Size", f"{result['bytes'] / 1024:,.0f} KB")
+        st.caption(f"⏱️ Encode time: {result['encode_seconds']:.2f}s")
+        with open(result['path'], 'rb') as f:
+            st.download_button(
+                label=f"📥 Download {label}",
+                data=f.read(),
+                file_name=os.path.basename(result['path']),
+                mime=EXPORT_MIME_TYPES[os.path.splitext(result['path'])[1]],
+                key=f"download_{session_key}"
+            )
+    elif job:
+        st.error(f"❌ {label} {job['status']}: {job['error'] or job['message']}")
+    return job
+
+def load_frames(store, frames):
+    """Resolve stored frame handles back to images"""
+    return [dict(frame, image=store.get(frame['image'])) for frame in frames]
 
 def main():
-    st.title("🎬 Disease Progression Video Generation")
+    start_rerun_profile(__file__)
     st.title("🎬 Disease Progression Video Generation")
     st.markdown("Generate educational videos showing disease progression over time for medical education and patient understanding")
     
@@ -329,54 +207,83 @@ def main():
         # Generate buttons
         st.subheader("🎬 Generation Controls")
         
-        col_analysis, col_video = st.columns(2)
-        
-        with col_analysis:
-            if st.button("📊 Generate Analysis", disabled=not api_key):
-                if api_key and condition:
-                    st.session_state.disease_info = disease_info
-                    st.session_state.generate_analysis = True
-                else:
-                    st.error("Please enter API key and disease information")
-        
-        with col_video:
-            if st.button("🎬 Generate Video Frames", disabled=not api_key):
-                if api_key and condition:
-                    st.session_state.disease_info = disease_info
-                    st.session_state.generate_frames = True
-                    st.session_state.num_frames = num_frames
-                else:
-                    st.error("Please enter API key and disease information")
+        reuse_checkpoints = st.checkbox(
+            "♻️ Reuse saved stages",
+            value=True,
+            help="Stages already generated for this configuration are loaded from disk instead of regenerated"
+        )
+        missing_stages = get_missing_stages(disease_info, num_frames)
+        if len(missing_stages) < num_frames:
+            st.caption(f"💾 {num_frames - len(missing_stages)} of {num_frames} stages already saved for this configuration")
+        
+        if st.button("🎬 Generate Analysis & Frames", type="primary", disabled=not api_key):
+            if api_key and condition:
+                st.session_state.disease_info = disease_info
+                st.session_state.num_frames = num_frames
+                st.session_state.pipeline_job_id = get_job_manager().submit(
+                    "progression_pipeline",
+                    disease_info=disease_info,
+                    api_key=api_key,
+                    model=model,
+                    num_frames=num_frames,
+                    resume=reuse_checkpoints
+                )
+            else:
+                st.error("Please enter API key and disease information")
     
-    with col2:
+    with col2, profile_section("render results"):
         st.subheader("📹 Disease Progression Results")
         
-        # Generate analysis
-        if hasattr(st.session_state, 'generate_analysis') and st.session_state.generate_analysis:
-            if st.button("📊 Start Analysis Generation"):
-                try:
-                    with st.spinner("🔬 Generating disease progression analysis..."):
-                        analysis = create_progression_analysis(st.session_state.disease_info, api_key, model)
-                        st.session_state.progression_analysis = analysis
-                        st.session_state.generate_analysis = False
-                        st.success("✅ Analysis generated successfully!")
-                except Exception as e:
-                    st.error(f"❌ Error: {str(e)}")
-        
-        # Generate video frames
-        if hasattr(st.session_state, 'generate_frames') and st.session_state.generate_frames:
-            if st.button("🎬 Start Frame Generation"):
-                try:
-                    frames = generate_disease_progression_frames(
-                        st.session_state.disease_info, 
-                        api_key, 
-                        st.session_state.num_frames
+        # Analysis and frame generation run as one background pipeline job,
+        # so reruns and page switches don't interrupt it
+        job_manager = get_job_manager()
+        pipeline_job = None
+        if st.session_state.get('pipeline_job_id'):
+            pipeline_job = job_manager.poll(st.session_state.pipeline_job_id)
+        if pipeline_job:
+            partial = pipeline_job['partial']
+            if pipeline_job['status'] in ACTIVE_STATES:
+                st.progress(pipeline_job['progress'])
+                st.text(f"⏳ {pipeline_job['message'] or 'Queued'} ({time.time() - pipeline_job['created_at']:.0f}s)")
+                wait_note = describe_wait("dall-e-3", PRIORITY_BATCH)
+                if wait_note:
+                    st.caption(f"Frames share the DALL-E 3 budget and run after interactive requests, {wait_note}")
+                if st.button("⏹️ Cancel Generation"):
+                    job_manager.cancel(pipeline_job['id'])
+                if partial.get('analysis'):
+                    with st.expander("Analysis (ready)", expanded=False):
+                        st.markdown(partial['analysis'])
+                for frame in partial.get('frames', []):
+                    st.image(
+                        get_preview(frame['image']),
+                        caption=f"Stage {frame['stage_number']}: {frame['stage']}",
+                        use_column_width=True
                     )
-                    st.session_state.progression_frames = frames
-                    st.session_state.generate_frames = False
-                    st.success("✅ Video frames generated successfully!")
-                except Exception as e:
-                    st.error(f"❌ Error: {str(e)}")
+            elif pipeline_job['status'] == 'completed':
+                result = pipeline_job['result']
+                if result['analysis'] is not None:
+                    st.session_state.progression_analysis = result['analysis']
+                if result['frames']:
+                    # Frames live in the session store; session state keeps their handles
+                    store = get_session_store(st.session_state)
+                    for frame in st.session_state.get('progression_frames', []):
+                        store.release(frame['image'])
+                    st.session_state.progression_frames = [
+                        dict(frame, image=store.put(frame['image'])) for frame in result['frames']
+                    ]
+                st.session_state.pipeline_job_id = None
+                elapsed = pipeline_job['updated_at'] - pipeline_job['created_at']
+                if result['errors']:
+                    for error in result['errors']:
+                        st.error(f"❌ Error in {error}")
+                else:
+                    st.success(f"✅ Analysis and {len(result['frames'])} frames generated in {elapsed:.1f}s")
+            else:
+                st.error(f"❌ Generation {pipeline_job['status']}: {pipeline_job['error'] or pipeline_job['message']}")
+                missing_stages = get_missing_stages(st.session_state.disease_info, st.session_state.num_frames)
+                if st.button(f"🔁 Resume Generation ({len(missing_stages)} stages left)", disabled=not api_key):
+                    job_manager.resume(pipeline_job['id'], api_key=api_key, resume=True)
+                    st.rerun()
         
         # Display analysis
         if hasattr(st.session_state, 'progression_analysis'):
@@ -386,59 +293,80 @@ def main():
             
             # Save analysis
             if st.button("💾 Save Analysis Report"):
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"disease_progression_analysis_{timestamp}.txt"
-                
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(f"DISEASE PROGRESSION ANALYSIS REPORT\n")
-                    f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                    f.write(f"Disease: {st.session_state.disease_info['condition']}\n")
-                    f.write(f"Location: {st.session_state.disease_info['location']}\n")
-                    f.write(f"{'='*60}\n\n")
-                    f.write(st.session_state.progression_analysis)
-                    f.write(f"\n\n{'='*60}\n")
-                    f.write("DISCLAIMER: This is educational content for medical professionals.\n")
-                
-                st.success(f"📄 Analysis saved as {filename}")
+                report_id = get_report_store().save(
+                    st.session_state.progression_analysis,
+                    "disease_progression",
+                    model=model,
+                    condition=st.session_state.disease_info['condition'],
+                    location=st.session_state.disease_info['location']
+                )
+                st.success(f"📄 Analysis saved to the report library as report #{report_id}")
         
         # Display video frames
         if hasattr(st.session_state, 'progression_frames'):
             st.markdown("### 🎬 Disease Progression Frames:")
             
-            # Display frames in sequence
-            for i, frame_data in enumerate(st.session_state.progression_frames):
-                st.markdown(f"**Stage {frame_data['stage_number']}:** {frame_data['stage']}")
-                st.image(frame_data['image'], caption=f"Stage {frame_data['stage_number']}", use_column_width=True)
+            # Display frames in sequence; a frame is only read back when its preview is missing
+            store = get_session_store(st.session_state)
+            with profile_section("render frames"):
+                for i, frame_data in enumerate(st.session_state.progression_frames):
+                    st.markdown(f"**Stage {frame_data['stage_number']}:** {frame_data['stage']}")
+                    image_key = frame_data['image'].key
+                    preview = get_cached_preview(image_key) or get_preview(store.get(frame_data['image']), key=image_key)
+                    st.image(preview, caption=f"Stage {frame_data['stage_number']}", use_column_width=True)
                 
-                # Download individual frame
-                img_buffer = io.BytesIO()
-                frame_data['image'].save(img_buffer, format='PNG')
-                img_buffer.seek(0)
+                    # Full-resolution PNG is only encoded once the user asks for it
+                    download_keys = st.session_state.setdefault('download_ready', set())
+                    if image_key in download_keys:
+                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                        filename = f"progression_stage_{frame_data['stage_number']}_{timestamp}.png"
+                    
+                        st.download_button(
+                            label=f"📥 Download Stage {frame_data['stage_number']}",
+                            data=encode_full_resolution(store.get(frame_data['image']), key=image_key),
+                            file_name=filename,
+                            mime="image/png",
+                            key=f"download_{i}"
+                        )
+                    elif st.button(f"📥 Prepare Stage {frame_data['stage_number']} Download", key=f"prepare_download_{i}"):
+                        download_keys.add(image_key)
+                        st.rerun()
                 
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"progression_stage_{frame_data['stage_number']}_{timestamp}.png"
-                
-                st.download_button(
-                    label=f"📥 Download Stage {frame_data['stage_number']}",
-                    data=img_buffer.getvalue(),
-                    file_name=filename,
-                    mime="image/png",
-                    key=f"download_{i}"
-                )
-                
-                st.markdown("---")
+                    st.markdown("---")
             
-            # Video creation instructions
+            # Video and animated exports
             st.markdown("### 🎬 Create Video:")
-            st.info("""
-            **To create a video from these frames:**
-            1. Download all frames using the buttons above
-            2. Use video editing software (e.g., Adobe Premiere, DaVinci Resolve, or free tools like OpenShot)
-            3. Import frames in sequence
-            4. Set frame duration to your preferred timing
-            5. Add transitions between stages
-            6. Export as MP4 for sharing
+            col_mp4, col_animated = st.columns(2)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             
+            with col_mp4:
+                if st.button("🎞️ Create MP4 Video"):
+                    st.session_state.video_job_id = job_manager.submit(
+                        "progression_video",
+                        frames=load_frames(store, st.session_state.progression_frames),
+                        frame_duration=frame_duration,
+                        output_path=os.path.join(JOB_RESULTS_DIR, f"disease_progression_{timestamp}.mp4")
+                    )
+                render_export_job(job_manager, 'video_job_id', "MP4")
+            
+            with col_animated:
+                animation_format = st.radio("Animated Format", ["GIF", "WEBP"], horizontal=True)
+                dither = st.checkbox("Dithering", value=True, help="Smoother gradients at a slightly larger file size")
+                if st.button("🖼️ Create Animated Export"):
+                    st.session_state.animation_job_id = job_manager.submit(
+                        "progression_animation",
+                        frames=load_frames(store, st.session_state.progression_frames),
+                        frame_duration=frame_duration,
+                        output_path=os.path.join(
+                            JOB_RESULTS_DIR,
+                            f"disease_progression_{timestamp}.{animation_format.lower()}"
+                        ),
+                        format=animation_format,
+                        dither=dither
+                    )
+                render_export_job(job_manager, 'animation_job_id', "Animation")
+            
+            st.info("""
             **Suggested video settings:**
             - Frame rate: 1-2 FPS for educational viewing
             - Add fade transitions between stages
@@ -500,5 +428,17 @@ def main():
         - Not all diseases follow predictable patterns
         """)
 
+    st.sidebar.caption(format_memory_usage(get_session_store(st.session_state).memory_usage()))
+    finish_rerun_profile(st.sidebar.caption)
+
+    # Keep polling while background jobs run
+    active_jobs = [pipeline_job]
+    for session_key in ('video_job_id', 'animation_job_id'):
+        if st.session_state.get(session_key):
+            active_jobs.append(job_manager.poll(st.session_state[session_key]))
+    if any(job and job['status'] in ACTIVE_STATES for job in active_jobs):
+        time.sleep(1)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
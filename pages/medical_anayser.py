@@ -1,13 +1,27 @@
 import streamlit as st
-import openai
-import requests
 from PIL import Image
 import io
 import os
-import base64
+import sys
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 
+# Add the parent directory to the path to import the shared modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jobs import get_job_manager, ACTIVE_STATES
+from rate_limits import describe_wait, PRIORITY_STANDARD, PRIORITY_BATCH
+from analysis_cache import DEFAULT_THRESHOLD
+from tiled_analysis import save_uploaded_image
+from sample_assets import SAMPLE_IMAGES, get_sample_image, start_prefetch
+from session_store import get_session_store, format_memory_usage
+from report_store import get_report_store
+from rerun_profiler import start_rerun_profile, profile_section, finish_rerun_profile
+from batch_analysis import (
+    BATCH_DIR, SERVER_INPUT_ROOT, get_batch_id, save_uploaded_archive, resolve_server_path,
+    export_batch_csv, export_batch_jsonl
+)
+
 # Load environment variables
 load_dotenv()
 
@@ -18,118 +32,17 @@ st.set_page_config(
     layout="wide"
 )
 
-def encode_image_to_base64(image):
-    """Convert PIL Image to base64 string"""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
-
-def analyze_medical_image(image, analysis_type, api_key, model="gpt-4o"):
-    """Analyze medical image using OpenAI's vision model"""
-    try:
-        # Encode image to base64
-        base64_image = encode_image_to_base64(image)
-        openai.api_key = api_key
-
-        medical_prompts = {
-            "general_analysis": """
-            As a medical AI assistant, analyze this medical image and provide:
-            1. **Visual Observations**: What do you see in the image?
-            2. **Potential Conditions**: What medical conditions could this indicate?
-            3. **Symptoms to Look For**: What symptoms should be monitored?
-            4. **Recommended Actions**: What should the healthcare provider consider?
-            5. **Urgency Level**: How urgent is this case?
-
-            IMPORTANT: This is for educational/assistance purposes only. Always consult with qualified medical professionals for diagnosis and treatment.
-            """,
-            "skin_analysis": """
-            Analyze this skin/dermatological image as a medical AI assistant:
-            1. **Skin Lesion Assessment**: Describe the appearance, size, color, texture
-            2. **Potential Skin Conditions**: List possible dermatological conditions
-            3. **ABCDE Analysis**: If applicable, assess Asymmetry, Border, Color, Diameter, Evolution
-            4. **Risk Factors**: Identify any concerning features
-            5. **Recommendations**: Suggest next steps for evaluation
-
-            DISCLAIMER: This is not a substitute for professional dermatological examination.
-            """,
-            "xray_analysis": """
-            As a medical AI assistant, analyze this X-ray/radiological image:
-            1. **Image Quality**: Comment on image clarity and positioning
-            2. **Anatomical Structures**: Identify visible structures
-            3. **Abnormal Findings**: Note any abnormalities or concerning features
-            4. **Possible Conditions**: Suggest potential diagnoses to consider
-            5. **Additional Imaging**: Recommend if other imaging might be needed
-
-            IMPORTANT: Radiological interpretation requires specialized training. This is for educational support only.
-            """,
-            "eye_analysis": """
-            Analyze this ophthalmological image as a medical AI assistant:
-            1. **Eye Structure Assessment**: Describe visible eye structures
-            2. **Abnormalities**: Note any visible abnormalities or lesions
-            3. **Potential Eye Conditions**: List possible ocular conditions
-            4. **Symptoms to Monitor**: What symptoms should be watched for
-            5. **Specialist Referral**: When to refer to ophthalmologist
-
-            DISCLAIMER: Eye conditions require professional ophthalmological evaluation.
-            """,
-            "wound_analysis": """
-            As a medical AI assistant, analyze this wound/injury image:
-            1. **Wound Assessment**: Describe type, size, depth, and appearance
-            2. **Healing Stage**: Assess current healing phase
-            3. **Infection Signs**: Look for signs of infection or complications
-            4. **Treatment Considerations**: Suggest wound care approaches
-            5. **Monitoring**: What to watch for during healing
-
-            IMPORTANT: Wound care requires proper medical evaluation and treatment.
-            """,
-            "symptom_analysis": """
-            Analyze this medical symptom image as a medical AI assistant:
-            1. **Symptom Description**: Describe what you observe
-            2. **Possible Causes**: List potential underlying causes
-            3. **Associated Symptoms**: What other symptoms might be present
-            4. **Severity Assessment**: Evaluate the severity level
-            5. **Medical Attention**: When to seek immediate medical care
-
-            DISCLAIMER: Symptoms require proper medical evaluation for accurate diagnosis.
-            """
-        }
-
-        prompt = medical_prompts.get(analysis_type, medical_prompts["general_analysis"])
-
-        # Use the new OpenAI API for chat completions
-        response = openai.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a medical AI assistant designed to help healthcare professionals analyze medical images. Provide detailed, structured analysis while emphasizing the importance of professional medical consultation. Always include disclaimers about the limitations of AI analysis."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
-                    ]
-                }
-            ],
-            max_tokens=1500,
-            temperature=0.1
-        )
-
-        # The new API returns content in response.choices[0].message.content or response.choices[0].content
-        result_content = None
-        if hasattr(response.choices[0], "message") and hasattr(response.choices[0].message, "content"):
-            result_content = response.choices[0].message.content
-        elif hasattr(response.choices[0], "content"):
-            result_content = response.choices[0].content
-        else:
-            result_content = str(response)
-        return result_content
-    except Exception as e:
-        raise Exception(f"Error analyzing medical image: {str(e)}")
+ANALYSIS_TYPE_LABELS = {
+    "general_analysis": "🔍 General Medical Analysis",
+    "skin_analysis": "🧴 Dermatological Analysis",
+    "xray_analysis": "📷 X-ray/Radiological Analysis",
+    "eye_analysis": "👁️ Ophthalmological Analysis",
+    "wound_analysis": "🩹 Wound Assessment",
+    "symptom_analysis": "🔬 Symptom Analysis"
+}
 
 def main():
+    start_rerun_profile(__file__)
     st.title("🏥 Medical Image Analyzer")
     st.markdown("AI-powered medical image analysis to assist healthcare professionals in identifying potential conditions and recommendations")
     
@@ -161,22 +74,8 @@ def main():
         # Medical analysis type
         analysis_type = st.selectbox(
             "Medical Analysis Type",
-            [
-                "general_analysis",
-                "skin_analysis", 
-                "xray_analysis",
-                "eye_analysis",
-                "wound_analysis",
-                "symptom_analysis"
-            ],
-            format_func=lambda x: {
-                "general_analysis": "🔍 General Medical Analysis",
-                "skin_analysis": "🧴 Dermatological Analysis",
-                "xray_analysis": "📷 X-ray/Radiological Analysis", 
-                "eye_analysis": "👁️ Ophthalmological Analysis",
-                "wound_analysis": "🩹 Wound Assessment",
-                "symptom_analysis": "🔬 Symptom Analysis"
-            }[x]
+            list(ANALYSIS_TYPE_LABELS.keys()),
+            format_func=lambda x: ANALYSIS_TYPE_LABELS[x]
         )
         
         # Analysis confidence level
@@ -184,10 +83,18 @@ def main():
         detailed_analysis = st.checkbox("Detailed Analysis", value=True, help="Provide comprehensive analysis")
         include_urgency = st.checkbox("Include Urgency Assessment", value=True, help="Assess urgency level")
         
+        # Near-duplicate cache
+        st.subheader("⚡ Analysis Cache")
+        use_cache = st.checkbox("Reuse analyses of near-identical images", value=True)
+        cache_threshold = st.slider(
+            "Match threshold (bits)", 0, 12, DEFAULT_THRESHOLD,
+            help="Maximum perceptual-hash distance for two images to count as the same case"
+        )
+        
     # Main content area
     col1, col2 = st.columns([1, 1])
     
-    with col1:
+    with col1, profile_section("load image"):
         st.subheader("📤 Upload Medical Image")
         
         # File uploader
@@ -199,23 +106,20 @@ def main():
         
         # Sample medical images (for demo purposes)
         st.markdown("**Demo Images (For Testing Only):**")
-        sample_images = {
-            "Sample Skin Lesion": "https://images.unsplash.com/photo-1559757175-3dfc3c8e7e88?w=400",
-            "Sample X-ray": "https://images.unsplash.com/photo-1559757175-7c8e7e88?w=400",
-            "Sample Eye": "https://images.unsplash.com/photo-1574279606130-09958dc756c3?w=400",
-            "Sample Wound": "https://images.unsplash.com/photo-1576091160399-112ba8d25d1f?w=400"
-        }
-        
-        sample_choice = st.selectbox("Demo Images", list(sample_images.keys()))
+        # Fetches the demo images into the local store once per process, so later sessions work offline
+        start_prefetch()
+        sample_choice = st.selectbox("Demo Images", list(SAMPLE_IMAGES.keys()))
         if st.button("Use Demo Image"):
-            st.session_state.sample_image_url = sample_images[sample_choice]
+            st.session_state.sample_image_url = SAMPLE_IMAGES[sample_choice]
             st.warning("⚠️ This is a demo image for testing purposes only")
         
         # Display uploaded or sample image
         image_to_analyze = None
+        image_bytes = None
         
         if uploaded_file is not None:
-            image_to_analyze = Image.open(uploaded_file)
+            image_bytes = uploaded_file.getvalue()
+            image_to_analyze = Image.open(io.BytesIO(image_bytes))
             st.image(image_to_analyze, caption="Medical Image for Analysis", use_column_width=True)
             
             # Image info
@@ -223,8 +127,10 @@ def main():
             
         elif hasattr(st.session_state, 'sample_image_url'):
             try:
-                response = requests.get(st.session_state.sample_image_url)
-                image_to_analyze = Image.open(io.BytesIO(response.content))
+                # Served from the local asset store and a process-wide decoded cache
+                image_bytes, image_to_analyze, bundled = get_sample_image(st.session_state.sample_image_url)
+                if bundled:
+                    st.warning("⚠️ The demo image could not be downloaded; showing a bundled synthetic placeholder instead")
                 st.image(image_to_analyze, caption="Demo Medical Image", use_column_width=True)
             except Exception as e:
                 st.error(f"Error loading demo image: {str(e)}")
@@ -236,30 +142,55 @@ def main():
             elif image_to_analyze is None:
                 st.error("Please upload a medical image")
             else:
-                st.session_state.analysis_image = image_to_analyze
+                # Keep the encoded bytes so preprocessing can decode at reduced resolution;
+                # session state only holds a handle to them
+                store = get_session_store(st.session_state)
+                if st.session_state.get('analysis_image'):
+                    store.release(st.session_state.analysis_image)
+                st.session_state.analysis_image = store.put(image_bytes)
                 st.session_state.analysis_type = analysis_type
                 st.session_state.analysis_model = model
     
-    with col2:
+    with col2, profile_section("analysis results"):
         st.subheader("📋 Medical Analysis Results")
         
-        # Perform analysis if requested
+        # Perform analysis in the background so reruns don't interrupt it
+        job_manager = get_job_manager()
         if hasattr(st.session_state, 'analysis_image'):
             if st.button("🔍 Start Analysis", key="analyze_btn"):
-                try:
-                    with st.spinner("🔬 Analyzing medical image... This may take up to 30 seconds"):
-                        result = analyze_medical_image(
-                            st.session_state.analysis_image,
-                            st.session_state.analysis_type,
-                            api_key,
-                            st.session_state.analysis_model
-                        )
-                        
-                        st.session_state.analysis_result = result
-                        st.success("✅ Medical analysis complete!")
-                        
-                except Exception as e:
-                    st.error(f"❌ Analysis Error: {str(e)}")
+                st.session_state.analysis_job_id = job_manager.submit(
+                    "medical_analysis",
+                    image=get_session_store(st.session_state).get(st.session_state.analysis_image),
+                    analysis_type=st.session_state.analysis_type,
+                    api_key=api_key,
+                    model=st.session_state.analysis_model,
+                    use_cache=use_cache,
+                    cache_threshold=cache_threshold
+                )
+        
+        analysis_job = None
+        if st.session_state.get('analysis_job_id'):
+            analysis_job = job_manager.poll(st.session_state.analysis_job_id)
+        if analysis_job:
+            if analysis_job['status'] in ACTIVE_STATES:
+                st.info("🔬 Analyzing medical image in the background... Sections appear as soon as they are written")
+                wait_note = describe_wait(st.session_state.analysis_model, PRIORITY_STANDARD)
+                if wait_note:
+                    st.caption(f"⏳ {wait_note}")
+                if st.button("⏹️ Cancel Analysis"):
+                    job_manager.cancel(analysis_job['id'])
+                for section in analysis_job['partial'].get('sections', []):
+                    st.markdown(section['text'])
+            elif analysis_job['status'] == 'completed':
+                st.session_state.analysis_result = analysis_job['result']['analysis']
+                st.session_state.analysis_stats = analysis_job['result']['stats']
+                st.session_state.analysis_job_id = None
+                st.success("✅ Medical analysis complete!")
+            else:
+                st.error(f"❌ Analysis {analysis_job['status']}: {analysis_job['error'] or analysis_job['message']}")
+                if st.button("🔁 Resume Analysis", disabled=not api_key):
+                    job_manager.resume(analysis_job['id'], api_key=api_key)
+                    st.rerun()
         
         # Display results
         if hasattr(st.session_state, 'analysis_result'):
@@ -269,26 +200,38 @@ def main():
             with st.container():
                 st.markdown(st.session_state.analysis_result)
             
+            stats = st.session_state.get('analysis_stats')
+            if stats and stats['cache_hit']:
+                st.caption(
+                    f"⚡ Returned from cache in {stats['lookup_seconds'] * 1000:.0f} ms "
+                    f"(hash distance {stats['cache_distance']})"
+                )
+            elif stats:
+                if stats.get('time_to_first_section') is not None:
+                    st.caption(
+                        f"⚡ First section after {stats['time_to_first_section']:.1f}s "
+                        f"(first token {stats['time_to_first_token']:.1f}s, full report {stats['request_seconds']:.1f}s)"
+                    )
+                st.caption(
+                    f"📦 Sent {stats['sent_size'][0]}x{stats['sent_size'][1]} {stats['format']} "
+                    f"({stats['payload_bytes'] / 1024:,.0f} KB, detail={stats['detail']}) "
+                    f"from a {stats['original_size'][0]}x{stats['original_size'][1]} original · "
+                    f"preprocessing {stats['preprocess_seconds'] * 1000:.0f} ms · model {stats['request_seconds']:.1f}s"
+                )
+            
             # Action buttons
             col_save, col_copy, col_print = st.columns(3)
             
             with col_save:
                 if st.button("💾 Save Report"):
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"medical_analysis_{timestamp}.txt"
-                    
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        f.write(f"MEDICAL IMAGE ANALYSIS REPORT\n")
-                        f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                        f.write(f"Analysis Type: {st.session_state.analysis_type}\n")
-                        f.write(f"AI Model: {st.session_state.analysis_model}\n")
-                        f.write(f"{'='*50}\n\n")
-                        f.write(st.session_state.analysis_result)
-                        f.write(f"\n\n{'='*50}\n")
-                        f.write("DISCLAIMER: This analysis is for educational/assistance purposes only. ")
-                        f.write("Always consult qualified healthcare professionals for medical decisions.\n")
-                    
-                    st.success(f"📄 Report saved as {filename}")
+                    report_id = get_report_store().save(
+                        st.session_state.analysis_result,
+                        "medical_analysis",
+                        analysis_type=st.session_state.analysis_type,
+                        model=st.session_state.analysis_model,
+                        image_hash=st.session_state.analysis_image.key
+                    )
+                    st.success(f"📄 Report #{report_id} saved to the report library")
             
             with col_copy:
                 if st.button("📋 Copy Analysis"):
@@ -309,5 +252,202 @@ def main():
         else:
             st.info("🔬 Medical analysis results will appear here after analyzing an image")
     
+    st.markdown("---")
+    
+    # Several analysis types over the same image in one pass
+    multi_job = None
+    with st.expander("🧪 Multi-Type Analysis (one image, several analyses)"), profile_section("multi-type analysis"):
+        multi_types = st.multiselect(
+            "Analysis types",
+            list(ANALYSIS_TYPE_LABELS.keys()),
+            default=["general_analysis", "skin_analysis", "wound_analysis"],
+            format_func=lambda x: ANALYSIS_TYPE_LABELS[x]
+        )
+        single_call = st.checkbox(
+            "Single structured call",
+            help="Ask for every analysis in one request instead of one concurrent request per type"
+        )
+        if st.button("🧪 Run Multi-Type Analysis", disabled=not (api_key and image_bytes and multi_types)):
+            st.session_state.multi_job_types = multi_types
+            st.session_state.multi_job_id = job_manager.submit(
+                "multi_analysis",
+                image=image_bytes,
+                analysis_types=multi_types,
+                api_key=api_key,
+                model=model,
+                single_call=single_call
+            )
+        
+        if st.session_state.get('multi_job_id'):
+            multi_job = job_manager.poll(st.session_state.multi_job_id)
+        if multi_job:
+            if multi_job['status'] in ACTIVE_STATES:
+                st.progress(multi_job['progress'])
+                st.text(multi_job['message'])
+                wait_note = describe_wait(model, PRIORITY_STANDARD)
+                if wait_note:
+                    st.caption(f"⏳ {wait_note}")
+            elif multi_job['status'] != 'completed':
+                st.error(f"❌ Multi-type analysis {multi_job['status']}: {multi_job['error'] or multi_job['message']}")
+            results = multi_job['result'] or multi_job['partial'].get('results', {})
+            requested = st.session_state.multi_job_types
+            columns = st.columns(max(1, len(requested)))
+            for column, result_type in zip(columns, requested):
+                with column:
+                    st.markdown(f"#### {ANALYSIS_TYPE_LABELS[result_type]}")
+                    result = results.get(result_type)
+                    if result is None:
+                        st.info("⏳ Waiting...")
+                    elif result['error']:
+                        st.error(result['error'])
+                    else:
+                        st.caption(f"⏱️ {result['seconds']:.1f}s")
+                        st.markdown(result['analysis'])
+    
+    # Batch mode for folders and archives of case images
+    batch_job = None
+    with st.expander("📦 Batch Analysis (folders and zip archives)"), profile_section("batch analysis"):
+        batch_zip = st.file_uploader("Upload a zip of medical images", type=['zip'], key="batch_zip")
+        # Server folders are only offered when an input root is configured
+        batch_dir = st.text_input(
+            f"...or a folder under {SERVER_INPUT_ROOT} on the server", placeholder="case_images"
+        ) if SERVER_INPUT_ROOT else ""
+        max_workers = st.slider("Concurrent vision calls", 1, 16, 4)
+        
+        if st.button("📦 Start Batch Analysis", disabled=not (api_key and (batch_zip or batch_dir))):
+            try:
+                if batch_zip is not None:
+                    source = save_uploaded_archive(batch_zip.getvalue())
+                else:
+                    source = resolve_server_path(batch_dir)
+                    if not os.path.isdir(source):
+                        raise Exception(f"Folder not found: {batch_dir}")
+            except Exception as e:
+                st.error(str(e))
+            else:
+                # The same input, type and model always map to the same results file, so reruns resume
+                batch_id = get_batch_id(source, analysis_type, model)
+                st.session_state.batch_results_path = os.path.join(BATCH_DIR, f"batch_{batch_id}.jsonl")
+                st.session_state.batch_job_id = job_manager.submit(
+                    "batch_analysis",
+                    source=source,
+                    analysis_type=analysis_type,
+                    api_key=api_key,
+                    model=model,
+                    results_path=st.session_state.batch_results_path,
+                    max_workers=max_workers
+                )
+        
+        if st.session_state.get('batch_job_id'):
+            batch_job = job_manager.poll(st.session_state.batch_job_id)
+        if batch_job:
+            st.progress(batch_job['progress'])
+            st.text(f"{batch_job['status'].title()}: {batch_job['message']}")
+            if batch_job['status'] in ACTIVE_STATES:
+                wait_note = describe_wait(model, PRIORITY_BATCH)
+                if wait_note:
+                    st.caption(f"⏳ Batch requests run after interactive ones, {wait_note}")
+                if st.button("⏹️ Cancel Batch"):
+                    job_manager.cancel(batch_job['id'])
+            elif batch_job['status'] != 'completed':
+                if batch_job['error']:
+                    st.error(f"❌ Batch error: {batch_job['error']}")
+                if st.button("🔁 Resume Batch", disabled=not api_key):
+                    job_manager.resume(batch_job['id'], api_key=api_key)
+                    st.rerun()
+            st.dataframe(batch_job['partial'].get('rows', []), use_container_width=True)
+        
+        results_path = st.session_state.get('batch_results_path')
+        if results_path and os.path.exists(results_path):
+            col_csv, col_jsonl = st.columns(2)
+            with col_csv:
+                st.download_button("📥 Export CSV", export_batch_csv(results_path),
+                                   file_name="batch_analysis.csv", mime="text/csv")
+            with col_jsonl:
+                st.download_button("📥 Export JSONL", export_batch_jsonl(results_path),
+                                   file_name="batch_analysis.jsonl", mime="application/json")
+    
+    # Tiled mode for whole-slide exports and very large scans
+    tiled_job = None
+    with st.expander("🧩 Tiled Analysis (very large images)"), profile_section("tiled analysis"):
+        st.caption("The image is read region by region; the most informative tiles are analyzed and then summarized.")
+        tiled_upload = st.file_uploader(
+            "Upload a large image",
+            type=['png', 'jpg', 'jpeg', 'tif', 'tiff', 'svs', 'ndpi', 'mrxs', 'scn'],
+            key="tiled_upload"
+        )
+        # Server files are only offered when an input root is configured
+        tiled_path = st.text_input(
+            f"...or a file under {SERVER_INPUT_ROOT} on the server", placeholder="slides/case_001.svs"
+        ) if SERVER_INPUT_ROOT else ""
+        max_tiles = st.slider("Tiles to analyze", 4, 32, 12)
+        
+        if st.button("🧩 Start Tiled Analysis", disabled=not (api_key and (tiled_upload or tiled_path))):
+            try:
+                if tiled_upload is not None:
+                    source = save_uploaded_image(tiled_upload)
+                else:
+                    source = resolve_server_path(tiled_path)
+                    if not os.path.isfile(source):
+                        raise Exception(f"File not found: {tiled_path}")
+            except Exception as e:
+                st.error(str(e))
+            else:
+                st.session_state.tiled_job_id = job_manager.submit(
+                    "tiled_analysis",
+                    path=source,
+                    analysis_type=analysis_type,
+                    api_key=api_key,
+                    model=model,
+                    max_tiles=max_tiles,
+                    # Uploads are private copies and are removed once the job completes
+                    delete_input=tiled_upload is not None
+                )
+        
+        if st.session_state.get('tiled_job_id'):
+            tiled_job = job_manager.poll(st.session_state.tiled_job_id)
+        if tiled_job:
+            st.progress(tiled_job['progress'])
+            st.text(f"{tiled_job['status'].title()}: {tiled_job['message']}")
+            if tiled_job['status'] in ACTIVE_STATES:
+                wait_note = describe_wait(model, PRIORITY_BATCH)
+                if wait_note:
+                    st.caption(f"⏳ Tile requests run after interactive ones, {wait_note}")
+                if st.button("⏹️ Cancel Tiled Analysis"):
+                    job_manager.cancel(tiled_job['id'])
+            elif tiled_job['status'] == 'completed':
+                result = tiled_job['result']
+                st.markdown(f"### 🧩 Summary ({result['image_size'][0]:,}x{result['image_size'][1]:,} px image)")
+                if result.get('failed_tiles'):
+                    st.warning(f"⚠️ {result['failed_tiles']} tiles could not be analyzed and are left out of the summary")
+                st.markdown(result['summary'])
+            else:
+                st.error(f"❌ Tiled analysis {tiled_job['status']}: {tiled_job['error'] or tiled_job['message']}")
+                if st.button("🔁 Retry Tiled Analysis", disabled=not api_key):
+                    job_manager.resume(tiled_job['id'], api_key=api_key)
+                    st.rerun()
+            
+            tiles = tiled_job['result']['tiles'] if tiled_job['result'] else tiled_job['partial'].get('tiles', [])
+            for tile in tiles:
+                col_tile, col_findings = st.columns([1, 3])
+                if tile.get('error'):
+                    with col_tile:
+                        st.caption(f"Tile {tile['index']}")
+                    with col_findings:
+                        st.error(f"❌ {tile['error']}")
+                    continue
+                with col_tile:
+                    st.image(tile['thumbnail'], caption=f"Tile {tile['index']}")
+                with col_findings:
+                    st.markdown(tile['analysis'])
+    
+    st.sidebar.caption(format_memory_usage(get_session_store(st.session_state).memory_usage()))
+    finish_rerun_profile(st.sidebar.caption)
+    
+    # Keep polling while background jobs run
+    if any(job and job['status'] in ACTIVE_STATES for job in (analysis_job, multi_job, batch_job, tiled_job)):
+        time.sleep(1)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,11 +2,7 @@ import streamlit as st
 import sys
 import os
 from dotenv import load_dotenv
-import PyPDF2
-import io
-from typing import List, Dict
-import hashlib
-import pickle
+from typing import Dict
 
 # Load environment variables
 load_dotenv()
@@ -14,115 +10,10 @@ load_dotenv()
 # Add the parent directory to the path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from openai import OpenAI
-
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-class PDFProcessor:
-    def __init__(self):
-        self.pdf_cache_dir = "pdf_cache"
-        if not os.path.exists(self.pdf_cache_dir):
-            os.makedirs(self.pdf_cache_dir)
-    
-    def extract_text_from_pdf(self, pdf_file) -> str:
-        """Extract text from a PDF file"""
-        try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_file.read()))
-            text = ""
-            for page_num, page in enumerate(pdf_reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
-                except Exception as e:
-                    st.warning(f"Could not extract text from page {page_num + 1}: {str(e)}")
-                    continue
-            return text
-        except Exception as e:
-            st.error(f"Error processing PDF {pdf_file.name}: {str(e)}")
-            return ""
-    
-    def get_file_hash(self, pdf_file) -> str:
-        """Generate hash for file caching"""
-        pdf_file.seek(0)
-        content = pdf_file.read()
-        pdf_file.seek(0)
-        return hashlib.md5(content).hexdigest()
-    
-    def cache_pdf_content(self, file_hash: str, content: str, filename: str):
-        """Cache extracted PDF content"""
-        cache_data = {
-            'content': content,
-            'filename': filename
-        }
-        cache_path = os.path.join(self.pdf_cache_dir, f"{file_hash}.pkl")
-        with open(cache_path, 'wb') as f:
-            pickle.dump(cache_data, f)
-    
-    def load_cached_content(self, file_hash: str) -> Dict:
-        """Load cached PDF content"""
-        cache_path = os.path.join(self.pdf_cache_dir, f"{file_hash}.pkl")
-        if os.path.exists(cache_path):
-            with open(cache_path, 'rb') as f:
-                return pickle.load(f)
-        return None
-
-def get_pdf_based_response(question: str, pdf_contents: Dict[str, str], chat_history: List = None) -> tuple:
-    """Get response based only on PDF content"""
-    
-    # Combine all PDF contents
-    combined_content = ""
-    for filename, content in pdf_contents.items():
-        combined_content += f"\n\n=== Content from {filename} ===\n{content}\n"
-    
-    if not combined_content.strip():
-        return "I don't have any PDF content to answer your question. Please upload some PDF files first.", chat_history or []
-    
-    # Create system prompt
-    system_prompt = f"""You are a helpful assistant that answers questions ONLY based on the provided PDF content. 
-
-IMPORTANT RULES:
-1. Only use information from the provided PDF content below
-2. If the answer is not in the PDF content, clearly state "I cannot find this information in the uploaded PDF documents"
-3. Always cite which document/page the information comes from when possible
-4. Be accurate and don't make up information not present in the PDFs
-5. If asked about something not in the PDFs, politely explain that you can only answer based on the uploaded documents
-
-PDF CONTENT:
-{combined_content}
-
-Remember: Answer ONLY based on the above PDF content."""
-
-    # Prepare messages
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    # Add chat history if available
-    if chat_history:
-        messages.extend(chat_history)
-    
-    # Add current question
-    messages.append({"role": "user", "content": question})
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.3  # Lower temperature for more factual responses
-        )
-        
-        reply = response.choices[0].message.content
-        
-        # Update chat history
-        updated_history = chat_history if chat_history else []
-        updated_history.append({"role": "user", "content": question})
-        updated_history.append({"role": "assistant", "content": reply})
-        
-        return reply, updated_history
-        
-    except Exception as e:
-        error_msg = f"Error getting response: {str(e)}"
-        return error_msg, chat_history or []
+from pdf_qa import get_pdf_processor, get_pdf_based_response, load_document_texts
+from document_store import get_document_store
+from rate_limits import describe_wait, PRIORITY_INTERACTIVE
+from rerun_profiler import start_rerun_profile, profile_section, finish_rerun_profile
 
 # Streamlit App Configuration
 st.set_page_config(
@@ -130,6 +21,7 @@ st.set_page_config(
     page_icon="📚", 
     layout="wide"
 )
+start_rerun_profile(__file__)
 
 # Custom CSS
 st.markdown("""
@@ -164,15 +56,22 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if "pdf_contents" not in st.session_state:
-    st.session_state.pdf_contents = {}
+# pdf_documents maps filename -> DocumentRef; the texts, page indexes and word
+# counts live once per file in the shared document store
+if "pdf_documents" not in st.session_state:
+    st.session_state.pdf_documents = {}
 if "pdf_chat_history" not in st.session_state:
     st.session_state.pdf_chat_history = []
 if "pdf_input_key" not in st.session_state:
     st.session_state.pdf_input_key = 0
 
-# Initialize PDF processor
-pdf_processor = PDFProcessor()
+# Shared PDF processor and document store, created once per process rather than on every rerun
+pdf_processor = get_pdf_processor()
+document_store = get_document_store()
+
+def load_pdf_contents() -> Dict[str, str]:
+    """Read the session's documents back from the document store for a question"""
+    return load_document_texts(st.session_state.pdf_documents.values())
 
 # Header
 st.title("📚 PDF-Based AI Assistant")
@@ -195,67 +94,62 @@ with st.sidebar:
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        for i, uploaded_file in enumerate(uploaded_files):
-            status_text.text(f"Processing {uploaded_file.name}...")
+        with profile_section("process uploads"):
+            for i, uploaded_file in enumerate(uploaded_files):
+                status_text.text(f"Processing {uploaded_file.name}...")
             
-            # Check if file is already processed
-            file_hash = pdf_processor.get_file_hash(uploaded_file)
-            cached_data = pdf_processor.load_cached_content(file_hash)
+                # Text already extracted by any session or replica is reused
+                try:
+                    document, from_cache = pdf_processor.load_document(uploaded_file)
+                except Exception as e:
+                    st.error(str(e))
+                    document, from_cache = None, False
             
-            if cached_data:
-                st.session_state.pdf_contents[uploaded_file.name] = cached_data['content']
-                status_text.text(f"✅ Loaded from cache: {uploaded_file.name}")
-            else:
-                # Extract text
-                extracted_text = pdf_processor.extract_text_from_pdf(uploaded_file)
-                if extracted_text:
-                    st.session_state.pdf_contents[uploaded_file.name] = extracted_text
-                    # Cache the content
-                    pdf_processor.cache_pdf_content(file_hash, extracted_text, uploaded_file.name)
-                    status_text.text(f"✅ Processed: {uploaded_file.name}")
+                if document:
+                    st.session_state.pdf_documents[uploaded_file.name] = document
+                    status_text.text(f"✅ Loaded from cache: {uploaded_file.name}" if from_cache else f"✅ Processed: {uploaded_file.name}")
                 else:
                     status_text.text(f"❌ Failed to process: {uploaded_file.name}")
             
-            progress_bar.progress((i + 1) / len(uploaded_files))
+                progress_bar.progress((i + 1) / len(uploaded_files))
         
         status_text.text("✅ All files processed!")
-        st.success(f"Successfully processed {len(st.session_state.pdf_contents)} PDF files!")
+        st.success(f"Successfully processed {len(st.session_state.pdf_documents)} PDF files!")
     
     # Display loaded PDFs
-    if st.session_state.pdf_contents:
+    if st.session_state.pdf_documents:
         st.markdown("### 📋 Loaded Documents")
-        for filename, content in st.session_state.pdf_contents.items():
-            word_count = len(content.split())
+        for filename, document in st.session_state.pdf_documents.items():
             st.markdown(f"""
             <div class="pdf-card">
                 <strong>📄 {filename}</strong><br>
-                <small>{word_count:,} words extracted</small>
+                <small>{document.words:,} words extracted from {document.pages:,} pages</small>
             </div>
             """, unsafe_allow_html=True)
         
         # Clear all PDFs button
         if st.button("🗑️ Clear All PDFs", type="secondary"):
-            st.session_state.pdf_contents = {}
+            st.session_state.pdf_documents = {}
             st.session_state.pdf_chat_history = []
             st.session_state.pdf_input_key += 1
             st.rerun()
     
     # Statistics
-    if st.session_state.pdf_contents:
+    if st.session_state.pdf_documents:
         st.markdown("### 📊 Document Statistics")
-        total_words = sum(len(content.split()) for content in st.session_state.pdf_contents.values())
-        total_chars = sum(len(content) for content in st.session_state.pdf_contents.values())
+        total_words = sum(document.words for document in st.session_state.pdf_documents.values())
+        total_bytes = sum(document.nbytes for document in st.session_state.pdf_documents.values())
         
         st.markdown(f"""
         <div class="stats-card">
-            <h4>{len(st.session_state.pdf_contents)} Documents</h4>
+            <h4>{len(st.session_state.pdf_documents)} Documents</h4>
             <p>{total_words:,} Total Words</p>
-            <p>{total_chars:,} Total Characters</p>
+            <p>{total_bytes / 1024:,.0f} KB of Text</p>
         </div>
         """, unsafe_allow_html=True)
 
 # Main content area
-if not st.session_state.pdf_contents:
+if not st.session_state.pdf_documents:
     # Welcome screen
     st.markdown("""
     <div class="upload-section">
@@ -322,14 +216,15 @@ else:
         """, unsafe_allow_html=True)
         
         # Display chat history
-        if st.session_state.pdf_chat_history:
-            for message in st.session_state.pdf_chat_history:
-                if message["role"] == "user":
-                    with st.chat_message("user"):
-                        st.write(message['content'])
-                else:
-                    with st.chat_message("assistant"):
-                        st.write(message['content'])
+        with profile_section("render history"):
+            if st.session_state.pdf_chat_history:
+                for message in st.session_state.pdf_chat_history:
+                    if message["role"] == "user":
+                        with st.chat_message("user"):
+                            st.write(message['content'])
+                    else:
+                        with st.chat_message("assistant"):
+                            st.write(message['content'])
         
         # Chat input
         with st.form(key="pdf_chat_form", clear_on_submit=True):
@@ -363,11 +258,12 @@ else:
         
         # Process question
         if submit_button and user_question and user_question.strip():
-            with st.spinner("🔍 Searching through your PDFs..."):
+            wait_note = describe_wait("gpt-4", PRIORITY_INTERACTIVE)
+            with st.spinner(f"🔍 Searching through your PDFs... ({wait_note})" if wait_note else "🔍 Searching through your PDFs..."), profile_section("pdf question"):
                 try:
                     response, updated_history = get_pdf_based_response(
                         user_question,
-                        st.session_state.pdf_contents,
+                        load_pdf_contents(),
                         st.session_state.pdf_chat_history
                     )
                     st.session_state.pdf_chat_history = updated_history
@@ -392,7 +288,19 @@ else:
         
         st.metric("Total Messages", total_messages)
         st.metric("Questions Asked", user_messages)
-        
+
+        # Check a cited page; only that page is read from the document store
+        st.markdown("### 📖 Page Viewer")
+        viewed_filename = st.selectbox("Document", list(st.session_state.pdf_documents.keys()), key="page_viewer_document")
+        viewed_document = st.session_state.pdf_documents[viewed_filename]
+        # Numbered as in the PDF; pages whose text couldn't be extracted are missing
+        viewed_page = st.selectbox("Page", document_store.pages(viewed_document.file_hash), key="page_viewer_page")
+        with st.expander(f"{viewed_filename} · page {viewed_page}"):
+            try:
+                st.text(document_store.read_page(viewed_document.file_hash, viewed_page))
+            except Exception as e:
+                st.error(str(e))
+
         # Tips
         st.markdown("### 💡 Tips")
         st.info("""
@@ -416,4 +324,6 @@ st.markdown("---")
 st.markdown("""
 **Note:** This assistant only provides information based on the uploaded PDF documents. 
 For questions outside the scope of your documents, please consult other sources.
-""")
\ No newline at end of file
+""")
+
+finish_rerun_profile(st.sidebar.caption)
@@ -0,0 +1,112 @@
+import streamlit as st
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Add the parent directory to the path to import the shared modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from report_store import get_report_store, format_report, import_legacy_reports, REPORT_TYPES
+from rerun_profiler import start_rerun_profile, profile_section, finish_rerun_profile
+
+# Configure page
+st.set_page_config(
+    page_title="Report Library",
+    page_icon="🗂️",
+    layout="wide"
+)
+
+FACET_LABELS = {
+    "report_type": "Report Type",
+    "analysis_type": "Analysis Type",
+    "model": "AI Model",
+    "condition": "Condition"
+}
+DATE_RANGES = {
+    "Any time": None,
+    "Last 24 hours": timedelta(days=1),
+    "Last 7 days": timedelta(days=7),
+    "Last 30 days": timedelta(days=30)
+}
+PAGE_SIZE = 25
+
+def main():
+    start_rerun_profile(__file__)
+    st.title("🗂️ Report Library")
+    st.markdown("Search every saved medical analysis and disease progression report")
+
+    store = get_report_store()
+    query = st.text_input("🔍 Search reports", placeholder="e.g. melanoma asymmetr*")
+
+    # Facet filters, each showing how many matching reports it would select
+    filters = {}
+    with st.sidebar:
+        st.header("🔎 Filters")
+        with profile_section("facet counts"):
+            facets = store.facets(query, **{
+                field: st.session_state.get(f"facet_{field}") for field in FACET_LABELS
+            })
+        for field, label in FACET_LABELS.items():
+            counts = dict(facets[field])
+            options = [None] + list(counts.keys())
+            if st.session_state.get(f"facet_{field}") not in options:
+                st.session_state[f"facet_{field}"] = None
+            filters[field] = st.selectbox(
+                label,
+                options,
+                format_func=lambda value, counts=counts: "All" if value is None else f"{value} ({counts[value]})",
+                key=f"facet_{field}"
+            )
+        date_range = DATE_RANGES[st.selectbox("Saved", list(DATE_RANGES.keys()))]
+        if date_range is not None:
+            filters["since"] = (datetime.now() - date_range).timestamp()
+
+        st.markdown("---")
+        st.subheader("📥 Legacy Reports")
+        if st.button("Import old report files"):
+            imported = import_legacy_reports()
+            st.success(f"Imported {imported} report files")
+
+    search_start = time.perf_counter()
+    with profile_section("search"):
+        total = store.count(query, **filters)
+        page_count = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1) if page_count > 1 else 1
+        reports = store.search(query, limit=PAGE_SIZE, offset=(page - 1) * PAGE_SIZE, **filters)
+    st.caption(f"{total:,} reports found in {(time.perf_counter() - search_start) * 1000:.0f} ms")
+
+    # Bulk export of everything matching the current search, built only on request
+    export_format = st.radio("Export format", ["jsonl", "csv"], horizontal=True, format_func=str.upper)
+    if st.button("📦 Prepare Export", disabled=total == 0):
+        with profile_section("export"):
+            st.session_state.report_export = (export_format, store.export(export_format, query, **filters))
+    if st.session_state.get('report_export'):
+        export_format, data = st.session_state.report_export
+        st.download_button(
+            f"📥 Download {export_format.upper()} Export",
+            data=data,
+            file_name=f"reports.{export_format}",
+            mime="text/csv" if export_format == "csv" else "application/json"
+        )
+
+    with profile_section("render reports"):
+        for report in reports:
+            saved = datetime.fromtimestamp(report['created_at']).strftime('%Y-%m-%d %H:%M')
+            subject = report['condition'] or report['analysis_type'] or "Report"
+            with st.expander(f"#{report['id']} · {subject} · {REPORT_TYPES[report['report_type']].title()} · {saved}"):
+                st.markdown(report['body'])
+                st.download_button(
+                    "📄 Download",
+                    data=format_report(report),
+                    file_name=f"{report['report_type']}_{report['id']}.txt",
+                    mime="text/plain",
+                    key=f"download_report_{report['id']}"
+                )
+
+    if not reports:
+        st.info("No saved reports match this search")
+
+    finish_rerun_profile(st.sidebar.caption)
+
+if __name__ == "__main__":
+    main()
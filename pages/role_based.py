@@ -8,47 +8,13 @@ load_dotenv()
 
 #add the parent directory to the path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_openai_response
-
-#Role-Based System Prompts 
-ROLE_PROMPTS = {
-    "Default": "You are a helpful assistant",
-    "Teacher" : "You are an experienced and patient school teacher who explain concepts clearly with examples and encourage learning. Use simple language and break down complex topics into easy-to-understand parts",
-    "Doctor": "You are a professional medical doctor who provides advice based on symptoms. Always remind users to consult with a real healthcare provider for serious concerns. Be informative but responsible.",
-    "Lawyer": "You are a legal expert who explains laws and rights in simple terms. Provide general legal information but always advise users to consult with a qualified attorney for specific legal matters.",
-    "Fitness Coach": "You are a motivating fitness coach who gives health and exercise guidance. Be encouraging, provide practical tips, and always emphasize safety and gradual progress.",
-    "Career Advisor": "You are a career advisor helping people choose jobs and build resumes. Provide practical advice about career development, job searching, and professional growth."
-}
-
-
-def get_role_response(prompt, chat_history, role):
-    """Get Response with role-specific system prompt"""
-    messages = [{"role": "system", "content": ROLE_PROMPTS[role]}]
-    #Add Chat History
-    if chat_history:
-        messages.extend(chat_history)
-
-    messages.append({"role": "user", "content": prompt})
-
-    from openai import OpenAI
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages= messages
-    )
-
-    reply = response.choices[0].message.content
-
-    #Update Chat History
-    update_history = chat_history if chat_history else []
-    update_history.append({"role":"user", "content": prompt})
-    update_history.append({"role":"assistant", "content": reply})
-
-    return reply, update_history
+from role_chat import ROLE_PROMPTS, get_role_response
+from rate_limits import describe_wait, PRIORITY_INTERACTIVE
+from rerun_profiler import start_rerun_profile, profile_section, finish_rerun_profile
 
 #Streamlit
 st.set_page_config(page_title="Role_based AI Assistant", page_icon="-", layout="wide")
+start_rerun_profile(__file__)
 
 #Custom CSS For Better Styling
 
@@ -151,18 +117,19 @@ with col1:
 
     #Display Chat History
 
-    if st.session_state.role_chat_history:
-        st.markdown("## Conversation")
+    with profile_section("render history"):
+        if st.session_state.role_chat_history:
+            st.markdown("## Conversation")
 
-        for i, message in enumerate(st.session_state.role_chat_history):
-            if message["role"] == "user":
-                with st.chat_message("user"):
-                    st.write(message['content'])
-            else:
-                with st.chat_message("assistant"):
-                    st.write(message['content'])
-    else:
-        st.info(f"Hello! I am your {selected_role} assistant. How can I help you today?")
+            for i, message in enumerate(st.session_state.role_chat_history):
+                if message["role"] == "user":
+                    with st.chat_message("user"):
+                        st.write(message['content'])
+                else:
+                    with st.chat_message("assistant"):
+                        st.write(message['content'])
+        else:
+            st.info(f"Hello! I am your {selected_role} assistant. How can I help you today?")
 
     #Chat Input Form 
     with st.form(key="role_chat_form", clear_on_submit=True):
@@ -175,7 +142,8 @@ with col1:
         submit_button = st.form_submit_button("Send")
 
     if submit_button and user_input and user_input.strip():
-        with st.spinner(f"....{selected_role} is thinking..."):
+        wait_note = describe_wait("gpt-4", PRIORITY_INTERACTIVE)
+        with st.spinner(f"....{selected_role} is thinking... ({wait_note})" if wait_note else f"....{selected_role} is thinking..."), profile_section("chat request"):
             try:
                 response, updated_history = get_role_response(
                     user_input,
@@ -198,9 +166,4 @@ with col2:
     st.metric("Total Messages", total_messages)
     st.metric("Your Messages", user_message)
 
-    
-
-          
-
-
-        
\ No newline at end of file
+finish_rerun_profile(st.sidebar.caption)
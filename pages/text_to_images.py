@@ -1,20 +1,43 @@
 import streamlit as st
-import openai
-import requests
-from PIL import Image
-import io
 import os
+import sys
 from datetime import datetime
 from dotenv import load_dotenv
 
+#add the parent directory to the path to import the shared modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_library import get_image_library
+from image_generation import generate_images
+from rate_limits import describe_wait, PRIORITY_STANDARD
+from rerun_profiler import start_rerun_profile, profile_section, finish_rerun_profile
+
 #Load Emnironemnt 
 load_dotenv()
 
+LIBRARY_PAGE_SIZE = 12
+
+def render_library_image(library, digest, caption, key_prefix):
+    """Show a library image from local storage with an on-request full-resolution download"""
+    st.image(library.thumbnail(digest), caption=caption, use_column_width=True)
+    download_keys = st.session_state.setdefault("download_ready", set())
+    if digest in download_keys:
+        st.download_button(
+            label="Download Image",
+            data=library.image_bytes(digest),
+            file_name=f"generated_image_{digest[:12]}.png",
+            mime="image/png",
+            key=f"{key_prefix}_download_{digest}"
+        )
+    elif st.button("Prepare Download", key=f"{key_prefix}_prepare_{digest}"):
+        download_keys.add(digest)
+        st.rerun()
+
 #Configure Page
 st.set_page_config(page_title="AI Image Generator Hub",
                    page_icon="+^",
                    layout="wide"
                    )
+start_rerun_profile(__file__)
 
 #Title and Description
 st.title("AI Image Generator")
@@ -31,14 +54,12 @@ else:
     api_key = st.sidebar.text_input("OpenAI API Key", type="password", help="Enter Your OpenAI API Key")
 
 if api_key:
-    openai.api_key = api_key
-
     #Image Generator Paramete
     st.sidebar.subheader("Generate Parameter")
     #Model Selection
     model = st.sidebar.selectbox(
         "Model",
-        ["dall-e-3", "dalle-e-2"],
+        ["dall-e-3", "dall-e-2"],
         help="Choose the DALL-E Model Version"
     )
 
@@ -65,7 +86,8 @@ if api_key:
     if model == "dall-e-2":
         n_images = st.sidebar.slider("Number of Images", 1,4,1)
     else:
-        n_images = 1
+        #DALL-E 3 returns one image per request, so variations are generated concurrently
+        n_images = st.sidebar.slider("Variations", 1,4,1, help="Each variation is a separate request, run in parallel")
 
 #Main Content Area
 
@@ -115,55 +137,74 @@ with col1:
         elif not prompt:
             st.error("Please enter a text prompt")
         else:
-            try:
-                with st.spinner("Generating image ... This may take a few seconds"):
-                    response = openai.images.generate(
-                        prompt=prompt,
-                        model=model,
-                        n=n_images,
-                        size=size,
-                        quality=quality if model == "dall-e-3" else None,
-                        style=style if model == "dall-e-3" else None,
-                        response_format="url"
+            #show each image as soon as its request finishes
+            wait_note = describe_wait(model, PRIORITY_STANDARD, requests=n_images)
+            st.caption(f"Generating {n_images} image(s) ... {wait_note or 'This may take a few seconds'}")
+            arrivals = [st.empty() for _ in range(n_images)]
+
+            def show_arrival(index, digest, elapsed):
+                arrivals[index].image(
+                    get_image_library().thumbnail(digest),
+                    caption=f"Image {index+1} ready after {elapsed:.1f}s",
+                    width=256
+                )
+
+            with profile_section("generate images"):
+                try:
+                    digests, errors = generate_images(
+                        prompt, api_key, model, size, n_images,
+                        quality=quality, style=style, on_image=show_arrival
                     )
-                    #store Generated Images in session state
-                    st.session_state.generated_images = response.data
-                    st.session_state.current_prompt = prompt
-                    st.success("Image generated successfully!")
-            except Exception as e:
-                st.error(f"Error generating image: {str(e)}")
-with col2:
+                    for arrival in arrivals:
+                        arrival.empty()
+                    for error in errors:
+                        st.error(f"Error generating image: {error}")
+                    if digests:
+                        #session state keeps only library digests
+                        st.session_state.generated_images = digests
+                        st.session_state.current_prompt = prompt
+                        st.success(f"{len(digests)} image(s) generated successfully!")
+                except Exception as e:
+                    st.error(f"Error generating image: {str(e)}")
+with col2, profile_section("render generated images"):
     st.subheader("Generated Images")
 
-    #displaying generated imnages
+    #displaying generated images from the local library, without network access
     if hasattr(st.session_state,"generated_images") and st.session_state.generated_images:
-        for i, image_data in enumerate(st.session_state.generated_images):
+        library = get_image_library()
+        for i, digest in enumerate(st.session_state.generated_images):
             try:
-                #download and display image
-                image_response = requests.get(image_data.url)
-                image = Image.open(io.BytesIO(image_response.content))
-                st.image(image, caption=f"Generated Image {i+1}", use_column_width=True)
-                #download image
-                img_buffer = io.BytesIO()
-                image.save(img_buffer, format="PNG")
-                img_buffer.seek(0)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"generated_image_{timestamp}_{i+1}.png"
-                st.download_button(
-                    label=f"Download Image",
-                    data=img_buffer.getvalue(),
-                    file_name=filename,
-                    mime="image/png"
-                )
+                render_library_image(library, digest, f"Generated Image {i+1}", "current")
 
                 #show prompt used
                 if hasattr(st.session_state, "current_prompt"):
                     st.caption(f"Prompt: {st.session_state.current_prompt}")
-                
 
             except Exception as e:
                 st.error(f"Error displaying image {i+1}: {str(e)}")
 
     else:
         st.info("Generated images will appear here")
-        
\ No newline at end of file
+        
+#Browse past generations
+st.markdown("---")
+st.subheader("Image Library")
+library = get_image_library()
+library_query = st.text_input("Search prompts", placeholder="e.g. knee MRI")
+with profile_section("render library"):
+    library_total = library.count(library_query)
+    if library_total:
+        library_pages = (library_total + LIBRARY_PAGE_SIZE - 1) // LIBRARY_PAGE_SIZE
+        library_page = st.number_input("Page", min_value=1, max_value=library_pages, value=1) if library_pages > 1 else 1
+        st.caption(f"{library_total} images in the library")
+        entries = library.search(library_query, limit=LIBRARY_PAGE_SIZE, offset=(library_page - 1) * LIBRARY_PAGE_SIZE)
+        library_columns = st.columns(4)
+        for i, entry in enumerate(entries):
+            with library_columns[i % 4]:
+                created = datetime.fromtimestamp(entry["created_at"]).strftime("%Y-%m-%d %H:%M")
+                render_library_image(library, entry["digest"], f"{entry['model']} · {entry['size']} · {created}", "library")
+                st.caption(entry["prompt"])
+    else:
+        st.info("Images you generate are kept here")
+
+finish_rerun_profile(st.sidebar.caption)
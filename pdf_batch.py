@@ -0,0 +1,225 @@
+"""Answer a fixed list of questions over a directory of PDFs
+
+    python pdf_batch.py docs/ questions.txt -o answers.jsonl
+    python pdf_batch.py docs/ questions.jsonl -o answers.jsonl --workers 8
+
+Questions come one per line from a text file (blank lines and lines starting
+with # are skipped) or as JSONL objects with a "question" and optional "id".
+Text is extracted through the shared PDFProcessor cache, so documents seen by
+the app or an earlier run are not parsed again. Each answer is appended to the
+output as soon as it arrives, with the documents and pages it cites and how
+long it took; re-running the same command skips questions already answered
+for the same set of documents.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pdf_qa import PDF_QA_MODEL, answer_pdf_question, get_pdf_processor
+from rate_limits import PRIORITY_BATCH
+
+DEFAULT_WORKERS = 4
+
+# "page 3", "pages 3-5", "pages 2, 4 and 7"
+_PAGE_REFERENCE = re.compile(
+    r"\bpages?\s+(\d+(?:\s*(?:-|–|to)\s*\d+)?(?:\s*(?:,|and|&)\s*\d+(?:\s*(?:-|–|to)\s*\d+)?)*)",
+    re.IGNORECASE
+)
+_PAGE_RANGE = re.compile(r"(\d+)(?:\s*(?:-|–|to)\s*(\d+))?")
+MAX_CITED_RANGE = 50
+
+
+def load_questions(path):
+    """Return [(question_id, question)]; ids default to a hash of the question text"""
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                question = item["question"]
+                question_id = str(item.get("id") or hashlib.sha1(question.encode('utf-8')).hexdigest()[:12])
+            else:
+                question = line
+                question_id = hashlib.sha1(question.encode('utf-8')).hexdigest()[:12]
+            questions.append((question_id, question))
+    return questions
+
+
+def load_corpus(directory, max_workers=DEFAULT_WORKERS):
+    """Extract (or load from cache) every PDF under directory
+
+    Returns (corpus_id, contents) where contents maps the path relative to
+    directory to its text and corpus_id identifies this exact set of documents.
+    """
+    paths = sorted(
+        os.path.join(root, filename)
+        for root, _, files in os.walk(directory) for filename in files if filename.lower().endswith(".pdf")
+    )
+    if not paths:
+        raise Exception(f"No PDF files found in {directory}")
+    processor = get_pdf_processor()
+
+    def process(path):
+        name = os.path.relpath(path, directory)
+        with open(path, 'rb') as f:
+            file_hash, text, from_cache = processor.process(f, name)
+        return name, file_hash, text, from_cache
+
+    documents = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for name, file_hash, text, from_cache in executor.map(process, paths):
+            if not text:
+                print(f"skipped {name}: no text extracted", file=sys.stderr)
+                continue
+            print(f"{'cached' if from_cache else 'extracted'} {name}", file=sys.stderr)
+            documents.append((name, file_hash, text))
+    corpus_id = hashlib.sha1(",".join(sorted(file_hash for _, file_hash, _ in documents)).encode()).hexdigest()[:16]
+    return corpus_id, {name: text for name, _, text in documents}
+
+
+def _cited_pages(reference):
+    pages = set()
+    for match in _PAGE_RANGE.finditer(reference):
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first <= last <= first + MAX_CITED_RANGE:
+            pages.update(range(first, last + 1))
+        else:
+            pages.add(first)
+    return pages
+
+
+def extract_citations(answer, filenames):
+    """Documents and pages an answer cites, matched line by line
+
+    Page references count for the documents named on the same line, or for
+    the only document when the corpus has just one.
+    """
+    citations = {}
+    for line in answer.splitlines():
+        lowered = line.lower()
+        named = [
+            filename for filename in filenames
+            if filename.lower() in lowered or os.path.splitext(os.path.basename(filename))[0].lower() in lowered
+        ]
+        pages = set()
+        for match in _PAGE_REFERENCE.finditer(line):
+            pages.update(_cited_pages(match.group(1)))
+        if not named and pages and len(filenames) == 1:
+            named = list(filenames)
+        for filename in named:
+            citations.setdefault(filename, set()).update(pages)
+    return [{"document": filename, "pages": sorted(pages)} for filename, pages in citations.items()]
+
+
+def load_answers(output_path):
+    """Load the records written so far, keyed by (question_id, corpus); later lines win"""
+    records = {}
+    if os.path.exists(output_path):
+        with open(output_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A partially written last line from an interrupted run
+                    continue
+                records[(record["question_id"], record["corpus"])] = record
+    return records
+
+
+def _answer_one(question_id, question, corpus_id, contents):
+    start_time = time.perf_counter()
+    record = {"question_id": question_id, "question": question, "corpus": corpus_id, "model": PDF_QA_MODEL}
+    try:
+        answer = answer_pdf_question(question, contents, priority=PRIORITY_BATCH)
+        record.update(status="ok", answer=answer, citations=extract_citations(answer, list(contents)), error=None)
+    except Exception as e:
+        record.update(status="error", answer=None, citations=[], error=str(e))
+    record["seconds"] = round(time.perf_counter() - start_time, 3)
+    return record
+
+
+def run_pdf_batch(directory, questions_path, output_path, max_workers=DEFAULT_WORKERS, on_result=None):
+    """Answer every question not yet answered for this corpus, appending each record to output_path
+
+    Returns a summary with counts and the wall time.
+    """
+    start_time = time.perf_counter()
+    corpus_id, contents = load_corpus(directory, max_workers)
+    extract_seconds = time.perf_counter() - start_time
+    questions = load_questions(questions_path)
+    completed = {key for key, record in load_answers(output_path).items() if record["status"] == "ok"}
+    pending = [(question_id, question) for question_id, question in questions if (question_id, corpus_id) not in completed]
+    summary = {
+        "corpus": corpus_id, "documents": len(contents), "questions": len(questions),
+        "skipped": len(questions) - len(pending), "answered": 0, "failed": 0,
+        "extract_seconds": round(extract_seconds, 3)
+    }
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    write_lock = threading.Lock()
+    with open(output_path, 'a+', encoding='utf-8') as output_file:
+        # Terminate a line left half-written by an interrupted run
+        if output_file.tell() > 0:
+            output_file.seek(output_file.tell() - 1)
+            if output_file.read(1) != "\n":
+                output_file.write("\n")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_answer_one, question_id, question, corpus_id, contents)
+                for question_id, question in pending
+            ]
+            try:
+                for future in as_completed(futures):
+                    record = future.result()
+                    with write_lock:
+                        output_file.write(json.dumps(record) + "\n")
+                        output_file.flush()
+                    summary["answered" if record["status"] == "ok" else "failed"] += 1
+                    if on_result:
+                        on_result(record)
+            except KeyboardInterrupt:
+                # Answers already written are kept; the next run picks up the rest
+                for future in futures:
+                    future.cancel()
+                raise
+    summary["seconds"] = round(time.perf_counter() - start_time, 3)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a list of questions over a directory of PDFs")
+    parser.add_argument("directory", help="Directory searched recursively for PDF files")
+    parser.add_argument("questions", help="Text file with one question per line, or JSONL with question/id")
+    parser.add_argument("-o", "--output", default="answers.jsonl", help="JSONL file answers are appended to")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Questions answered concurrently")
+    args = parser.parse_args()
+
+    done = [0]
+
+    def on_result(record):
+        done[0] += 1
+        status = "ok" if record["status"] == "ok" else f"error: {record['error']}"
+        print(f"[{done[0]}] {record['question_id']} {record['seconds']:.1f}s {status}", file=sys.stderr)
+
+    summary = run_pdf_batch(args.directory, args.questions, args.output, args.workers, on_result)
+    print(
+        f"{summary['answered']} answered, {summary['failed']} failed, {summary['skipped']} already done "
+        f"over {summary['documents']} documents in {summary['seconds']:.1f}s -> {args.output}"
+    )
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import io
+import os
+import json
+import zlib
+import pickle
+import hashlib
+import logging
+from typing import List, Dict
+
+from lazy_imports import lazy_import
+from utils import get_client
+from rate_limits import create_chat_completion, PRIORITY_INTERACTIVE
+from resources import register_resource, get_resource
+from storage import get_storage
+from document_store import get_document_store
+
+# Only loaded once a PDF is actually parsed
+PyPDF2 = lazy_import("PyPDF2")
+
+logger = logging.getLogger(__name__)
+
+PDF_QA_MODEL = "gpt-4"
+# Lower temperature for more factual responses; used for streamed answers too
+PDF_QA_PARAMS = {"max_tokens": 1000, "temperature": 0.3}
+
+
+class PDFProcessor:
+    def __init__(self, backend=None, documents=None):
+        # Extracted text is kept in the shared storage backend so every replica
+        # reuses it, and the document store indexes and reads pages from it;
+        # pdf_cache/ holds entries written before that and is only read
+        self.backend = backend or get_storage()
+        self.documents = documents or get_document_store()
+        self.pdf_cache_dir = "pdf_cache"
+
+    def extract_text_from_pdf(self, pdf_file) -> str:
+        """Extract text from a PDF file; pages that fail to extract are skipped"""
+        try:
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_file.read()))
+            text = ""
+            for page_num, page in enumerate(pdf_reader.pages):
+                try:
+                    page_text = page.extract_text()
+                    text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
+                except Exception as e:
+                    logger.warning("Could not extract text from page %d: %s", page_num + 1, e)
+                    continue
+            return text
+        except Exception as e:
+            raise Exception(f"Error processing PDF {getattr(pdf_file, 'name', 'upload')}: {str(e)}")
+
+    def get_file_hash(self, pdf_file) -> str:
+        """Generate hash for file caching"""
+        pdf_file.seek(0)
+        content = pdf_file.read()
+        pdf_file.seek(0)
+        return hashlib.md5(content).hexdigest()
+
+    def cache_pdf_content(self, file_hash: str, content: str, filename: str):
+        """Cache extracted PDF content"""
+        cache_data = {
+            'content': content,
+            'filename': filename
+        }
+        self.backend.set(f"pdf_text:{file_hash}", zlib.compress(json.dumps(cache_data).encode('utf-8')))
+
+    def load_cached_content(self, file_hash: str) -> Dict:
+        """Load cached PDF content"""
+        data = self.backend.get(f"pdf_text:{file_hash}")
+        if data is not None:
+            return json.loads(zlib.decompress(data).decode('utf-8'))
+        cache_path = os.path.join(self.pdf_cache_dir, f"{file_hash}.pkl")
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                cache_data = pickle.load(f)
+            self.cache_pdf_content(file_hash, cache_data['content'], cache_data['filename'])
+            return cache_data
+        return None
+
+    def process(self, pdf_file, filename=None):
+        """Return (file_hash, text, from_cache) for a PDF, extracting and caching it on first sight"""
+        filename = filename or getattr(pdf_file, 'name', 'document.pdf')
+        file_hash = self.get_file_hash(pdf_file)
+        cached_data = self.load_cached_content(file_hash)
+        if cached_data:
+            return file_hash, cached_data['content'], True
+        text = self.extract_text_from_pdf(pdf_file)
+        if text:
+            self.cache_pdf_content(file_hash, text, filename)
+        return file_hash, text, False
+
+    def get_document(self, file_hash):
+        """DocumentRef for a PDF processed before, or None if it was never seen"""
+        ref = self.documents.get(file_hash)
+        if ref is None:
+            cached_data = self.load_cached_content(file_hash)
+            if cached_data is None:
+                return None
+            ref = self.documents.add(file_hash, cached_data['filename'], cached_data['content'])
+        return ref
+
+    def load_document(self, pdf_file, filename=None):
+        """Return (DocumentRef, from_cache) for a PDF, or (None, False) if it has no text"""
+        filename = filename or getattr(pdf_file, 'name', 'document.pdf')
+        file_hash = self.get_file_hash(pdf_file)
+        ref = self.get_document(file_hash)
+        if ref is not None:
+            return ref._replace(filename=filename), True
+        text = self.extract_text_from_pdf(pdf_file)
+        if not text:
+            return None, False
+        self.cache_pdf_content(file_hash, text, filename)
+        return self.documents.add(file_hash, filename, text), False
+
+
+register_resource("pdf_processor", PDFProcessor, description="PDF text extractor and its cache")
+
+
+def get_pdf_processor() -> PDFProcessor:
+    """Return the process-wide PDF processor"""
+    return get_resource("pdf_processor")
+
+
+def load_document_texts(refs) -> Dict[str, str]:
+    """Resolve DocumentRefs to {filename: text} for a question"""
+    documents = get_document_store()
+    return {ref.filename: documents.read_text(ref.file_hash) for ref in refs}
+
+
+def build_pdf_messages(question: str, pdf_contents: Dict[str, str], chat_history: List = None) -> list:
+    """Chat messages asking question against the given documents only, or None if there is no content"""
+    # Combine all PDF contents
+    combined_content = ""
+    for filename, content in pdf_contents.items():
+        combined_content += f"\n\n=== Content from {filename} ===\n{content}\n"
+
+    if not combined_content.strip():
+        return None
+
+    # Create system prompt
+    system_prompt = f"""You are a helpful assistant that answers questions ONLY based on the provided PDF content.
+
+IMPORTANT RULES:
+1. Only use information from the provided PDF content below
+2. If the answer is not in the PDF content, clearly state "I cannot find this information in the uploaded PDF documents"
+3. Always cite which document/page the information comes from when possible
+4. Be accurate and don't make up information not present in the PDFs
+5. If asked about something not in the PDFs, politely explain that you can only answer based on the uploaded documents
+
+PDF CONTENT:
+{combined_content}
+
+Remember: Answer ONLY based on the above PDF content."""
+
+    # Prepare messages
+    messages = [{"role": "system", "content": system_prompt}]
+
+    # Add chat history if available
+    if chat_history:
+        messages.extend(chat_history)
+
+    # Add current question
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+NO_CONTENT_REPLY = "I don't have any PDF content to answer your question. Please upload some PDF files first."
+
+
+def answer_pdf_question(question: str, pdf_contents: Dict[str, str], chat_history: List = None,
+                        priority=PRIORITY_INTERACTIVE) -> str:
+    """Answer question from pdf_contents only; raises if the request fails"""
+    messages = build_pdf_messages(question, pdf_contents, chat_history)
+    if messages is None:
+        return NO_CONTENT_REPLY
+    response = create_chat_completion(
+        get_client(),
+        priority,
+        model=PDF_QA_MODEL,
+        messages=messages,
+        **PDF_QA_PARAMS
+    )
+    return response.choices[0].message.content
+
+
+def get_pdf_based_response(question: str, pdf_contents: Dict[str, str], chat_history: List = None,
+                           priority=PRIORITY_INTERACTIVE) -> tuple:
+    """Get response based only on PDF content"""
+    if not pdf_contents:
+        return NO_CONTENT_REPLY, chat_history or []
+
+    try:
+        reply = answer_pdf_question(question, pdf_contents, chat_history, priority)
+
+        # Update chat history
+        updated_history = chat_history if chat_history else []
+        updated_history.append({"role": "user", "content": question})
+        updated_history.append({"role": "assistant", "content": reply})
+
+        return reply, updated_history
+
+    except Exception as e:
+        error_msg = f"Error getting response: {str(e)}"
+        return error_msg, chat_history or []
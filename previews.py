@@ -0,0 +1,104 @@
+from PIL import Image, features
+from collections import OrderedDict
+import io
+import os
+import hashlib
+import threading
+import weakref
+
+from storage import get_storage
+
+PREVIEW_MAX_SIDE = 512
+PREVIEW_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+PREVIEW_QUALITY = 80
+# Previews in shared storage expire after this long; an expired one is simply encoded again
+PREVIEW_TTL = float(os.getenv("PREVIEW_TTL_HOURS", "24")) * 3600
+
+MAX_CACHED_PREVIEWS = 256
+MAX_CACHED_DOWNLOADS = 16
+
+
+class _LRUCache:
+    """Small thread-safe LRU shared by every session in the process"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+_previews = _LRUCache(MAX_CACHED_PREVIEWS)
+_downloads = _LRUCache(MAX_CACHED_DOWNLOADS)
+_image_keys = {}
+
+
+def get_image_key(image) -> str:
+    """Content hash of a PIL image, memoised per image object so it is computed once"""
+    entry = _image_keys.get(id(image))
+    if entry is not None and entry[0]() is image:
+        return entry[1]
+    digest = hashlib.md5(f"{image.mode}{image.size}".encode())
+    digest.update(image.tobytes())
+    key = digest.hexdigest()
+    image_id = id(image)
+    _image_keys[image_id] = (weakref.ref(image, lambda _: _image_keys.pop(image_id, None)), key)
+    return key
+
+
+def _preview_key(key, max_side, format):
+    return f"preview:{key}:{max_side}:{format.lower()}"
+
+
+def get_cached_preview(key, max_side=PREVIEW_MAX_SIDE, format=PREVIEW_FORMAT):
+    """Return preview bytes for a key if they exist in memory or in shared storage, else None"""
+    cache_key = (key, max_side, format)
+    preview = _previews.get(cache_key)
+    if preview is None:
+        preview = get_storage().get(_preview_key(key, max_side, format))
+        if preview is not None:
+            _previews.put(cache_key, preview)
+    return preview
+
+
+def get_preview(image, key=None, max_side=PREVIEW_MAX_SIDE, format=PREVIEW_FORMAT, quality=PREVIEW_QUALITY) -> bytes:
+    """Return a downscaled, compressed preview of an image, encoding it only once"""
+    key = key or get_image_key(image)
+    preview = get_cached_preview(key, max_side, format)
+    if preview is not None:
+        return preview
+
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format=format, quality=quality)
+    preview = buffer.getvalue()
+
+    get_storage().set(_preview_key(key, max_side, format), preview, ttl=PREVIEW_TTL)
+    _previews.put((key, max_side, format), preview)
+    return preview
+
+
+def encode_full_resolution(image, key=None, format="PNG") -> bytes:
+    """Encode the full-resolution image for download, reusing recent encodings"""
+    key = key or get_image_key(image)
+    data = _downloads.get((key, format))
+    if data is None:
+        buffer = io.BytesIO()
+        image.save(buffer, format=format)
+        data = buffer.getvalue()
+        _downloads.put((key, format), data)
+    return data
@@ -0,0 +1,461 @@
+from PIL import Image, ImageDraw, ImageFont
+import io
+import os
+import json
+import shutil
+import time
+import hashlib
+import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lazy_imports import lazy_import
+from resources import register_resource, get_resource
+from rate_limits import create_chat_completion, create_images, PRIORITY_STANDARD, PRIORITY_BATCH
+
+openai = lazy_import("openai")
+requests = lazy_import("requests")
+np = lazy_import("numpy")
+# Only needed for MP4 export
+cv2 = lazy_import("cv2")
+
+CHECKPOINT_DIR = "progression_checkpoints"
+
+def encode_image_to_base64(image):
+    """Convert PIL Image to base64 string"""
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    img_str = base64.b64encode(buffered.getvalue()).decode()
+    return img_str
+
+PROGRESSION_STAGES = [
+    "Early stage - initial symptoms barely visible",
+    "Mild progression - early signs becoming apparent",
+    "Moderate progression - clear manifestation of symptoms",
+    "Advanced stage - significant disease presentation",
+    "Severe stage - advanced disease characteristics",
+    "Critical stage - life-threatening complications",
+    "End-stage - irreversible damage",
+    "Terminal stage - palliative care focus"
+]
+
+def get_progression_stages(num_frames=5):
+    """Return the progression stages used for the given number of frames"""
+    return PROGRESSION_STAGES[:num_frames]
+
+def get_checkpoint_dir(disease_info):
+    """Return the checkpoint directory for a disease configuration
+
+    Stage n always uses the same prompt for a given configuration, so checkpoints
+    are shared across runs with different frame counts.
+    """
+    key = hashlib.md5(json.dumps(disease_info, sort_keys=True).encode()).hexdigest()
+    return os.path.join(CHECKPOINT_DIR, key)
+
+def _stage_checkpoint_path(checkpoint_dir, stage_number):
+    return os.path.join(checkpoint_dir, f"stage_{stage_number}.png")
+
+def _label_frame(frame_image, stage, stage_number):
+    return {
+        'image': add_stage_label(frame_image, f"Stage {stage_number}: {stage}"),
+        'stage': stage,
+        'stage_number': stage_number
+    }
+
+def load_checkpointed_frames(disease_info, num_frames=5):
+    """Load frames already generated for this configuration, keyed by stage number"""
+    checkpoint_dir = get_checkpoint_dir(disease_info)
+    frames = {}
+    for i, stage in enumerate(get_progression_stages(num_frames)):
+        path = _stage_checkpoint_path(checkpoint_dir, i+1)
+        if os.path.exists(path):
+            frame_image = Image.open(path)
+            frame_image.load()
+            frames[i+1] = _label_frame(frame_image, stage, i+1)
+    return frames
+
+def get_missing_stages(disease_info, num_frames=5):
+    """Return the stage numbers that have no checkpoint yet"""
+    checkpoint_dir = get_checkpoint_dir(disease_info)
+    return [
+        i+1 for i in range(len(get_progression_stages(num_frames)))
+        if not os.path.exists(_stage_checkpoint_path(checkpoint_dir, i+1))
+    ]
+
+def clear_checkpoints(disease_info):
+    """Discard checkpointed frames so the next run regenerates every stage"""
+    shutil.rmtree(get_checkpoint_dir(disease_info), ignore_errors=True)
+
+class StageCancelled(Exception):
+    """Raised for a stage that had not been requested yet when its job was cancelled"""
+
+def generate_progression_frame(disease_info, stage, stage_number, api_key, cancelled=None):
+    """Generate a single labelled progression frame using DALL-E
+
+    The raw image is checkpointed to disk before labelling so a later run can
+    reuse it instead of paying for the stage again. cancelled, if given, is
+    checked before the paid request is sent.
+    """
+    if cancelled and cancelled():
+        raise StageCancelled(f"Stage {stage_number} was cancelled before it was requested")
+    openai.api_key = api_key
+    prompt = f"""
+    Medical illustration of {disease_info['condition']} - {stage}.
+    Location: {disease_info['location']}
+    
+    Style: Professional medical illustration, clinical photography style,
+    educational medical content, anatomically accurate, clear visualization,
+    medical textbook quality, diagnostic imaging style, healthcare professional standard
+    
+    Show: {disease_info['visual_characteristics']} at {stage}
+    """
+    # Frames are bulk work, so they wait behind interactive requests for the image budget
+    response = create_images(
+        openai,
+        PRIORITY_BATCH,
+        prompt=prompt,
+        model="dall-e-3",
+        size="1024x1024",
+        quality="hd",
+        style="natural",
+        n=1
+    )
+    # Download and store the image
+    img_url = response.data[0].url
+    img_response = requests.get(img_url)
+    img_response.raise_for_status()
+    frame_image = Image.open(io.BytesIO(img_response.content))
+    frame_image.load()
+
+    # Checkpoint atomically so a crash never leaves a truncated stage behind
+    checkpoint_dir = get_checkpoint_dir(disease_info)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = _stage_checkpoint_path(checkpoint_dir, stage_number)
+    frame_image.save(path + ".tmp", format="PNG")
+    os.replace(path + ".tmp", path)
+
+    return _label_frame(frame_image, stage, stage_number)
+
+def generate_disease_progression_frames(disease_info, api_key, num_frames=5, on_frame=None, resume=True, cancelled=None):
+    """Generate frames showing disease progression using DALL-E
+
+    Each stage is checkpointed as it arrives. With resume=True, stages that were
+    already checkpointed are loaded from disk and only the missing ones are
+    generated. If some stages fail, the rest are still checkpointed and the error
+    names the failed stages. on_frame, if given, is called with each frame as
+    soon as it is available. Once cancelled() is true, stages not yet
+    requested are dropped.
+    """
+    try:
+        progression_stages = get_progression_stages(num_frames)
+        if not resume:
+            clear_checkpoints(disease_info)
+        generated_frames = list(load_checkpointed_frames(disease_info, num_frames).values())
+        if on_frame:
+            for frame in generated_frames:
+                on_frame(frame)
+
+        # Generate the missing stages concurrently, then restore stage order
+        missing = get_missing_stages(disease_info, num_frames)
+        failures = []
+        if missing:
+            executor = ThreadPoolExecutor(max_workers=len(missing))
+            try:
+                futures = {
+                    executor.submit(
+                        generate_progression_frame, disease_info,
+                        progression_stages[stage_number-1], stage_number, api_key, cancelled
+                    ): stage_number
+                    for stage_number in missing
+                }
+                for future in as_completed(futures):
+                    try:
+                        frame = future.result()
+                    except Exception as e:
+                        failures.append(f"stage {futures[future]}: {str(e)}")
+                        continue
+                    generated_frames.append(frame)
+                    if on_frame:
+                        on_frame(frame)
+            finally:
+                # On cancellation, stages not yet started are dropped and requests
+                # already sent finish (and checkpoint) without holding up the job
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        if failures:
+            raise Exception(
+                f"{len(failures)} of {len(progression_stages)} stages failed "
+                f"({'; '.join(sorted(failures))}). Completed stages are checkpointed; "
+                f"resume to regenerate only the missing ones"
+            )
+        return sorted(generated_frames, key=lambda frame: frame['stage_number'])
+        
+    except Exception as e:
+        raise Exception(f"Error generating progression frames: {str(e)}")
+
+def run_progression_pipeline(disease_info, api_key, model="gpt-4o", num_frames=5, resume=True, cancelled=None):
+    """Run the analysis and every frame generation concurrently, yielding each result as it lands
+
+    Yields dicts with a 'type' of 'analysis', 'frame' or 'error'. Failed tasks are
+    reported as errors without cancelling the rest of the pipeline. Checkpointed
+    stages are yielded straight from disk when resume is True. Stages not yet
+    requested are dropped once cancelled() is true or the caller stops iterating.
+    """
+    progression_stages = get_progression_stages(num_frames)
+    if not resume:
+        clear_checkpoints(disease_info)
+    for stage_number, frame in sorted(load_checkpointed_frames(disease_info, num_frames).items()):
+        yield {'type': 'frame', 'stage_number': stage_number, 'result': frame}
+
+    missing = get_missing_stages(disease_info, num_frames)
+    executor = ThreadPoolExecutor(max_workers=len(missing) + 1)
+    try:
+        futures = {
+            executor.submit(create_progression_analysis, disease_info, api_key, model): ("analysis", None)
+        }
+        for stage_number in missing:
+            future = executor.submit(
+                generate_progression_frame, disease_info,
+                progression_stages[stage_number-1], stage_number, api_key, cancelled
+            )
+            futures[future] = ("frame", stage_number)
+
+        for future in as_completed(futures):
+            task, stage_number = futures[future]
+            try:
+                yield {'type': task, 'stage_number': stage_number, 'result': future.result()}
+            except Exception as e:
+                yield {'type': 'error', 'task': task, 'stage_number': stage_number, 'error': str(e)}
+    finally:
+        # Reached early when the caller closes the generator after a cancellation
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def load_label_font():
+    """Load the stage label font, falling back to Pillow's built-in font"""
+    try:
+        return ImageFont.truetype("arial.ttf", 24)
+    except OSError:
+        return ImageFont.load_default()
+
+register_resource("label_font", load_label_font, description="Stage label font")
+
+def add_stage_label(image, label_text):
+    """Add stage label to the image"""
+    try:
+        # Create a copy of the image
+        labeled_image = image.copy()
+        draw = ImageDraw.Draw(labeled_image)
+        
+        # Loaded once per process and shared by every frame
+        font = get_resource("label_font")
+        
+        # Calculate text position
+        text_width = draw.textlength(label_text, font=font)
+        text_height = 30
+        x = 10
+        y = 10
+        
+        # Draw background rectangle for text
+        draw.rectangle([x-5, y-5, x+text_width+5, y+text_height+5], fill="black", outline="white")
+        
+        # Draw text
+        draw.text((x, y), label_text, fill="white", font=font)
+        
+        return labeled_image
+        
+    except Exception:
+        return image
+
+def create_progression_analysis(disease_info, api_key, model="gpt-4o"):
+    """Generate detailed analysis of disease progression"""
+    try:
+        openai.api_key = api_key
+        
+        analysis_prompt = f"""
+        As a medical education specialist, provide a comprehensive analysis of {disease_info['condition']} progression:
+
+        **Disease:** {disease_info['condition']}
+        **Location:** {disease_info['location']}
+        **Patient Demographics:** {disease_info.get('demographics', 'General population')}
+
+        Please provide:
+        1. **Disease Overview**: Brief description of the condition
+        2. **Progression Timeline**: Typical timeline from onset to advanced stages
+        3. **Stage-by-Stage Analysis**: Detailed description of each progression stage
+        4. **Visual Changes**: How the appearance changes through each stage
+        5. **Symptoms Evolution**: How symptoms develop and worsen over time
+        6. **Risk Factors**: Factors that accelerate or influence progression
+        7. **Intervention Points**: Key stages where treatment can be most effective
+        8. **Prognosis**: Expected outcomes at different stages
+        9. **Educational Notes**: Important points for patients and healthcare providers
+
+        **Format**: Use clear medical terminology suitable for healthcare professionals while being educational.
+        **Disclaimer**: Include appropriate medical disclaimers about individual variation and professional consultation.
+        """
+        
+        response = create_chat_completion(
+            openai,
+            PRIORITY_STANDARD,
+            model=model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a medical education specialist with expertise in disease progression and pathology. Provide comprehensive, educational analysis for healthcare professionals and medical students."
+                },
+                {
+                    "role": "user",
+                    "content": analysis_prompt
+                }
+            ],
+            max_tokens=2000,
+            temperature=0.1
+        )
+        
+        return response.choices[0].message.content
+        
+    except Exception as e:
+        raise Exception(f"Error generating progression analysis: {str(e)}")
+
+def create_video_from_frames(frames, frame_duration, output_path, fps=1):
+    """Create a video file from a list of PIL Image frames"""
+    try:
+        # Hold each stage for frame_duration seconds at a player-friendly frame rate
+        repeats = max(1, int(round(frame_duration * fps)))
+        first_frame = frames[0]['image']
+        writer = cv2.VideoWriter(
+            output_path,
+            cv2.VideoWriter_fourcc(*'mp4v'),
+            fps,
+            first_frame.size
+        )
+        try:
+            for frame in frames:
+                image = frame['image'].convert('RGB')
+                if image.size != first_frame.size:
+                    image = image.resize(first_frame.size)
+                frame_array = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+                for _ in range(repeats):
+                    writer.write(frame_array)
+        finally:
+            writer.release()
+        
+        return output_path
+    except Exception as e:
+        raise Exception(f"Error creating video: {str(e)}")
+
+def build_shared_palette(images, colors=256, sample_side=128):
+    """Quantize one palette from downscaled copies of every frame
+
+    Using one palette keeps colours stable between stages and avoids a
+    per-frame quantization pass over full-resolution pixels.
+    """
+    montage = Image.new("RGB", (sample_side * len(images), sample_side))
+    for i, image in enumerate(images):
+        sample = image.convert("RGB").resize((sample_side, sample_side), Image.BILINEAR)
+        montage.paste(sample, (i * sample_side, 0))
+    return montage.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+
+def create_animated_export(frames, frame_duration, output_path, format="GIF", dither=True, max_side=768, colors=256):
+    """Create an animated GIF or WebP from progression frames
+
+    All frames share one palette. Frames are resized and quantized lazily while
+    Pillow writes them, so only one converted frame is built at a time.
+    Returns the output path, file size in bytes and encode time in seconds.
+    """
+    try:
+        start_time = time.perf_counter()
+        images = [frame['image'] for frame in frames]
+        size = images[0].size
+        if max_side and max(size) > max_side:
+            scale = max_side / max(size)
+            size = (int(size[0] * scale), int(size[1] * scale))
+        palette = build_shared_palette(images, colors)
+        dither_mode = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+
+        def converted_frames():
+            for image in images:
+                image = image.convert("RGB")
+                if image.size != size:
+                    image = image.resize(size, Image.LANCZOS)
+                quantized = image.quantize(palette=palette, dither=dither_mode)
+                # WebP has no palette mode; lossless RGB keeps the reduced colour set
+                yield quantized if format == "GIF" else quantized.convert("RGB")
+
+        frame_iter = converted_frames()
+        first_frame = next(frame_iter)
+        save_options = {"lossless": True, "method": 4} if format == "WEBP" else {"optimize": False}
+        first_frame.save(
+            output_path,
+            format=format,
+            save_all=True,
+            append_images=frame_iter,
+            duration=int(frame_duration * 1000),
+            loop=0,
+            **save_options
+        )
+        return {
+            'path': output_path,
+            'bytes': os.path.getsize(output_path),
+            'encode_seconds': time.perf_counter() - start_time
+        }
+    except Exception as e:
+        raise Exception(f"Error creating animated {format}: {str(e)}")
+
+def progression_frames_job(ctx, disease_info, api_key, num_frames=5, resume=True):
+    """Background job: generate progression frames, publishing each as it lands"""
+    frames = []
+
+    def on_frame(frame):
+        frames.append(frame)
+        ctx.publish('frames', sorted(frames, key=lambda f: f['stage_number']))
+        ctx.report_progress(len(frames), num_frames, f"Stage {frame['stage_number']} ready")
+        ctx.check_cancelled()
+
+    return generate_disease_progression_frames(
+        disease_info, api_key, num_frames, on_frame=on_frame, resume=resume, cancelled=ctx.cancelled
+    )
+
+def progression_pipeline_job(ctx, disease_info, api_key, model="gpt-4o", num_frames=5, resume=True):
+    """Background job: run the concurrent analysis and frame pipeline"""
+    analysis = None
+    frames = []
+    errors = []
+    total_tasks = num_frames + 1
+    events = run_progression_pipeline(disease_info, api_key, model, num_frames, resume, cancelled=ctx.cancelled)
+    try:
+        for done, event in enumerate(events, start=1):
+            if event['type'] == 'analysis':
+                analysis = event['result']
+                ctx.publish('analysis', analysis)
+            elif event['type'] == 'frame':
+                frames.append(event['result'])
+                frames.sort(key=lambda f: f['stage_number'])
+                ctx.publish('frames', list(frames))
+            else:
+                label = "analysis" if event['task'] == 'analysis' else f"stage {event['stage_number']}"
+                errors.append(f"{label}: {event['error']}")
+                ctx.publish('errors', list(errors))
+            ctx.report_progress(done, total_tasks, f"{done}/{total_tasks} tasks finished")
+            ctx.check_cancelled()
+    finally:
+        # Stops stages that have not been requested yet when the job is cancelled
+        events.close()
+
+    if analysis is None and not frames:
+        raise Exception("; ".join(errors))
+    return {'analysis': analysis, 'frames': frames, 'errors': errors}
+
+def progression_video_job(ctx, frames, frame_duration, output_path):
+    """Background job: encode progression frames into a video file"""
+    ctx.report_progress(0, 1, "Encoding video")
+    start_time = time.perf_counter()
+    create_video_from_frames(frames, frame_duration, output_path)
+    return {
+        'path': output_path,
+        'bytes': os.path.getsize(output_path),
+        'encode_seconds': time.perf_counter() - start_time
+    }
+
+def progression_animation_job(ctx, frames, frame_duration, output_path, format="GIF", dither=True, max_side=768):
+    """Background job: encode progression frames into an animated GIF or WebP"""
+    ctx.report_progress(0, 1, f"Encoding animated {format}")
+    return create_animated_export(frames, frame_duration, output_path, format, dither, max_side)
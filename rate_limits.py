@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import heapq
+import itertools
+import threading
+
+from resources import register_resource, get_resource
+
+# Lower numbers are served first when requests for a model are queued
+PRIORITY_INTERACTIVE = 0
+PRIORITY_STANDARD = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_STANDARD: "standard", PRIORITY_BATCH: "batch"}
+
+# Requests and tokens per minute per model; image models count each image as a
+# request and have no token budget. OPENAI_RATE_LIMITS takes a JSON object in
+# the same shape to match the organisation's actual tier; each entry only needs
+# the values that differ from the model's defaults.
+DEFAULT_RATE_LIMITS = {
+    "gpt-4": {"rpm": 500, "tpm": 10000},
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 200000},
+    "dall-e-3": {"rpm": 7, "tpm": None},
+    "dall-e-2": {"rpm": 50, "tpm": None},
+    "default": {"rpm": 60, "tpm": 30000}
+}
+
+
+def merge_rate_limits(overrides, defaults=DEFAULT_RATE_LIMITS):
+    """Apply per-model overrides on top of the defaults; unknown models start from the default entry"""
+    limits = {model: dict(values) for model, values in defaults.items()}
+    # The default entry goes first so models it covers pick up its overrides too
+    for model in sorted(overrides, key=lambda model: model != "default"):
+        limits[model] = {**limits.get(model, limits["default"]), **overrides[model]}
+    return limits
+
+
+RATE_LIMITS = merge_rate_limits(json.loads(os.getenv("OPENAI_RATE_LIMITS", "{}")))
+# Budgets are per process; with several replicas each one gets an equal share
+RATE_LIMIT_REPLICAS = max(1, int(os.getenv("RATE_LIMIT_REPLICAS", "1")))
+# A request queued for longer than this fails instead of waiting forever
+MAX_QUEUE_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "600"))
+MAX_RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 10
+
+# Token estimates for requests whose size is only known once they complete
+IMAGE_TOKENS_LOW = 85
+IMAGE_TOKENS_HIGH = 765
+DEFAULT_COMPLETION_TOKENS = 1000
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request has waited longer than MAX_QUEUE_WAIT for its turn"""
+
+
+class TokenBucket:
+    """Budget that refills continuously, holding at most one minute's worth"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount, now) -> float:
+        """Seconds until amount is available"""
+        self._refill(now)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def consume(self, amount, now):
+        # May go negative for a request larger than the bucket; later requests wait it off
+        self._refill(now)
+        self.level -= amount
+
+    def refund(self, amount, now):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    """Budget taken for one request, settled against actual usage once it completes"""
+
+    def __init__(self, model, requests, tokens):
+        self.model = model
+        self.requests = requests
+        self.tokens = tokens
+
+
+class _ModelState:
+    def __init__(self, limits):
+        self.requests = TokenBucket(limits["rpm"] / RATE_LIMIT_REPLICAS)
+        self.tokens = TokenBucket(limits["tpm"] / RATE_LIMIT_REPLICAS) if limits.get("tpm") else None
+        self.queue = []
+        self.blocked_until = 0.0
+        self.condition = threading.Condition()
+
+    def wait_time(self, requests, tokens, now, clamp=True):
+        """Seconds until the buckets can pay for a request
+
+        With clamp, a request larger than a bucket only waits for a full bucket,
+        otherwise it could never be served.
+        """
+        if clamp:
+            requests = min(requests, self.requests.capacity)
+        wait = self.requests.time_until(requests, now)
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.time_until(min(tokens, self.tokens.capacity) if clamp else tokens, now))
+        return max(wait, self.blocked_until - now)
+
+
+class RequestScheduler:
+    """Queues OpenAI requests per model so they stay within rate limits
+
+    Each model has a requests-per-minute and a tokens-per-minute token bucket.
+    A request reserves its estimated cost up front and waits in a priority
+    queue until the buckets can pay for it; the estimate is corrected with the
+    reported usage afterwards. A 429 that still gets through pauses the model
+    and the request is queued again instead of failing.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits or RATE_LIMITS
+        self._states = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def _state(self, model) -> _ModelState:
+        with self._lock:
+            state = self._states.get(model)
+            if state is None:
+                state = _ModelState(self.limits.get(model, self.limits["default"]))
+                self._states[model] = state
+            return state
+
+    def acquire(self, model, tokens=0, requests=1, priority=PRIORITY_STANDARD, timeout=MAX_QUEUE_WAIT) -> Reservation:
+        """Block until the model's budget covers the request, then reserve it"""
+        state = self._state(model)
+        ticket = [priority, next(self._sequence), requests, tokens]
+        deadline = time.monotonic() + timeout
+        with state.condition:
+            heapq.heappush(state.queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now >= deadline:
+                        raise RateLimitTimeout(f"Gave up waiting {timeout:.0f}s for the {model} rate limit")
+                    if state.queue[0] is ticket:
+                        wait = state.wait_time(requests, tokens, now)
+                        if wait <= 0:
+                            state.requests.consume(requests, now)
+                            if state.tokens is not None:
+                                state.tokens.consume(tokens, now)
+                            return Reservation(model, requests, tokens)
+                        state.condition.wait(min(wait, deadline - now))
+                    else:
+                        state.condition.wait(deadline - now)
+            finally:
+                state.queue.remove(ticket)
+                heapq.heapify(state.queue)
+                state.condition.notify_all()
+
+    def settle(self, reservation, actual_tokens):
+        """Correct a reservation with the tokens the request actually used"""
+        state = self._state(reservation.model)
+        if state.tokens is None:
+            return
+        with state.condition:
+            now = time.monotonic()
+            difference = reservation.tokens - actual_tokens
+            if difference > 0:
+                state.tokens.refund(difference, now)
+            else:
+                state.tokens.consume(-difference, now)
+            state.condition.notify_all()
+
+    def backoff(self, model, seconds):
+        """Pause a model after the API reported it is over its limit"""
+        state = self._state(model)
+        with state.condition:
+            state.blocked_until = max(state.blocked_until, time.monotonic() + seconds)
+            state.condition.notify_all()
+
+    def run(self, model, request, tokens=0, requests=1, priority=PRIORITY_STANDARD, usage=None):
+        """Call request() within the model's budget, retrying after rate limit errors
+
+        usage(response) returns the tokens the response used, or None if unknown.
+        """
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            reservation = self.acquire(model, tokens, requests, priority)
+            try:
+                response = request()
+            except Exception as e:
+                if getattr(e, "status_code", None) != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                self.backoff(model, _retry_after(e, RATE_LIMIT_BACKOFF * 2 ** attempt))
+                continue
+            used = usage(response) if usage else None
+            if used is not None:
+                self.settle(reservation, used)
+            return response
+
+    def expected_wait(self, model, tokens=DEFAULT_COMPLETION_TOKENS, requests=1, priority=PRIORITY_STANDARD) -> float:
+        """Seconds a new request would wait behind the queued requests it can't overtake"""
+        state = self._state(model)
+        with state.condition:
+            ahead = [ticket for ticket in state.queue if ticket[0] <= priority]
+            return state.wait_time(
+                requests + sum(ticket[2] for ticket in ahead),
+                tokens + sum(ticket[3] for ticket in ahead),
+                time.monotonic(),
+                clamp=False
+            )
+
+    def status(self):
+        """Queue length per priority and expected wait for every model in use"""
+        with self._lock:
+            models = list(self._states)
+        report = []
+        for model in models:
+            state = self._state(model)
+            with state.condition:
+                queued = {name: 0 for name in PRIORITY_NAMES.values()}
+                for ticket in state.queue:
+                    queued[PRIORITY_NAMES.get(ticket[0], "batch")] += 1
+            report.append({
+                "model": model,
+                "queued": queued,
+                "expected_wait": self.expected_wait(model, priority=PRIORITY_BATCH)
+            })
+        return report
+
+
+def _retry_after(error, default):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+
+register_resource("request_scheduler", RequestScheduler, description="Rate-limit-aware OpenAI request queue")
+
+
+def get_scheduler() -> RequestScheduler:
+    """Return the process-wide request scheduler"""
+    return get_resource("request_scheduler")
+
+
+def estimate_chat_tokens(messages, max_tokens=None) -> int:
+    """Rough prompt size (about four characters per token) plus the completion allowance"""
+    tokens = 0
+    for message in messages:
+        tokens += 4
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(part["text"]) // 4
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS_LOW if part["image_url"].get("detail") == "low" else IMAGE_TOKENS_HIGH
+    return tokens + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def create_chat_completion(client, priority=PRIORITY_STANDARD, **params):
+    """client.chat.completions.create through the scheduler
+
+    Streaming responses keep their estimated cost, as usage is only known at the end.
+    """
+    return get_scheduler().run(
+        params["model"],
+        lambda: client.chat.completions.create(**params),
+        tokens=estimate_chat_tokens(params["messages"], params.get("max_tokens")),
+        priority=priority,
+        usage=None if params.get("stream") else _usage_tokens
+    )
+
+
+def create_images(client, priority=PRIORITY_STANDARD, **params):
+    """client.images.generate through the scheduler; each image counts as a request"""
+    return get_scheduler().run(
+        params.get("model", "dall-e-2"),
+        lambda: client.images.generate(**params),
+        requests=params.get("n", 1),
+        priority=priority
+    )
+
+
+def format_expected_wait(seconds) -> str:
+    """Short note for spinners and captions; empty when there is no meaningful wait"""
+    if seconds < 1:
+        return ""
+    if seconds < 90:
+        return f"queued for rate limits, about {seconds:.0f}s"
+    return f"queued for rate limits, about {seconds / 60:.0f} min"
+
+
+def describe_wait(model, priority=PRIORITY_STANDARD, tokens=DEFAULT_COMPLETION_TOKENS, requests=1) -> str:
+    """format_expected_wait for a new request to model at the given priority"""
+    return format_expected_wait(get_scheduler().expected_wait(model, tokens, requests, priority))
@@ -0,0 +1,297 @@
+import os
+import csv
+import io
+import glob
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+from resources import register_resource, get_resource
+
+REPORT_DB_PATH = "reports.db"
+
+REPORT_TYPES = {
+    "medical_analysis": "MEDICAL IMAGE ANALYSIS REPORT",
+    "disease_progression": "DISEASE PROGRESSION ANALYSIS REPORT"
+}
+FACET_FIELDS = ("report_type", "analysis_type", "model", "condition")
+EXPORT_FIELDS = ("id", "report_type", "analysis_type", "model", "condition", "location", "image_hash", "created_at", "body")
+
+# Report files written by the old "Save Report" buttons, picked up by import_legacy_reports
+LEGACY_REPORT_PATTERNS = {
+    "medical_analysis": "medical_analysis_*.txt",
+    "disease_progression": "disease_progression_analysis_*.txt"
+}
+_LEGACY_HEADERS = {
+    "Generated": "created_at",
+    "Analysis Type": "analysis_type",
+    "AI Model": "model",
+    "Disease": "condition",
+    "Location": "location"
+}
+
+
+def _body_hash(body):
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, a trailing * matches a prefix"""
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+
+class ReportStore:
+    """Saved reports with metadata, zlib-compressed bodies and a full-text index
+
+    The FTS5 index is contentless, so report text is stored once (compressed)
+    in the reports table and the index only holds the tokens.
+    """
+
+    def __init__(self, db_path=REPORT_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    id INTEGER PRIMARY KEY,
+                    report_type TEXT NOT NULL,
+                    analysis_type TEXT,
+                    model TEXT,
+                    condition TEXT,
+                    location TEXT,
+                    image_hash TEXT,
+                    created_at REAL NOT NULL,
+                    body BLOB NOT NULL,
+                    body_hash TEXT
+                )
+            """)
+            self._add_body_hashes(conn)
+            for field in (*FACET_FIELDS, "image_hash", "body_hash", "created_at"):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_reports_{field} ON reports ({field})")
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+                    body, condition, location, content='', tokenize='porter unicode61'
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def _add_body_hashes(conn):
+        """Add the body_hash column to databases created before it existed and fill it in"""
+        if "body_hash" in [row[1] for row in conn.execute("PRAGMA table_info(reports)")]:
+            return
+        conn.execute("ALTER TABLE reports ADD COLUMN body_hash TEXT")
+        rows = conn.execute("SELECT id, body FROM reports").fetchall()
+        conn.executemany(
+            "UPDATE reports SET body_hash = ? WHERE id = ?",
+            [(_body_hash(zlib.decompress(body).decode('utf-8')), report_id) for report_id, body in rows]
+        )
+
+    def save(self, body, report_type, analysis_type=None, model=None, condition=None, location=None,
+             image_hash=None, created_at=None) -> int:
+        """Store a report and index it; returns the report id"""
+        if report_type not in REPORT_TYPES:
+            raise ValueError(f"Unknown report type: {report_type}")
+        created_at = time.time() if created_at is None else created_at
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO reports (report_type, analysis_type, model, condition, location, image_hash, created_at, "
+                "body, body_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (report_type, analysis_type, model, condition, location, image_hash, created_at,
+                 zlib.compress(body.encode('utf-8'), 6), _body_hash(body))
+            )
+            conn.execute(
+                "INSERT INTO reports_fts (rowid, body, condition, location) VALUES (?, ?, ?, ?)",
+                (cursor.lastrowid, body, condition or "", location or "")
+            )
+            return cursor.lastrowid
+
+    def delete(self, report_id):
+        report = self.get(report_id)
+        if report is None:
+            return
+        with self._lock, self._connect() as conn:
+            # Contentless FTS5 rows are removed by replaying the indexed values
+            conn.execute(
+                "INSERT INTO reports_fts (reports_fts, rowid, body, condition, location) VALUES ('delete', ?, ?, ?, ?)",
+                (report_id, report["body"], report["condition"] or "", report["location"] or "")
+            )
+            conn.execute("DELETE FROM reports WHERE id = ?", (report_id,))
+
+    def _where(self, query=None, since=None, until=None, **filters):
+        clauses, args = [], []
+        if query and _fts_query(query):
+            clauses.append("id IN (SELECT rowid FROM reports_fts WHERE reports_fts MATCH ?)")
+            args.append(_fts_query(query))
+        for field, value in filters.items():
+            if field not in (*FACET_FIELDS, "image_hash", "body_hash"):
+                raise ValueError(f"Cannot filter reports by {field}")
+            if value is not None:
+                clauses.append(f"{field} = ?")
+                args.append(value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            args.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    @staticmethod
+    def _row_to_report(row):
+        report = dict(row)
+        if "body" in report:
+            report["body"] = zlib.decompress(report["body"]).decode('utf-8')
+        return report
+
+    def search(self, query=None, limit=50, offset=0, **filters):
+        """Newest reports matching a full-text query and facet filters
+
+        Filters are report_type, analysis_type, model, condition, image_hash,
+        body_hash, since and until (timestamps).
+        """
+        where, args = self._where(query, **filters)
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"SELECT * FROM reports{where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (*args, limit, offset)
+            ).fetchall()
+        return [self._row_to_report(row) for row in rows]
+
+    def count(self, query=None, **filters) -> int:
+        where, args = self._where(query, **filters)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM reports{where}", args).fetchone()[0]
+
+    def facets(self, query=None, **filters):
+        """Value counts per facet field for the reports matching the other filters"""
+        facets = {}
+        with self._connect() as conn:
+            for field in FACET_FIELDS:
+                # Each facet ignores its own filter so every option stays selectable
+                where, args = self._where(query, **{k: v for k, v in filters.items() if k != field})
+                facets[field] = conn.execute(
+                    f"SELECT {field}, COUNT(*) FROM reports{where}{' AND' if where else ' WHERE'} {field} IS NOT NULL "
+                    f"GROUP BY {field} ORDER BY COUNT(*) DESC",
+                    args
+                ).fetchall()
+        return facets
+
+    def get(self, report_id):
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+        return self._row_to_report(row) if row else None
+
+    def iter_reports(self, query=None, batch_size=500, **filters):
+        """Yield every matching report, oldest first, a batch at a time"""
+        where, args = self._where(query, **filters)
+        last_id = 0
+        while True:
+            batch_where = f"{where} AND id > ?" if where else " WHERE id > ?"
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                rows = conn.execute(
+                    f"SELECT * FROM reports{batch_where} ORDER BY id LIMIT ?", (*args, last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._row_to_report(row)
+            last_id = rows[-1]["id"]
+
+    def export(self, format="jsonl", query=None, **filters) -> bytes:
+        """Export matching reports as JSONL or CSV"""
+        buffer = io.StringIO()
+        if format == "csv":
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for report in self.iter_reports(query, **filters):
+                writer.writerow(report)
+        elif format == "jsonl":
+            for report in self.iter_reports(query, **filters):
+                buffer.write(json.dumps(report) + "\n")
+        else:
+            raise ValueError(f"Unsupported export format: {format}")
+        return buffer.getvalue().encode('utf-8')
+
+
+register_resource("report_store", ReportStore, description="Saved report index")
+
+
+def get_report_store() -> ReportStore:
+    """Return the process-wide report store"""
+    return get_resource("report_store")
+
+
+def format_report(report) -> str:
+    """Render a stored report in the layout of the old text files"""
+    lines = [REPORT_TYPES[report["report_type"]]]
+    lines.append(f"Generated: {datetime.fromtimestamp(report['created_at']).strftime('%Y-%m-%d %H:%M:%S')}")
+    if report.get("condition"):
+        lines.append(f"Disease: {report['condition']}")
+    if report.get("location"):
+        lines.append(f"Location: {report['location']}")
+    if report.get("analysis_type"):
+        lines.append(f"Analysis Type: {report['analysis_type']}")
+    if report.get("model"):
+        lines.append(f"AI Model: {report['model']}")
+    lines.append("=" * 60)
+    lines.append("")
+    lines.append(report["body"])
+    return "\n".join(lines) + "\n"
+
+
+def parse_legacy_report(text):
+    """Split an old report file into its metadata and body"""
+    metadata = {}
+    header, _, rest = text.partition("\n=")
+    for line in header.splitlines()[1:]:
+        name, _, value = line.partition(":")
+        if name.strip() in _LEGACY_HEADERS and value.strip():
+            metadata[_LEGACY_HEADERS[name.strip()]] = value.strip()
+    body = rest.lstrip("=").strip()
+    # Drop the trailing separator and disclaimer the old files ended with
+    separator = body.rfind("\n" + "=" * 20)
+    if separator != -1:
+        body = body[:separator].rstrip()
+    if "created_at" in metadata:
+        metadata["created_at"] = datetime.strptime(metadata["created_at"], "%Y-%m-%d %H:%M:%S").timestamp()
+    return metadata, body
+
+
+def import_legacy_reports(directory=".", store=None):
+    """Load old timestamped report files into the store; returns the number imported"""
+    store = store or get_report_store()
+    imported = 0
+    for report_type, pattern in LEGACY_REPORT_PATTERNS.items():
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            with open(path, encoding='utf-8') as f:
+                metadata, body = parse_legacy_report(f.read())
+            if metadata.get("created_at") is None:
+                metadata["created_at"] = os.path.getmtime(path)
+            # Re-running the import skips files that are already in the store; two different
+            # reports saved in the same second are both kept
+            if store.count(report_type=report_type, body_hash=_body_hash(body),
+                           since=metadata["created_at"], until=metadata["created_at"] + 1):
+                continue
+            store.save(body, report_type, **metadata)
+            imported += 1
+    return imported
+
+
+if __name__ == "__main__":
+    print(f"Imported {import_legacy_reports()} reports into {REPORT_DB_PATH}")
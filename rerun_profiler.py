@@ -0,0 +1,324 @@
+"""Opt-in rerun profiler for the Streamlit pages
+
+With PROFILE_RERUNS=1 every page times each rerun and the named sections
+inside it, samples the stacks the script thread spends its time in, and
+appends one JSON line per rerun to rerun_profiles/<page>.jsonl. A caption in
+the sidebar shows how long the last rerun took. Reruns cut short by st.rerun()
+or st.stop() are recorded as incomplete when the session's next rerun starts.
+
+    PROFILE_RERUNS=1 streamlit run app.py
+    python rerun_profiler.py                        # summary for every profiled page
+    python rerun_profiler.py rag --top 20           # one page, more stacks
+    python rerun_profiler.py --collapsed stacks.txt # collapsed stacks for flamegraph.pl / speedscope
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_RERUNS = os.getenv("PROFILE_RERUNS", "").lower() in ("1", "true", "yes")
+RERUN_PROFILE_DIR = os.getenv("RERUN_PROFILE_DIR", os.path.join(ROOT_DIR, "rerun_profiles"))
+# Seconds between stack samples of the threads running a profiled rerun
+RERUN_SAMPLE_INTERVAL = float(os.getenv("RERUN_SAMPLE_INTERVAL", "0.005"))
+MAX_STACK_DEPTH = 12
+TOP_STACKS = 10
+
+
+class RerunProfile:
+    def __init__(self, page, session_id):
+        self.page = page
+        self.session_id = session_id
+        self.thread = threading.current_thread()
+        self.thread_id = self.thread.ident
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.sections = []
+        self.open_sections = []
+        self.stacks = Counter()
+        self.samples = 0
+
+    def open_section(self, name):
+        section = {"name": name, "offset": time.perf_counter() - self.start, "seconds": None,
+                   "depth": len(self.open_sections)}
+        self.sections.append(section)
+        self.open_sections.append(section)
+
+    def close_section(self):
+        section = self.open_sections.pop()
+        section["seconds"] = time.perf_counter() - self.start - section["offset"]
+
+    def to_record(self, completed, stacks, samples):
+        """The rerun as a JSON record; stacks and samples are a snapshot taken away from the sampler"""
+        while self.open_sections:
+            self.close_section()
+        return {
+            "page": self.page,
+            "session": self.session_id,
+            "started_at": self.started_at,
+            "seconds": round(time.perf_counter() - self.start, 6),
+            "completed": completed,
+            "sections": [
+                {**section, "offset": round(section["offset"], 6), "seconds": round(section["seconds"], 6)}
+                for section in self.sections
+            ],
+            "samples": samples,
+            # Every sampled stack is kept so --collapsed output is complete; summaries pick the top ones
+            "stacks": stacks.most_common()
+        }
+
+
+_local = threading.local()
+_lock = threading.Lock()
+# Profiles being recorded, by script thread, for the sampler
+_active = {}
+# The last profile each session started, until it is written out
+_unfinished = {}
+_sampler = None
+
+
+def _session_id():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else None
+    except Exception:
+        return None
+
+
+def _frame_label(frame):
+    path = frame.f_code.co_filename
+    if path.startswith(ROOT_DIR):
+        path = os.path.relpath(path, ROOT_DIR)
+    else:
+        path = os.path.basename(path)
+    return f"{path}:{frame.f_code.co_name}:{frame.f_lineno}"
+
+
+def _collapse(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def _sample_loop():
+    while True:
+        time.sleep(RERUN_SAMPLE_INTERVAL)
+        with _lock:
+            profiles = list(_active.values())
+        if not profiles:
+            continue
+        frames = sys._current_frames()
+        for profile in profiles:
+            if not profile.thread.is_alive():
+                # The script thread exited mid-rerun; the rerun is written out when the session returns
+                with _lock:
+                    if _active.get(profile.thread_id) is profile:
+                        del _active[profile.thread_id]
+                continue
+            frame = frames.get(profile.thread_id)
+            if frame is not None:
+                stack = _collapse(frame)
+                with _lock:
+                    # A finished profile is no longer active and must not change while it is written out
+                    if _active.get(profile.thread_id) is profile:
+                        profile.stacks[stack] += 1
+                        profile.samples += 1
+
+
+def _ensure_sampler():
+    global _sampler
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name="rerun-profiler", daemon=True)
+            _sampler.start()
+
+
+def _write_record(record):
+    os.makedirs(RERUN_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(RERUN_PROFILE_DIR, f"{record['page']}.jsonl")
+    with _lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def _finish(profile, completed):
+    with _lock:
+        if _active.get(profile.thread_id) is profile:
+            del _active[profile.thread_id]
+        if _unfinished.get(profile.session_id) is profile:
+            del _unfinished[profile.session_id]
+        stacks, samples = Counter(profile.stacks), profile.samples
+    record = profile.to_record(completed, stacks, samples)
+    try:
+        _write_record(record)
+    except OSError:
+        return None
+    return record
+
+
+def start_rerun_profile(page_file):
+    """Start timing this rerun of page_file; does nothing unless PROFILE_RERUNS is set"""
+    if not PROFILE_RERUNS:
+        return
+    session_id = _session_id()
+    with _lock:
+        previous = _unfinished.get(session_id)
+    if previous is not None:
+        # The previous rerun ended early through st.rerun() or st.stop()
+        _finish(previous, completed=False)
+    profile = RerunProfile(os.path.splitext(os.path.basename(page_file))[0], session_id)
+    _local.profile = profile
+    with _lock:
+        _active[profile.thread_id] = profile
+        _unfinished[session_id] = profile
+    _ensure_sampler()
+
+
+@contextmanager
+def profile_section(name):
+    """Time the enclosed block as a named section of the current rerun"""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        yield
+        return
+    profile.open_section(name)
+    try:
+        yield
+    finally:
+        if profile.open_sections:
+            profile.close_section()
+
+
+def format_rerun_summary(record):
+    """One-line description of a rerun: total time and its slowest section"""
+    summary = f"⏱️ Rerun {record['seconds']:.2f}s"
+    top_level = [section for section in record["sections"] if section["depth"] == 0]
+    if top_level:
+        slowest = max(top_level, key=lambda section: section["seconds"])
+        summary += f" · slowest: {slowest['name']} {slowest['seconds']:.2f}s"
+    return summary
+
+
+def finish_rerun_profile(display=None):
+    """Write out the current rerun's profile and pass its summary line to display"""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return None
+    _local.profile = None
+    record = _finish(profile, completed=True)
+    if record and display:
+        display(format_rerun_summary(record))
+    return record
+
+
+def load_profiles(page, directory=RERUN_PROFILE_DIR):
+    """Every rerun recorded for page, skipping a partially written last line"""
+    records = []
+    path = os.path.join(directory, f"{page}.jsonl")
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return records
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize_page(records, top=TOP_STACKS):
+    """Rerun timings, per-section totals and the hottest stacks across records"""
+    rerun_seconds = [record["seconds"] for record in records]
+    total_seconds = sum(rerun_seconds)
+    sections = defaultdict(list)
+    for record in records:
+        for section in record["sections"]:
+            sections[section["name"]].append(section["seconds"])
+    stacks = Counter()
+    samples = 0
+    for record in records:
+        samples += record["samples"]
+        for stack, count in record["stacks"]:
+            stacks[stack] += count
+    return {
+        "reruns": len(records),
+        "completed": sum(1 for record in records if record["completed"]),
+        "p50_seconds": statistics.median(rerun_seconds),
+        "p95_seconds": _percentile(rerun_seconds, 0.95),
+        "sections": sorted(
+            (
+                {
+                    "name": name, "count": len(seconds), "mean_seconds": statistics.mean(seconds),
+                    "p95_seconds": _percentile(seconds, 0.95),
+                    "share": sum(seconds) / total_seconds if total_seconds else 0.0
+                }
+                for name, seconds in sections.items()
+            ),
+            key=lambda section: section["share"], reverse=True
+        ),
+        "samples": samples,
+        "stacks": stacks.most_common(top)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize recorded Streamlit rerun profiles")
+    parser.add_argument("pages", nargs="*", help="Page names such as app or rag; defaults to every recorded page")
+    parser.add_argument("--dir", default=RERUN_PROFILE_DIR, help="Directory the profiles were written to")
+    parser.add_argument("--top", type=int, default=TOP_STACKS, help="Hot stacks shown per page")
+    parser.add_argument("--collapsed", help="Also write the recorded stacks in collapsed format to this file")
+    args = parser.parse_args()
+
+    pages = args.pages
+    if not pages and os.path.isdir(args.dir):
+        pages = sorted(os.path.splitext(name)[0] for name in os.listdir(args.dir) if name.endswith(".jsonl"))
+    if not pages:
+        print(f"No rerun profiles in {args.dir}; run a page with PROFILE_RERUNS=1 first")
+        return
+
+    all_stacks = Counter()
+    for page in pages:
+        records = load_profiles(page, args.dir)
+        if not records:
+            print(f"{page}: no reruns recorded")
+            continue
+        summary = summarize_page(records, args.top)
+        print(
+            f"{page}: {summary['reruns']} reruns ({summary['completed']} ran to the end), "
+            f"p50 {summary['p50_seconds'] * 1000:.0f} ms, p95 {summary['p95_seconds'] * 1000:.0f} ms"
+        )
+        for section in summary["sections"]:
+            print(
+                f"  {section['name']:<28} x{section['count']:<5} mean {section['mean_seconds'] * 1000:8.1f} ms  "
+                f"p95 {section['p95_seconds'] * 1000:8.1f} ms  {section['share']:6.1%} of rerun time"
+            )
+        if summary["samples"]:
+            print(f"  hottest stacks ({summary['samples']} samples):")
+            for stack, count in summary["stacks"]:
+                print(f"    {count / summary['samples']:6.1%}  {stack.split(';')[-1]}")
+                print(f"            {stack}")
+        for record in records:
+            for stack, count in record["stacks"]:
+                all_stacks[f"{page};{stack}"] += count
+
+    if args.collapsed:
+        with open(args.collapsed, 'w', encoding='utf-8') as f:
+            for stack, count in all_stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Collapsed stacks written to {args.collapsed}")
+
+
+if __name__ == "__main__":
+    main()
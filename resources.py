@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import threading
+
+# Resident set size is read from /proc where available; elsewhere sizes are only
+# reported for resources registered with a size_of function
+_STATM_PATH = "/proc/self/statm"
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _resident_bytes():
+    try:
+        with open(_STATM_PATH) as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Resource:
+    def __init__(self, name, factory, size_of=None, description=""):
+        self.name = name
+        self.factory = factory
+        self.size_of = size_of
+        self.description = description
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded = False
+        self.load_seconds = None
+        self.load_rss_bytes = None
+
+
+class ResourceRegistry:
+    """Process-wide singletons shared by every Streamlit session and job thread
+
+    Each resource is created by its factory on first use, exactly once, under
+    its own lock so a slow load (a model, an index) doesn't block other
+    resources. Sizes come from the resource's size_of function when given,
+    otherwise from the growth of the process RSS while it was loading.
+    """
+
+    def __init__(self):
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, size_of=None, description=""):
+        """Declare a resource; registering the same name again keeps the first declaration"""
+        with self._lock:
+            if name not in self._resources:
+                self._resources[name] = _Resource(name, factory, size_of, description)
+
+    def override(self, name, factory, size_of=None, description=""):
+        """Replace a resource's declaration, dropping any value already created from the old one"""
+        with self._lock:
+            self._resources[name] = _Resource(name, factory, size_of, description)
+
+    def get(self, name):
+        with self._lock:
+            resource = self._resources.get(name)
+        if resource is None:
+            raise KeyError(f"Unknown resource: {name}")
+        if resource.loaded:
+            return resource.value
+        with resource.lock:
+            if not resource.loaded:
+                rss_before = _resident_bytes()
+                start_time = time.perf_counter()
+                resource.value = resource.factory()
+                resource.load_seconds = time.perf_counter() - start_time
+                rss_after = _resident_bytes()
+                if rss_before is not None and rss_after is not None:
+                    resource.load_rss_bytes = max(rss_after - rss_before, 0)
+                resource.loaded = True
+        return resource.value
+
+    def release(self, name):
+        """Drop a loaded resource so the next get() recreates it"""
+        with self._lock:
+            resource = self._resources.get(name)
+        if resource is not None:
+            with resource.lock:
+                resource.value = None
+                resource.loaded = False
+
+    def memory_report(self):
+        """One row per registered resource with its load state, load time and size"""
+        with self._lock:
+            resources = list(self._resources.values())
+        report = []
+        for resource in resources:
+            size = None
+            if resource.loaded:
+                size = resource.size_of(resource.value) if resource.size_of else resource.load_rss_bytes
+            report.append({
+                "name": resource.name,
+                "description": resource.description,
+                "loaded": resource.loaded,
+                "load_seconds": resource.load_seconds,
+                "bytes": size
+            })
+        return report
+
+
+_registry = ResourceRegistry()
+
+
+def register_resource(name, factory, size_of=None, description=""):
+    """Declare a process-wide resource on the shared registry"""
+    _registry.register(name, factory, size_of, description)
+
+
+def override_resource(name, factory, size_of=None, description=""):
+    """Replace a process-wide resource, e.g. with a stand-in for benchmarks"""
+    _registry.override(name, factory, size_of, description)
+
+
+def get_resource(name):
+    """Return a process-wide resource, creating it on first use"""
+    return _registry.get(name)
+
+
+def get_registry() -> ResourceRegistry:
+    return _registry
+
+
+def process_resident_bytes():
+    """Resident memory of the whole process, or None where it cannot be read"""
+    return _resident_bytes()
+
+
+def image_size_of(image) -> int:
+    """Decoded size of a PIL image"""
+    return image.width * image.height * len(image.getbands())
+
+
+def getsizeof_deep(value) -> int:
+    """Rough size of plain containers of bytes, strings and images"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(getsizeof_deep(k) + getsizeof_deep(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(getsizeof_deep(item) for item in value)
+    if hasattr(value, "getbands"):
+        return image_size_of(value)
+    return sys.getsizeof(value)
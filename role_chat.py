@@ -0,0 +1,46 @@
+from utils import get_client
+from rate_limits import create_chat_completion, PRIORITY_INTERACTIVE
+
+ROLE_CHAT_MODEL = "gpt-4"
+
+#Role-Based System Prompts 
+ROLE_PROMPTS = {
+    "Default": "You are a helpful assistant",
+    "Teacher" : "You are an experienced and patient school teacher who explain concepts clearly with examples and encourage learning. Use simple language and break down complex topics into easy-to-understand parts",
+    "Doctor": "You are a professional medical doctor who provides advice based on symptoms. Always remind users to consult with a real healthcare provider for serious concerns. Be informative but responsible.",
+    "Lawyer": "You are a legal expert who explains laws and rights in simple terms. Provide general legal information but always advise users to consult with a qualified attorney for specific legal matters.",
+    "Fitness Coach": "You are a motivating fitness coach who gives health and exercise guidance. Be encouraging, provide practical tips, and always emphasize safety and gradual progress.",
+    "Career Advisor": "You are a career advisor helping people choose jobs and build resumes. Provide practical advice about career development, job searching, and professional growth."
+}
+
+
+def build_role_messages(prompt, chat_history, role):
+    """System prompt for the role, then the history, then the new prompt"""
+    messages = [{"role": "system", "content": ROLE_PROMPTS[role]}]
+    #Add Chat History
+    if chat_history:
+        messages.extend(chat_history)
+
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def get_role_response(prompt, chat_history, role):
+    """Get Response with role-specific system prompt"""
+    messages = build_role_messages(prompt, chat_history, role)
+
+    response = create_chat_completion(
+        get_client(),
+        PRIORITY_INTERACTIVE,
+        model=ROLE_CHAT_MODEL,
+        messages= messages
+    )
+
+    reply = response.choices[0].message.content
+
+    #Update Chat History
+    update_history = chat_history if chat_history else []
+    update_history.append({"role":"user", "content": prompt})
+    update_history.append({"role":"assistant", "content": reply})
+
+    return reply, update_history
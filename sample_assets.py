@@ -0,0 +1,174 @@
+import io
+import os
+import json
+import time
+import hashlib
+import threading
+from PIL import Image, ImageDraw, ImageFilter
+
+from lazy_imports import lazy_import
+from resources import register_resource, get_resource, getsizeof_deep
+
+requests = lazy_import("requests")
+
+SAMPLE_ASSET_DIR = "sample_assets"
+MANIFEST_PATH = os.path.join(SAMPLE_ASSET_DIR, "manifest.json")
+
+# Demo images offered by the medical analyzer (for testing only)
+SAMPLE_IMAGES = {
+    "Sample Skin Lesion": "https://images.unsplash.com/photo-1559757175-3dfc3c8e7e88?w=400",
+    "Sample X-ray": "https://images.unsplash.com/photo-1559757175-7c8e7e88?w=400",
+    "Sample Eye": "https://images.unsplash.com/photo-1574279606130-09958dc756c3?w=400",
+    "Sample Wound": "https://images.unsplash.com/photo-1576091160399-112ba8d25d1f?w=400"
+}
+
+# After a failed download the bundled placeholder is served without retrying for this long
+DOWNLOAD_RETRY_SECONDS = 300
+
+_lock = threading.Lock()
+_download_failed_at = {}
+_prefetch_started = False
+
+# url -> (bytes, decoded image), shared by every session
+register_resource("sample_images", dict, size_of=getsizeof_deep, description="Decoded demo images")
+
+
+def _load_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def _object_path(digest):
+    return os.path.join(SAMPLE_ASSET_DIR, "objects", digest)
+
+
+def get_sample_image_bytes(url) -> bytes:
+    """Return a sample image's bytes, downloading it into the local store only the first time"""
+    with _lock:
+        manifest = _load_manifest()
+        digest = manifest.get(url)
+        if digest and os.path.exists(_object_path(digest)):
+            with open(_object_path(digest), 'rb') as f:
+                return f.read()
+
+    try:
+        response = requests.get(url, timeout=15)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        with _lock:
+            _download_failed_at[url] = time.time()
+        raise Exception(f"Sample image is not in the local store and could not be downloaded: {str(e)}")
+    data = response.content
+    digest = hashlib.sha256(data).hexdigest()
+
+    with _lock:
+        os.makedirs(os.path.dirname(_object_path(digest)), exist_ok=True)
+        if not os.path.exists(_object_path(digest)):
+            with open(_object_path(digest) + ".tmp", 'wb') as f:
+                f.write(data)
+            os.replace(_object_path(digest) + ".tmp", _object_path(digest))
+        manifest = _load_manifest()
+        manifest[url] = digest
+        with open(MANIFEST_PATH + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
+    return data
+
+
+def _draw_placeholder(name):
+    """Synthetic stand-in for a demo image, drawn locally so it needs no download"""
+    if "X-ray" in name:
+        image = Image.new("L", (400, 400), 20)
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((185, 40, 215, 360), fill=200)
+        for y in range(90, 300, 35):
+            draw.arc((90, y - 40, 310, y + 40), 200, 340, fill=170, width=10)
+        return image.filter(ImageFilter.GaussianBlur(3)).convert("RGB")
+    if "Eye" in name:
+        image = Image.new("RGB", (400, 400), (235, 225, 220))
+        draw = ImageDraw.Draw(image)
+        draw.ellipse((60, 120, 340, 280), fill=(250, 250, 248))
+        draw.ellipse((140, 140, 260, 260), fill=(70, 110, 150))
+        draw.ellipse((180, 180, 220, 220), fill=(10, 10, 10))
+        return image.filter(ImageFilter.GaussianBlur(1))
+    image = Image.new("RGB", (400, 400), (225, 180, 150))
+    draw = ImageDraw.Draw(image)
+    if "Wound" in name:
+        draw.ellipse((110, 170, 290, 230), fill=(170, 40, 40))
+        draw.ellipse((130, 185, 270, 215), fill=(200, 90, 80))
+    else:
+        draw.ellipse((160, 150, 250, 240), fill=(95, 60, 40))
+        draw.ellipse((185, 170, 230, 215), fill=(60, 35, 25))
+    return image.filter(ImageFilter.GaussianBlur(2))
+
+
+def _bundled_sample(url):
+    """(bytes, image) for the bundled placeholder of a sample URL"""
+    name = next((name for name, sample_url in SAMPLE_IMAGES.items() if sample_url == url), "")
+    buffer = io.BytesIO()
+    _draw_placeholder(name).save(buffer, format="PNG")
+    data = buffer.getvalue()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return data, image
+
+
+def get_sample_image(url):
+    """Return (bytes, decoded PIL image, bundled) for a sample, decoded once per process and shared by all sessions
+
+    When the sample is not in the local store and cannot be downloaded, a
+    bundled placeholder is returned with bundled=True. The shared image must
+    be treated as read-only.
+    """
+    decoded = get_resource("sample_images")
+    with _lock:
+        cached = decoded.get(url)
+        failed_at = _download_failed_at.get(url)
+    if cached is not None:
+        return (*cached, False)
+    bundled_key = ("bundled", url)
+    if failed_at is None or time.time() - failed_at > DOWNLOAD_RETRY_SECONDS:
+        try:
+            data = get_sample_image_bytes(url)
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            with _lock:
+                decoded[url] = (data, image)
+            return data, image, False
+        except Exception:
+            pass
+    with _lock:
+        cached = decoded.get(bundled_key)
+    if cached is None:
+        cached = _bundled_sample(url)
+        with _lock:
+            decoded[bundled_key] = cached
+    return (*cached, True)
+
+
+def prefetch_sample_images(verbose=True):
+    """Download every sample into the local store so the analyzer works offline"""
+    for name, url in SAMPLE_IMAGES.items():
+        try:
+            get_sample_image_bytes(url)
+            if verbose:
+                print(f"✅ {name}")
+        except Exception as e:
+            if verbose:
+                print(f"❌ {name}: {str(e)}")
+
+
+def start_prefetch():
+    """Download missing samples in the background the first time this is called in a process"""
+    global _prefetch_started
+    with _lock:
+        if _prefetch_started:
+            return
+        _prefetch_started = True
+    threading.Thread(target=prefetch_sample_images, args=(False,), name="sample-prefetch", daemon=True).start()
+
+
+if __name__ == "__main__":
+    prefetch_sample_images()
@@ -0,0 +1,216 @@
+from PIL import Image
+from collections import OrderedDict, namedtuple
+import os
+import time
+import uuid
+import hashlib
+import threading
+import weakref
+
+from previews import get_image_key
+
+SESSION_OBJECT_DIR = "session_objects"
+# Per-session budget for objects held in memory; older objects beyond it are spilled to disk
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET_MB", "128")) * 1024 * 1024
+# Stored objects not written or read for this long, and held by no session in this process, are deleted
+SESSION_OBJECT_MAX_AGE = float(os.getenv("SESSION_OBJECT_MAX_AGE_HOURS", "24")) * 3600
+# Minimum seconds between sweeps of SESSION_OBJECT_DIR
+SWEEP_INTERVAL = 600
+
+# What session state keeps instead of the object itself
+ObjectHandle = namedtuple("ObjectHandle", ["key", "kind", "nbytes"])
+
+_write_lock = threading.Lock()
+_stores = weakref.WeakValueDictionary()
+_last_sweep = 0.0
+
+
+def _object_path(handle):
+    return os.path.join(SESSION_OBJECT_DIR, handle.key[:2], f"{handle.key}.{handle.kind}")
+
+
+def _describe(value):
+    """Return (key, kind, in-memory size) for an image, text or bytes value"""
+    if isinstance(value, Image.Image):
+        return get_image_key(value), "png", value.width * value.height * len(value.getbands())
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+        return hashlib.md5(data).hexdigest(), "txt", len(data)
+    if isinstance(value, (bytes, bytearray)):
+        return hashlib.md5(value).hexdigest(), "bin", len(value)
+    raise TypeError(f"Cannot store {type(value).__name__} in the session store")
+
+
+def _write_object(handle, value):
+    """Write an object to the shared store unless another session already has"""
+    path = _object_path(handle)
+    with _write_lock:
+        if os.path.exists(path):
+            # Still in use, so the sweep leaves it alone
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        if handle.kind == "png":
+            value.save(tmp_path, format="PNG")
+        else:
+            with open(tmp_path, 'wb') as f:
+                f.write(value.encode('utf-8') if handle.kind == "txt" else value)
+        os.replace(tmp_path, path)
+
+
+def _read_object(handle):
+    path = _object_path(handle)
+    if not os.path.exists(path):
+        raise Exception(f"Stored object {handle.key} is missing from {SESSION_OBJECT_DIR}")
+    os.utime(path)
+    if handle.kind == "png":
+        image = Image.open(path)
+        image.load()
+        return image
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data.decode('utf-8') if handle.kind == "txt" else data
+
+
+class SessionStore:
+    """Keeps a session's large objects within a memory budget
+
+    Session state holds ObjectHandles. Objects are written to a shared
+    content-addressed directory and the least recently used ones are dropped
+    from memory once the budget is exceeded, to be read back on next use.
+    """
+
+    def __init__(self, budget_bytes=SESSION_MEMORY_BUDGET):
+        self.budget_bytes = budget_bytes
+        self._resident = OrderedDict()
+        self._resident_bytes = 0
+        self._handles = set()
+        self._spills = 0
+        self._loads = 0
+        self._lock = threading.Lock()
+
+    def put(self, value) -> ObjectHandle:
+        """Store a PIL image, text or bytes and return its handle"""
+        key, kind, nbytes = _describe(value)
+        handle = ObjectHandle(key, kind, nbytes)
+        _write_object(handle, value)
+        with self._lock:
+            self._handles.add(handle)
+            self._make_resident(handle, value)
+        return handle
+
+    def get(self, handle):
+        """Return the object behind a handle, reading it back from disk if it was spilled"""
+        with self._lock:
+            if handle in self._resident:
+                self._resident.move_to_end(handle)
+                return self._resident[handle]
+        value = _read_object(handle)
+        with self._lock:
+            self._loads += 1
+            self._make_resident(handle, value)
+        return value
+
+    def release(self, handle):
+        """Forget a handle; the shared file stays for other sessions"""
+        with self._lock:
+            self._handles.discard(handle)
+            if handle in self._resident:
+                del self._resident[handle]
+                self._resident_bytes -= handle.nbytes
+
+    def _make_resident(self, handle, value):
+        if handle not in self._resident:
+            self._resident_bytes += handle.nbytes
+        self._resident[handle] = value
+        self._resident.move_to_end(handle)
+        # Every object is already on disk, so spilling only drops the in-memory copy
+        while self._resident_bytes > self.budget_bytes and self._resident:
+            spilled, _ = self._resident.popitem(last=False)
+            self._resident_bytes -= spilled.nbytes
+            self._spills += 1
+
+    def memory_usage(self):
+        """Resident and spilled totals for this session"""
+        with self._lock:
+            return {
+                "resident_bytes": self._resident_bytes,
+                "resident_objects": len(self._resident),
+                "spilled_bytes": sum(h.nbytes for h in self._handles if h not in self._resident),
+                "spilled_objects": len(self._handles) - len(self._resident),
+                "budget_bytes": self.budget_bytes,
+                "spills": self._spills,
+                "loads": self._loads
+            }
+
+
+def purge_session_objects(older_than=SESSION_OBJECT_MAX_AGE) -> int:
+    """Delete stored objects untouched for older_than seconds that no live session here holds
+
+    Objects are shared by content, so age is measured from the last write or
+    read by any session. Returns the number of files deleted.
+    """
+    if not os.path.isdir(SESSION_OBJECT_DIR):
+        return 0
+    held = set()
+    for store in list(_stores.values()):
+        with store._lock:
+            held.update(_object_path(handle) for handle in store._handles)
+    cutoff = time.time() - older_than
+    deleted = 0
+    for directory, _, filenames in os.walk(SESSION_OBJECT_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if path in held:
+                continue
+            with _write_lock:
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        deleted += 1
+                except OSError:
+                    continue
+    return deleted
+
+
+def _maybe_sweep():
+    global _last_sweep
+    with _write_lock:
+        if time.time() - _last_sweep < SWEEP_INTERVAL:
+            return
+        _last_sweep = time.time()
+    threading.Thread(target=purge_session_objects, name="session-object-sweep", daemon=True).start()
+
+
+def get_session_store(session_state) -> SessionStore:
+    """Return the store for a Streamlit session, creating it on first use
+
+    New sessions also start a sweep of expired objects, at most every SWEEP_INTERVAL.
+    """
+    store = session_state.get('_session_store')
+    if store is None:
+        store = SessionStore()
+        session_state['_session_store'] = store
+        _stores[uuid.uuid4().hex] = store
+        _maybe_sweep()
+    return store
+
+
+def get_process_memory_usage():
+    """Sum of memory_usage() over every live session in this process"""
+    usages = [store.memory_usage() for store in list(_stores.values())]
+    return {
+        "sessions": len(usages),
+        "resident_bytes": sum(usage["resident_bytes"] for usage in usages),
+        "spilled_bytes": sum(usage["spilled_bytes"] for usage in usages)
+    }
+
+
+def format_memory_usage(usage) -> str:
+    """One-line summary of a session's memory_usage() for the sidebar"""
+    megabyte = 1024 * 1024
+    return (
+        f"🧠 Session memory: {usage['resident_bytes'] / megabyte:.1f} / {usage['budget_bytes'] / megabyte:.0f} MB "
+        f"in memory, {usage['spilled_objects']} objects ({usage['spilled_bytes'] / megabyte:.1f} MB) spilled to disk"
+    )
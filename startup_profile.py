@@ -0,0 +1,116 @@
+"""Cold-start profiler for the Streamlit pages
+
+Runs every page once in a fresh interpreter with `-X importtime` and reports
+how long the first load took and which imports it spent that time on.
+Streamlit's own import is measured separately and not charged to the page.
+
+    python startup_profile.py                  # breakdown for every page
+    python startup_profile.py pages/rag.py     # one page
+    python startup_profile.py --check          # exit 1 if a page is over budget
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGES = ["app.py"] + sorted(
+    os.path.join("pages", name) for name in os.listdir(os.path.join(ROOT_DIR, "pages")) if name.endswith(".py")
+)
+# Seconds a page may take to load on top of importing streamlit
+COLD_START_BUDGET = float(os.getenv("COLD_START_BUDGET_SECONDS", "1.5"))
+PAGE_MARKER = "--- page start ---"
+
+# Executed in the child interpreter; the page runs through Streamlit's script
+# runner exactly as it would on first load, without a browser
+_DRIVER = f"""
+import sys, time, json
+start = time.perf_counter()
+import streamlit
+from streamlit.testing.v1 import AppTest
+streamlit_seconds = time.perf_counter() - start
+sys.stderr.write({PAGE_MARKER!r} + "\\n")
+sys.stderr.flush()
+start = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=120).run()
+page_seconds = time.perf_counter() - start
+print(json.dumps({{
+    "streamlit_seconds": streamlit_seconds,
+    "page_seconds": page_seconds,
+    "exceptions": [str(e.value) for e in app.exception]
+}}))
+"""
+
+
+def parse_importtime(stderr, top=10):
+    """Cumulative import time per top-level import made after the page marker"""
+    _, _, page_output = stderr.partition(PAGE_MARKER)
+    imports = []
+    for line in page_output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented two spaces per level below their parent
+        if len(name) - len(name.lstrip()) == 1:
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return {
+        "import_seconds": sum(seconds for _, seconds in imports),
+        "top_imports": imports[:top]
+    }
+
+
+def profile_page(page, top=10):
+    """Load a page once in a fresh interpreter and return its timings"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _DRIVER, page],
+        cwd=ROOT_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0 or not result.stdout.strip():
+        raise Exception(f"Error profiling {page}: {result.stderr.strip().splitlines()[-1:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings.update(parse_importtime(result.stderr, top))
+    timings["page"] = page
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time of each Streamlit page")
+    parser.add_argument("pages", nargs="*", default=PAGES)
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET, help="Seconds allowed per page")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 if any page exceeds the budget")
+    parser.add_argument("--top", type=int, default=8, help="Imports listed per page")
+    parser.add_argument("--json", action="store_true", help="Print raw timings as JSON")
+    args = parser.parse_args()
+
+    results = []
+    over_budget = []
+    for page in args.pages:
+        timings = profile_page(page, args.top)
+        results.append(timings)
+        if timings["page_seconds"] > args.budget:
+            over_budget.append(page)
+        if args.json:
+            continue
+        status = "OVER BUDGET" if page in over_budget else "ok"
+        print(
+            f"{page}: {timings['page_seconds']:.2f}s first load "
+            f"({timings['import_seconds']:.2f}s imports, streamlit {timings['streamlit_seconds']:.2f}s) [{status}]"
+        )
+        for name, seconds in timings["top_imports"]:
+            print(f"    {seconds * 1000:8.1f} ms  {name}")
+        for exception in timings["exceptions"]:
+            print(f"    page raised: {exception}")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    if args.check and over_budget:
+        print(f"{len(over_budget)} page(s) over the {args.budget:.2f}s budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
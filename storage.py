@@ -0,0 +1,334 @@
+import os
+import time
+import sqlite3
+from urllib.parse import urlparse
+
+from lazy_imports import lazy_import
+from resources import register_resource, get_resource
+
+redis = lazy_import("redis", optional=True)
+fakeredis = lazy_import("fakeredis", optional=True)
+
+# sqlite:///path/to/file.db for a single host, redis://host:port/db to share
+# state between replicas, fakeredis:// for a local in-process Redis stand-in
+STORAGE_URL = os.getenv("STORAGE_URL", "sqlite:///shared_state.db")
+KEY_PREFIX = os.getenv("STORAGE_KEY_PREFIX", "genai:")
+# Minimum seconds between deletions of expired rows from the SQLite backend
+EXPIRY_SWEEP_INTERVAL = 600
+
+
+class StorageBackend:
+    """Key-value, hash, set and sorted-set operations shared by every cache and store
+
+    The operations mirror Redis so the same code runs against the local SQLite
+    backend and a Redis server. Values are bytes; hash fields and set members
+    are strings.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None) -> bool:
+        """Set key only if it does not exist yet; returns whether it was set"""
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def exists(self, key) -> bool:
+        return self.get(key) is not None
+
+    def hset(self, key, mapping):
+        raise NotImplementedError
+
+    def hset_if_exists(self, key, field, mapping) -> bool:
+        """hset only if the hash already has field, atomically; returns whether it was set"""
+        raise NotImplementedError
+
+    def hgetall(self, key):
+        raise NotImplementedError
+
+    def hgetall_many(self, keys):
+        return [self.hgetall(key) for key in keys]
+
+    def sadd(self, key, *members):
+        raise NotImplementedError
+
+    def srem(self, key, *members):
+        raise NotImplementedError
+
+    def smembers_many(self, keys):
+        raise NotImplementedError
+
+    def sinter(self, keys):
+        sets = self.smembers_many(keys)
+        return set.intersection(*sets) if sets else set()
+
+    def zadd(self, key, member, score):
+        raise NotImplementedError
+
+    def zrem(self, key, member):
+        raise NotImplementedError
+
+    def zrevrange(self, key, offset=0, limit=None):
+        """Members from highest to lowest score"""
+        raise NotImplementedError
+
+    def zcard(self, key) -> int:
+        raise NotImplementedError
+
+
+class SQLiteBackend(StorageBackend):
+    """Single-host backend; several worker processes on one machine can share the file"""
+
+    def __init__(self, db_path="shared_state.db"):
+        self.db_path = db_path
+        self._last_expiry_sweep = 0.0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_kv_expires ON kv (expires_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS hashes (key TEXT, field TEXT, value TEXT, PRIMARY KEY (key, field))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS sets (key TEXT, member TEXT, PRIMARY KEY (key, member))")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS zsets (key TEXT, member TEXT, score REAL, PRIMARY KEY (key, member))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_zsets_score ON zsets (key, score)")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def _expiry(ttl):
+        return time.time() + ttl if ttl else None
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        with self._connect() as conn:
+            rows = dict(conn.execute(
+                f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(keys))}) "
+                f"AND (expires_at IS NULL OR expires_at > ?)",
+                (*keys, time.time())
+            ).fetchall())
+        return [rows.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, self._expiry(ttl))
+            )
+            # Expired rows are hidden from reads but only deleted here, at most every EXPIRY_SWEEP_INTERVAL
+            if ttl and time.time() - self._last_expiry_sweep > EXPIRY_SWEEP_INTERVAL:
+                self._last_expiry_sweep = time.time()
+                conn.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def add(self, key, value, ttl=None) -> bool:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, self._expiry(ttl))
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, *keys):
+        with self._connect() as conn:
+            for table in ("kv", "hashes", "sets", "zsets"):
+                conn.executemany(f"DELETE FROM {table} WHERE key = ?", [(key,) for key in keys])
+
+    def hset(self, key, mapping):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                [(key, field, str(value)) for field, value in mapping.items()]
+            )
+
+    def hset_if_exists(self, key, field, mapping) -> bool:
+        with self._connect() as conn:
+            # The write lock is taken up front so the hash can't be deleted in between
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM hashes WHERE key = ? AND field = ?", (key, field)).fetchone() is None:
+                return False
+            conn.executemany(
+                "INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                [(key, name, str(value)) for name, value in mapping.items()]
+            )
+            return True
+
+    def hgetall(self, key):
+        return self.hgetall_many([key])[0]
+
+    def hgetall_many(self, keys):
+        if not keys:
+            return []
+        hashes = {key: {} for key in keys}
+        with self._connect() as conn:
+            for key, field, value in conn.execute(
+                f"SELECT key, field, value FROM hashes WHERE key IN ({','.join('?' * len(keys))})", keys
+            ):
+                hashes[key][field] = value
+        return [hashes[key] for key in keys]
+
+    def sadd(self, key, *members):
+        with self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO sets (key, member) VALUES (?, ?)", [(key, m) for m in members])
+
+    def srem(self, key, *members):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM sets WHERE key = ? AND member = ?", [(key, m) for m in members])
+
+    def smembers_many(self, keys):
+        if not keys:
+            return []
+        sets = {key: set() for key in keys}
+        with self._connect() as conn:
+            for key, member in conn.execute(
+                f"SELECT key, member FROM sets WHERE key IN ({','.join('?' * len(keys))})", keys
+            ):
+                sets[key].add(member)
+        return [sets[key] for key in keys]
+
+    def zadd(self, key, member, score):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO zsets (key, member, score) VALUES (?, ?, ?)", (key, member, score))
+
+    def zrem(self, key, member):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM zsets WHERE key = ? AND member = ?", (key, member))
+
+    def zrevrange(self, key, offset=0, limit=None):
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT member FROM zsets WHERE key = ? ORDER BY score DESC LIMIT ? OFFSET ?",
+                (key, -1 if limit is None else limit, offset)
+            )]
+
+    def zcard(self, key) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM zsets WHERE key = ?", (key,)).fetchone()[0]
+
+
+class RedisBackend(StorageBackend):
+    """Backend shared by every replica; works with redis-py or any client with its interface"""
+
+    def __init__(self, client, prefix=KEY_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        return self.prefix + key
+
+    @staticmethod
+    def _text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def get(self, key):
+        return self.client.get(self._key(key))
+
+    def get_many(self, keys):
+        return self.client.mget([self._key(key) for key in keys]) if keys else []
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self._key(key), value, ex=int(ttl) if ttl else None)
+
+    def add(self, key, value, ttl=None) -> bool:
+        return bool(self.client.set(self._key(key), value, ex=int(ttl) if ttl else None, nx=True))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self._key(key) for key in keys])
+
+    def exists(self, key) -> bool:
+        return bool(self.client.exists(self._key(key)))
+
+    def hset(self, key, mapping):
+        self.client.hset(self._key(key), mapping={field: str(value) for field, value in mapping.items()})
+
+    def hset_if_exists(self, key, field, mapping) -> bool:
+        name = self._key(key)
+
+        def update(pipe):
+            # WATCH makes the transaction fail if the hash changes after this check
+            if not pipe.hexists(name, field):
+                return False
+            pipe.multi()
+            pipe.hset(name, mapping={item: str(value) for item, value in mapping.items()})
+            return True
+
+        return self.client.transaction(update, name, value_from_callable=True)
+
+    def hgetall(self, key):
+        return {self._text(f): self._text(v) for f, v in self.client.hgetall(self._key(key)).items()}
+
+    def hgetall_many(self, keys):
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hgetall(self._key(key))
+        return [{self._text(f): self._text(v) for f, v in result.items()} for result in pipeline.execute()]
+
+    def sadd(self, key, *members):
+        if members:
+            self.client.sadd(self._key(key), *members)
+
+    def srem(self, key, *members):
+        if members:
+            self.client.srem(self._key(key), *members)
+
+    def smembers_many(self, keys):
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.smembers(self._key(key))
+        return [{self._text(member) for member in result} for result in pipeline.execute()]
+
+    def sinter(self, keys):
+        return {self._text(member) for member in self.client.sinter([self._key(key) for key in keys])} if keys else set()
+
+    def zadd(self, key, member, score):
+        self.client.zadd(self._key(key), {member: score})
+
+    def zrem(self, key, member):
+        self.client.zrem(self._key(key), member)
+
+    def zrevrange(self, key, offset=0, limit=None):
+        stop = -1 if limit is None else offset + limit - 1
+        return [self._text(member) for member in self.client.zrevrange(self._key(key), offset, stop)]
+
+    def zcard(self, key) -> int:
+        return self.client.zcard(self._key(key))
+
+
+def create_backend(url=STORAGE_URL) -> StorageBackend:
+    """Build a backend from a storage URL"""
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteBackend(url[len("sqlite:///"):] or "shared_state.db")
+    if parsed.scheme in ("redis", "rediss"):
+        if redis is None:
+            raise Exception("STORAGE_URL points at Redis but the redis package is not installed")
+        return RedisBackend(redis.Redis.from_url(url))
+    if parsed.scheme == "fakeredis":
+        if fakeredis is None:
+            raise Exception("fakeredis:// needs the fakeredis package")
+        return RedisBackend(fakeredis.FakeRedis())
+    raise ValueError(f"Unsupported storage URL: {url}")
+
+
+register_resource("storage_backend", create_backend, description=f"Shared storage ({urlparse(STORAGE_URL).scheme})")
+
+
+def get_storage() -> StorageBackend:
+    """Return the process-wide storage backend"""
+    return get_resource("storage_backend")
@@ -0,0 +1,336 @@
+import io
+import os
+import math
+import uuid
+import time
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lazy_imports import lazy_import
+from medical_analysis import analyze_medical_image, prepare_image_for_vision, window_to_8bit
+from rate_limits import create_chat_completion, PRIORITY_BATCH
+from jobs import JOB_RETENTION_SECONDS
+
+np = lazy_import("numpy")
+openai = lazy_import("openai")
+openslide = lazy_import("openslide", optional=True)
+
+TILED_INPUT_DIR = "tiled_inputs"
+TILE_SIZE = 1024
+OVERVIEW_SIZE = 1024
+MAX_GRID = 16
+# Upper bound on pixels decoded at once when a format has no lazy region reader
+MAX_DECODED_PIXELS = 64_000_000
+# Overview pixels brighter than this are treated as slide background
+BACKGROUND_LEVEL = 220
+
+
+class TileCancelled(Exception):
+    """Raised for a tile that had not been requested yet when its job was cancelled"""
+
+
+class OpenSlideReader:
+    """Lazy region reads from whole-slide formats through OpenSlide"""
+
+    def __init__(self, path):
+        self.slide = openslide.OpenSlide(path)
+        self.size = self.slide.dimensions
+
+    def overview(self, max_side=OVERVIEW_SIZE):
+        return self.slide.get_thumbnail((max_side, max_side)).convert("RGB")
+
+    def read_region(self, box, out_size):
+        x0, y0, x1, y1 = box
+        level = self.slide.get_best_level_for_downsample(max((x1 - x0) / out_size[0], 1))
+        downsample = self.slide.level_downsamples[level]
+        region_size = (math.ceil((x1 - x0) / downsample), math.ceil((y1 - y0) / downsample))
+        region = self.slide.read_region((x0, y0), level, region_size).convert("RGB")
+        return region.resize(out_size, Image.LANCZOS)
+
+    def close(self):
+        self.slide.close()
+
+
+class PillowReader:
+    """Pillow fallback that decodes the image once, never beyond MAX_DECODED_PIXELS
+
+    Pillow can only decode most formats whole, so tiles are cropped from that
+    one decode. Large JPEGs are decoded in draft mode at a reduced scale; other
+    formats are refused beyond MAX_DECODED_PIXELS.
+    """
+
+    def __init__(self, path):
+        try:
+            image = Image.open(path)
+        except Image.DecompressionBombError:
+            raise Exception(
+                f"{os.path.basename(path)} is too large for Pillow to open; "
+                f"install openslide-python for lazy region reads"
+            )
+        # The file is only needed until the image has been decoded below
+        with image:
+            self.size = image.size
+            width, height = image.size
+            if width * height > MAX_DECODED_PIXELS:
+                if image.format != "JPEG":
+                    raise Exception(
+                        f"{image.format} image of {width}x{height} is too large to decode in memory; "
+                        f"install openslide-python for lazy region reads"
+                    )
+                # draft() picks the largest reduction that still covers the requested
+                # size, which can be up to twice as large on each side
+                scale = math.sqrt(MAX_DECODED_PIXELS / (4 * width * height))
+                image.draft("RGB", (max(1, int(width * scale)), max(1, int(height * scale))))
+                # JPEG draft mode can only reduce by up to 8x
+                if image.size[0] * image.size[1] > MAX_DECODED_PIXELS:
+                    raise Exception(f"JPEG of {width}x{height} is too large even at 1/8 scale")
+            self.image = window_to_8bit(image).convert("RGB")
+            self.scale = self.image.width / width
+
+    def overview(self, max_side=OVERVIEW_SIZE):
+        overview = self.image.copy()
+        overview.thumbnail((max_side, max_side), Image.LANCZOS)
+        return overview
+
+    def read_region(self, box, out_size):
+        scaled_box = tuple(int(round(coordinate * self.scale)) for coordinate in box)
+        return self.image.crop(scaled_box).resize(out_size, Image.LANCZOS)
+
+    def close(self):
+        self.image.close()
+
+
+def open_region_reader(path):
+    """Open the most memory-efficient reader available for a file"""
+    if openslide is not None:
+        try:
+            return OpenSlideReader(path)
+        except (ImportError, OSError):
+            # openslide-python is installed but its native library is missing
+            pass
+        except openslide.OpenSlideError:
+            pass
+    return PillowReader(path)
+
+
+def select_informative_tiles(reader, max_tiles=12):
+    """Score a tile grid on the overview and return the most informative tile boxes
+
+    A tile's score is the share of non-background pixels times its texture, so
+    empty slide background and flat regions are skipped.
+    """
+    width, height = reader.size
+    tile_extent = max(TILE_SIZE, math.ceil(max(width, height) / MAX_GRID))
+    overview = np.asarray(reader.overview().convert("L"), dtype=np.float64)
+    scale_x = overview.shape[1] / width
+    scale_y = overview.shape[0] / height
+
+    scored = []
+    for y in range(0, height, tile_extent):
+        for x in range(0, width, tile_extent):
+            box = (x, y, min(x + tile_extent, width), min(y + tile_extent, height))
+            cell = overview[
+                int(box[1] * scale_y):max(int(box[3] * scale_y), int(box[1] * scale_y) + 1),
+                int(box[0] * scale_x):max(int(box[2] * scale_x), int(box[0] * scale_x) + 1)
+            ]
+            tissue = float(np.mean(cell < BACKGROUND_LEVEL))
+            score = tissue * float(np.std(cell))
+            if score > 0:
+                scored.append((score, box))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [box for _, box in scored[:max_tiles]]
+
+
+def _tile_output_size(box):
+    width, height = box[2] - box[0], box[3] - box[1]
+    scale = min(1.0, TILE_SIZE / max(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _analyze_tile(reader, index, box, total, analysis_type, api_key, model, cancelled=None):
+    if cancelled and cancelled():
+        raise TileCancelled(f"Tile {index} was cancelled before it was requested")
+    tile = reader.read_region(box, _tile_output_size(box))
+    context = (
+        f"This is tile {index} of {total} from a much larger image, covering pixels "
+        f"{box[0]}-{box[2]} horizontally and {box[1]}-{box[3]} vertically. "
+        f"Report only findings visible in this tile, concisely."
+    )
+    analysis = analyze_medical_image(tile, analysis_type, api_key, model, extra_context=context, priority=PRIORITY_BATCH)
+    thumbnail = tile.copy()
+    thumbnail.thumbnail((256, 256))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=80)
+    return {"index": index, "box": box, "analysis": analysis, "thumbnail": buffer.getvalue(), "error": None}
+
+
+def summarize_tile_findings(overview, tile_results, analysis_type, api_key, model="gpt-4o"):
+    """Merge per-tile findings into one report, with the overview image for context"""
+    try:
+        openai.api_key = api_key
+        prepared = prepare_image_for_vision(overview, analysis_type)
+        findings = "\n\n".join(
+            f"Tile {result['index']} (region {result['box']}):\n"
+            f"{'Not examined; the request for this tile failed' if result.get('error') else result['analysis']}"
+            for result in sorted(tile_results, key=lambda r: r['index'])
+        )
+        prompt = f"""
+        The attached image is a downscaled overview of a very large medical image. The most
+        informative regions were analyzed separately at full detail; their findings follow.
+
+        {findings}
+
+        Merge these into one structured report:
+        1. **Overall Observations**: What the image shows as a whole
+        2. **Key Regional Findings**: Significant findings and which tiles they came from
+        3. **Potential Conditions**: What the combined findings could indicate
+        4. **Recommended Actions**: What the healthcare provider should consider
+        5. **Limitations**: Regions not examined and the limits of tiled AI analysis
+
+        IMPORTANT: This is for educational/assistance purposes only. Always consult with qualified medical professionals for diagnosis and treatment.
+        """
+        response = create_chat_completion(
+            openai,
+            PRIORITY_BATCH,
+            model=model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a medical AI assistant designed to help healthcare professionals analyze medical images. Provide detailed, structured analysis while emphasizing the importance of professional medical consultation. Always include disclaimers about the limitations of AI analysis."
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": prepared["data_url"], "detail": prepared["detail"]}}
+                    ]
+                }
+            ],
+            max_tokens=1500,
+            temperature=0.1
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        raise Exception(f"Error summarizing tile findings: {str(e)}")
+
+
+def run_tiled_analysis(path, analysis_type, api_key, model="gpt-4o", max_tiles=12, max_workers=4, on_tile=None,
+                       cancelled=None, completed=None):
+    """Analyze the most informative tiles of a large image concurrently, then summarize
+
+    Tiles are read inside the worker threads, so at most max_workers tiles are
+    decoded at a time on top of the reader's own bounded footprint. Once
+    cancelled() is true, tiles not yet requested are dropped. A tile whose
+    request fails is recorded with its error rather than failing the analysis.
+    completed holds tile results from an earlier run of the same analysis;
+    tiles analyzed there without an error are reused instead of sent again.
+    """
+    reader = open_region_reader(path)
+    try:
+        boxes = select_informative_tiles(reader, max_tiles)
+        if not boxes:
+            raise Exception("No informative regions found in the image")
+        reusable = {tuple(result['box']): result for result in completed or [] if not result.get('error')}
+        tile_results = []
+        for i, box in enumerate(boxes):
+            if box in reusable:
+                result = dict(reusable[box], index=i + 1)
+                tile_results.append(result)
+                if on_tile:
+                    on_tile(result, len(boxes))
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {
+                executor.submit(
+                    _analyze_tile, reader, i + 1, box, len(boxes), analysis_type, api_key, model, cancelled
+                ): (i + 1, box)
+                for i, box in enumerate(boxes) if box not in reusable
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except TileCancelled:
+                    raise
+                except Exception as e:
+                    index, box = futures[future]
+                    result = {"index": index, "box": box, "analysis": None, "thumbnail": None, "error": str(e)}
+                tile_results.append(result)
+                if on_tile:
+                    on_tile(result, len(boxes))
+        finally:
+            # Queued tiles are dropped on failure or cancellation; the ones in
+            # flight are waited for, as they still read from the reader
+            executor.shutdown(wait=True, cancel_futures=True)
+        failed = [result for result in tile_results if result['error']]
+        if len(failed) == len(tile_results):
+            raise Exception(f"Every tile failed; the first error was: {failed[0]['error']}")
+        summary = summarize_tile_findings(reader.overview(), tile_results, analysis_type, api_key, model)
+        return {
+            "summary": summary,
+            "tiles": sorted(tile_results, key=lambda r: r['index']),
+            "failed_tiles": len(failed),
+            "image_size": reader.size
+        }
+    finally:
+        reader.close()
+
+
+def purge_uploaded_images(older_than=JOB_RETENTION_SECONDS):
+    """Delete uploads left behind by jobs that never completed, once their job records have expired"""
+    if not os.path.isdir(TILED_INPUT_DIR):
+        return
+    cutoff = time.time() - older_than
+    for filename in os.listdir(TILED_INPUT_DIR):
+        path = os.path.join(TILED_INPUT_DIR, filename)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+def save_uploaded_image(uploaded_file) -> str:
+    """Stream an uploaded file to disk so it can be read region by region
+
+    Each upload gets its own file, so concurrent uploads of the same name
+    don't overwrite each other; only the extension is kept, for format detection.
+    """
+    purge_uploaded_images()
+    os.makedirs(TILED_INPUT_DIR, exist_ok=True)
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    path = os.path.join(TILED_INPUT_DIR, f"{uuid.uuid4().hex}{extension}")
+    uploaded_file.seek(0)
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: uploaded_file.read(1 << 20), b""):
+            f.write(chunk)
+    return path
+
+
+def tiled_analysis_job(ctx, path, analysis_type, api_key, model="gpt-4o", max_tiles=12, max_workers=4,
+                       delete_input=False):
+    """Background job: tiled analysis, publishing each tile's findings as they land
+
+    With delete_input, path is an upload and is deleted once the job completes;
+    it is kept after a failure or cancellation so the job can be resumed. The
+    published tiles double as checkpoints: a resumed job only sends the tiles
+    that are missing or failed.
+    """
+    previous = ctx.published('tiles') or []
+    tiles = []
+
+    def on_tile(result, total):
+        tiles.append(result)
+        ctx.publish('tiles', sorted(tiles, key=lambda r: r['index']))
+        ctx.report_progress(len(tiles), total + 1, f"{len(tiles)}/{total} tiles analyzed")
+        ctx.check_cancelled()
+
+    result = run_tiled_analysis(
+        path, analysis_type, api_key, model, max_tiles, max_workers, on_tile=on_tile, cancelled=ctx.cancelled,
+        completed=previous
+    )
+    if delete_input:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return result
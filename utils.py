@@ -1,18 +1,43 @@
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
 
+from lazy_imports import lazy_import
+from resources import register_resource, get_resource
+from rate_limits import create_chat_completion, PRIORITY_INTERACTIVE
+
+openai = lazy_import("openai")
+
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+register_resource(
+    "openai_client",
+    lambda: openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY")),
+    description="OpenAI client and its connection pool"
+)
+
+def get_client():
+    """Return the shared OpenAI client, created (and openai imported) on first use"""
+    return get_resource("openai_client")
+
+CHAT_MODEL = "gpt-4"
 
 def get_openai_response(prompt, chat_history=None):
     message = chat_history if chat_history else[]
     message.append({"role":"user","content":prompt})
 
-    response = client.chat.completions.create(
-        model = "gpt-4",
+    response = create_chat_completion(
+        get_client(),
+        PRIORITY_INTERACTIVE,
+        model = CHAT_MODEL,
         messages=message
     )
     reply = response.choices[0].message.content
     message.append({"role":"assistant","content":reply})
     return reply,message
+
+def stream_chat_reply(messages, model=CHAT_MODEL, priority=PRIORITY_INTERACTIVE, **params):
+    """Yield the reply to messages piece by piece as the model writes it"""
+    stream = create_chat_completion(get_client(), priority, model=model, messages=messages, stream=True, **params)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content